@@ -0,0 +1,131 @@
+import threading
+
+import numpy
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+
+class AllianceIncidence:
+    """
+    The match schedule as a sparse alliance by team matrix
+
+    Each row is one alliance in one match and each column is a team. An entry holds the driver station
+    the team is scheduled at, so the matrix is OPR's design matrix and a full decode of the schedule
+    at the same time. AllianceAssociations are only ever appended, so each event's schedule is
+    decoded once and later refreshes just add the associations stored since.
+    """
+
+    def __init__(self):
+        # Appending happens on whichever worker thread asks for the schedule first
+        self.lock = threading.RLock()
+        # Largest AllianceAssociation id that has been added
+        self.last_id = 0
+        # match_id -> match index, (match_id, Alliance) -> row and team_id -> column
+        self.match_index = {}
+        self.alliance_index = {}
+        self.team_index = {}
+        # The inverse maps, by row and by column
+        self.alliance_keys = []
+        self.team_ids = []
+        # (column, driver station) entries of every row, in driver station order
+        self.rows = []
+        self.matrix = None
+        self.frame = None
+
+    def add_associations(self, associations):
+        """
+
+        Adds AllianceAssociations to the schedule, skipping any that were added before.
+
+        :param associations: Rows with id, match_id, alliance, team_id and driver_station, ordered by id
+        :type associations: Iterable
+        :return: How many associations were added
+        :rtype: int
+        """
+        added = 0
+        with self.lock:
+            for association in associations:
+                if association.id <= self.last_id:
+                    continue
+                self.last_id = association.id
+                if not association.team_id:
+                    continue
+
+                self.match_index.setdefault(association.match_id, len(self.match_index))
+                key = (association.match_id, association.alliance)
+                if key not in self.alliance_index:
+                    self.alliance_index[key] = len(self.alliance_keys)
+                    self.alliance_keys.append(key)
+                    self.rows.append([])
+                if association.team_id not in self.team_index:
+                    self.team_index[association.team_id] = len(self.team_ids)
+                    self.team_ids.append(association.team_id)
+
+                row = self.rows[self.alliance_index[key]]
+                row.append((self.team_index[association.team_id], association.driver_station))
+                row.sort(key=lambda entry: entry[1])
+                added += 1
+
+            if added:
+                self.matrix = None
+                self.frame = None
+        return added
+
+    def get_matrix(self):
+        """
+
+        Gets the schedule as a CSR matrix, rebuilt from the decoded rows only after associations were added.
+
+        :return: An alliance by team matrix of driver stations
+        :rtype: scipy.sparse.csr_matrix
+        """
+        with self.lock:
+            if self.matrix is None:
+                indptr = numpy.cumsum([0] + [len(row) for row in self.rows])
+                indices = [column for row in self.rows for column, _ in row]
+                stations = [station for row in self.rows for _, station in row]
+                self.matrix = csr_matrix(
+                    (
+                        numpy.array(stations, dtype=numpy.int8),
+                        numpy.array(indices, dtype=numpy.int32),
+                        indptr,
+                    ),
+                    shape=(len(self.rows), len(self.team_ids)),
+                )
+            return self.matrix
+
+    def get_teams(self, row):
+        """
+
+        Gets the teams of an alliance in driver station order.
+
+        :param row: Row of the alliance, from alliance_index
+        :type row: int
+        :rtype: List[str]
+        """
+        matrix = self.get_matrix()
+        columns = matrix.indices[matrix.indptr[row] : matrix.indptr[row + 1]]
+        return [self.team_ids[column] for column in columns]
+
+    def to_frame(self):
+        """
+
+        Gets the schedule with one row per scheduled robot.
+
+        The returned DataFrame is shared between callers and must not be modified in place.
+
+        :return: A Dataframe with match_id, alliance, driver_station and team_id
+        :rtype: pandas.DataFrame
+        """
+        with self.lock:
+            if self.frame is None:
+                matrix = self.get_matrix().tocoo()
+                self.frame = pd.DataFrame(
+                    {
+                        "match_id": [self.alliance_keys[row][0] for row in matrix.row],
+                        "alliance": [self.alliance_keys[row][1] for row in matrix.row],
+                        "driver_station": matrix.data.astype(int),
+                        "team_id": [self.team_ids[column] for column in matrix.col],
+                    }
+                )
+            return self.frame
@@ -0,0 +1,490 @@
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from Config import Config, create_sqlite_engine
+from DataAccessor import DataAccessor
+from DataCalculator import DataCalculator
+from DataExporter import DataExporter
+from DataInput import DataInput
+from DataProcessor import DataProcessor
+from EventGenerator import EventGenerator, event_sizes
+from ResponseCache import CachedResponse
+from SQLObjects import (
+    Alliance,
+    AllianceAssociation,
+    Base,
+    ClimbType,
+    MatchDatum,
+    TeamDatum,
+    flatten_json,
+    match_data_map,
+    match_datum_extractor,
+    team_datum_json_from_submission,
+)
+from datetime import datetime
+import pytz
+
+
+def flattened_match_datum_row(match_json):
+    """
+    Builds a match_data row the old way, by flattening the whole TBA match first
+    """
+    flat = flatten_json(match_json)
+    row = {
+        "match_id": flat["key"],
+        "event_key": flat["event_key"],
+        "winning_alliance": Alliance(flat["winning_alliance"] or "NA"),
+        "time": datetime.fromtimestamp(flat["time"], pytz.utc),
+        "actual_time": datetime.fromtimestamp(flat["actual_time"], pytz.utc),
+        "post_result_time": datetime.fromtimestamp(flat["post_result_time"], pytz.utc),
+    }
+    for letter, color in zip(["r", "b"], ["red", "blue"]):
+        for robot in range(1, 4):
+            row[f"{letter}_endgame_{robot}"] = ClimbType(
+                flat[f"score_breakdown.{color}.endgameRobot{robot}"].lower()
+            )
+    for letter, color in zip(["r", "b"], ["red", "blue"]):
+        for key, value in match_data_map.items():
+            column = f"{letter}_{key}"
+            if column in MatchDatum.__table__.columns:
+                row[column] = flat[f"score_breakdown.{color}.{value}"]
+    return row
+
+
+def benchmark_match_extraction(path="./data/2022week0.json", number=200):
+    """
+
+    Times building match_data rows with flatten_json against the compiled extractor.
+
+    :param path: A TBA match list to extract
+    :type path: str
+    :param number: How many times to extract the whole list
+    :type number: int
+    :return: Seconds per pass for each approach and the speedup
+    :rtype: Dict[str, float]
+    """
+    with open(path) as f:
+        matches = json.load(f)
+
+    # Both approaches have to produce the same rows for the comparison to mean anything
+    expected = [flattened_match_datum_row(match) for match in matches]
+    if match_datum_extractor.extract_rows(matches) != expected:
+        raise AssertionError("The extractor does not match flatten_json")
+
+    flattened = min(
+        timeit.repeat(
+            lambda: [flattened_match_datum_row(match) for match in matches],
+            number=number,
+            repeat=5,
+        )
+    ) / number
+    extracted = min(
+        timeit.repeat(
+            lambda: match_datum_extractor.extract_rows(matches),
+            number=number,
+            repeat=5,
+        )
+    ) / number
+    return {
+        "matches": len(matches),
+        "flatten_json_seconds": flattened,
+        "extractor_seconds": extracted,
+        "speedup": flattened / extracted,
+    }
+
+
+class SyntheticDataInput(DataInput):
+    """Serves one event of generated events instead of TBA, with matches after played_matches not played yet"""
+
+    def __init__(self, synthetic_event, *args, **kwargs):
+        self.synthetic_event = synthetic_event
+        # Counts the matches of every generated event, in the order they are played
+        self.played_matches = 0
+        super().__init__(*args, **kwargs)
+
+    def get_tba_response(self, url, headers=None, load_body=True):
+        matches = self.synthetic_event["matches"]
+        if url.endswith("/matches"):
+            played = [
+                match for match in matches[: self.played_matches] if match["event_key"] == self.event
+            ]
+            body = played + [
+                {
+                    **match,
+                    "actual_time": None,
+                    "post_result_time": None,
+                    "score_breakdown": None,
+                    "winning_alliance": "",
+                }
+                for match in matches[self.played_matches :]
+                if match["event_key"] == self.event
+            ]
+            validator = f'"{len(played)}"'
+        else:
+            body = sorted(
+                {
+                    team
+                    for match in matches
+                    if match["event_key"] == self.event
+                    for alliance in match["alliances"].values()
+                    for team in alliance["team_keys"]
+                }
+            )
+            validator = f'"{len(body)}"'
+        return CachedResponse(200, json.dumps(body).encode(), validator)
+
+
+class StageRecorder:
+    """Measures the wall time, query count and peak Python memory of benchmark stages"""
+
+    def __init__(self, engine, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.queries = 0
+        event.listen(engine, "before_cursor_execute", self.count_query)
+
+    def count_query(self, *args):
+        self.queries += 1
+
+    def measure(self, stage):
+        """
+
+        Runs a stage and measures it.
+
+        :param stage: The stage to run
+        :type stage: Callable[[], None]
+        :return: The seconds, queries and peak memory in bytes of the stage
+        :rtype: Dict[str, float]
+        """
+        self.queries = 0
+        if self.trace_memory:
+            tracemalloc.start()
+        start_time = time.perf_counter()
+        stage()
+        measurement = {
+            "seconds": time.perf_counter() - start_time,
+            "queries": self.queries,
+        }
+        if self.trace_memory:
+            measurement["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return measurement
+
+
+def explain(connection, statement, parameters):
+    """
+
+    Asks the database how it would run a query.
+
+    :param connection: A connection to the database
+    :type connection: sqlalchemy.engine.Connection
+    :param statement: The SQL the query was sent as
+    :type statement: str
+    :param parameters: The parameters the query was sent with
+    :return: The steps of the plan and whether any of them reads a whole table
+    :rtype: Tuple[List[str], bool]
+    """
+    cursor = connection.connection.cursor()
+    try:
+        if connection.dialect.name == "sqlite":
+            cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            plan = [row[-1] for row in cursor.fetchall()]
+            full_scan = any(
+                step.startswith("SCAN") and "CONSTANT ROW" not in step for step in plan
+            )
+        else:
+            cursor.execute(f"EXPLAIN {statement}", parameters)
+            columns = [column[0] for column in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            plan = [f"{row['table']}: {row['type']} using {row['key']}" for row in rows]
+            # ALL reads every row of the table and index every entry of an index
+            full_scan = any(row["type"] in ("ALL", "index") for row in rows)
+    finally:
+        cursor.close()
+    return plan, full_scan
+
+
+def check_query_plans(engine, data_accessor):
+    """
+
+    Explains the queries DataAccessor runs on its hot lookup paths and fails if any of them reads a whole table.
+
+    The queries are made for rows that are already stored, so the database has to be populated.
+    Every lookup runs on a clone of data_accessor with empty caches, so none of them is served from memory.
+
+    :param engine: Engine of the database to check
+    :type engine: sqlalchemy.engine.Engine
+    :param data_accessor: A DataAccessor for the database
+    :type data_accessor: DataAccessor.DataAccessor
+    :return: The plan of every query each lookup ran
+    :rtype: Dict[str, List[Dict]]
+    """
+    team_datum = data_accessor.session.query(TeamDatum).first()
+    association = data_accessor.session.query(AllianceAssociation).first()
+    if team_datum is None or association is None:
+        raise ValueError("The query plans can only be checked on a populated database")
+
+    lookups = {
+        "team datum by match, team and alliance": lambda accessor: accessor.get_team_data(
+            match_id=team_datum.match_id, team_id=team_datum.team_id, alliance=team_datum.alliance
+        ),
+        "team data by team": lambda accessor: accessor.get_team_data(team_id=team_datum.team_id),
+        "alliance associations by match": lambda accessor: accessor.get_alliance_associations(
+            match_id=association.match_id
+        ),
+        "alliance associations by team": lambda accessor: accessor.get_alliance_associations(
+            team_id=association.team_id
+        ),
+        "stored alliance associations": lambda accessor: accessor.add_alliance_associations(
+            [
+                {
+                    "match_id": association.match_id,
+                    "alliance": association.alliance,
+                    "team_id": association.team_id,
+                    "driver_station": association.driver_station,
+                    "event_key": association.event_key,
+                }
+            ]
+        ),
+        "warnings by match, alliance and category": lambda accessor: accessor.get_warnings(
+            match_id=team_datum.match_id,
+            alliance=team_datum.alliance,
+            category="Endgame Status Violations",
+        ),
+        "match datum by match": lambda accessor: accessor.get_match_datum(team_datum.match_id),
+        "predictions by scout and match": lambda accessor: accessor.get_predictions(
+            scout_id=team_datum.scout_id, match_id=team_datum.match_id
+        ),
+        "last match datum of an event": lambda accessor: accessor.get_last_match_datum(
+            team_datum.event_key
+        ),
+        "team data of an event": lambda accessor: accessor.get_all_team_data_df(team_datum.event_key),
+        "match data of an event": lambda accessor: accessor.get_all_match_data_df(team_datum.event_key),
+    }
+
+    plans = {}
+    full_scans = []
+    uncaptured = []
+    for name, lookup in lookups.items():
+        accessor = data_accessor.clone(data_accessor.session)
+        accessor.reset_caches()
+        queries = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith("SELECT"):
+                queries.append((statement, parameters))
+
+        event.listen(engine, "before_cursor_execute", capture)
+        try:
+            lookup(accessor)
+        finally:
+            event.remove(engine, "before_cursor_execute", capture)
+
+        if not queries:
+            uncaptured.append(name)
+        plans[name] = []
+        with engine.connect() as connection:
+            for statement, parameters in queries:
+                plan, full_scan = explain(connection, statement, parameters)
+                plans[name].append({"query": statement, "plan": plan, "full_scan": full_scan})
+                if full_scan:
+                    full_scans.append(f"{name}: {'; '.join(plan)}")
+
+    if uncaptured:
+        raise AssertionError("No queries were captured for: " + ", ".join(uncaptured))
+    if full_scans:
+        raise AssertionError("Hot queries read whole tables:\n" + "\n".join(full_scans))
+    return plans
+
+
+def benchmark_refresh(
+    engine, size="regional", seed=0, steps=5, step_size=6, trace_memory=True
+):
+    """
+
+    Plays a generated event through DataInput, DataProcessor, DataCalculator and DataExporter and measures every stage.
+
+    Every match but the last steps * step_size is played in one full refresh, then the rest are
+    played step_size matches at a time with incremental refreshes, like the ingest sees during an event.
+    Each generated event gets its own DataInput, and their match lists are fetched at the same time.
+    Afterwards check_query_plans makes sure the hot lookups are served by indexes.
+    Every table in the database is dropped first.
+
+    :param engine: Engine of the database to run against
+    :type engine: sqlalchemy.engine.Engine
+    :param size: Event size from EventGenerator.event_sizes
+    :type size: str
+    :param seed: Seed for the generated event
+    :type seed: int
+    :param steps: How many incremental refreshes to run
+    :type steps: int
+    :param step_size: How many matches are played before each incremental refresh
+    :type step_size: int
+    :param trace_memory: Whether to trace peak memory, which slows every stage down
+    :type trace_memory: bool
+    :return: The benchmark settings and the measurements of every refresh
+    :rtype: Dict
+    """
+    synthetic_event = EventGenerator(seed).generate(size)
+    matches = synthetic_event["matches"]
+    submissions = defaultdict(list)
+    for submission in synthetic_event["submissions"]:
+        submissions[submission["match_key"]].append(submission)
+
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+
+    event_keys = sorted({match["event_key"] for match in matches})
+    config = Config(logger, True)
+    config.year = "2022"
+    config.event = ",".join(event_key[len(config.year):] for event_key in event_keys)
+    config.simulator_url = "synthetic"
+    config.cache_dir = tempfile.mkdtemp()
+
+    recorder = StageRecorder(engine, trace_memory)
+    fetch_executor = ThreadPoolExecutor(max_workers=len(event_keys))
+    components = {}
+
+    def load():
+        components["data_accessor"] = DataAccessor(engine, session, None, config)
+        components["data_inputs"] = [
+            SyntheticDataInput(
+                synthetic_event,
+                engine,
+                session,
+                None,
+                components["data_accessor"],
+                config,
+                event=event_key,
+            )
+            for event_key in event_keys
+        ]
+        components["data_processor"] = DataProcessor(components["data_accessor"], config)
+        components["data_calculator"] = DataCalculator(
+            engine, session, None, components["data_accessor"], config
+        )
+        components["data_exporter"] = DataExporter(components["data_accessor"], tempfile.mkdtemp())
+
+    results = {
+        "size": size,
+        "seed": seed,
+        "events": len(event_keys),
+        "teams": len(synthetic_event["teams"]),
+        "matches": len(matches),
+        "submissions": len(synthetic_event["submissions"]),
+        "database": engine.url.drivername,
+        "python": platform.python_version(),
+        "trace_memory": trace_memory,
+        "created": datetime.now(pytz.utc).isoformat(),
+        "load": recorder.measure(load),
+        "refreshes": [],
+    }
+    data_accessor = components["data_accessor"]
+    data_inputs = components["data_inputs"]
+
+    def submit(played_matches):
+        for match in matches[data_inputs[0].played_matches : played_matches]:
+            for submission in submissions[match["key"]]:
+                data_accessor.add_team_datum(
+                    team_id=submission["team_number"],
+                    scout_id=submission["scout_id"],
+                    match_id=submission["match_key"],
+                    alliance=Alliance(submission["alliance"]),
+                    driver_station=submission["driver_station"],
+                    team_datum_json=team_datum_json_from_submission(submission),
+                )
+
+    def get_data():
+        # Like DataManager.get_data, fetching concurrently and storing one event at a time
+        fetched = list(
+            fetch_executor.map(lambda data_input: data_input.fetch_new_matches(), data_inputs)
+        )
+        for data_input, (status_code, occurred_data) in zip(data_inputs, fetched):
+            data_input.store_matches(occurred_data)
+        session.commit()
+
+    def check():
+        components["data_processor"].check_data()
+        session.commit()
+
+    first_played = max(len(matches) - steps * step_size, 1)
+    played = [first_played] + list(
+        range(first_played + step_size, len(matches) + step_size, step_size)
+    )[:steps]
+    for index, played_matches in enumerate(played):
+        full = index == 0
+        played_matches = min(played_matches, len(matches))
+        stages = {"submit": recorder.measure(lambda: submit(played_matches))}
+        for data_input in data_inputs:
+            data_input.played_matches = played_matches
+        stages["get_data"] = recorder.measure(get_data)
+        stages["check_data"] = recorder.measure(check)
+        stages["calculate_data"] = recorder.measure(
+            lambda: components["data_calculator"].calculate_team_data(full=full)
+        )
+        stages["export_data"] = recorder.measure(components["data_exporter"].export)
+        results["refreshes"].append(
+            {
+                "kind": "full" if full else "incremental",
+                "played_matches": played_matches,
+                "stages": stages,
+            }
+        )
+        logger.info(
+            f"{'Full' if full else 'Incremental'} refresh at {played_matches} matches: "
+            + ", ".join(f"{stage}: {m['seconds']:.2f}s" for stage, m in stages.items())
+        )
+
+    results["query_plans"] = check_query_plans(engine, data_accessor)
+    fetch_executor.shutdown()
+    session.close()
+    return results
+
+
+def get_arg(name, default=None):
+    if name in sys.argv[1:]:
+        return sys.argv[sys.argv.index(name) + 1]
+    return default
+
+
+if __name__ == "__main__":
+    if "refresh" in sys.argv[1:]:
+        # The benchmark drops every table, so it never falls back to the configured database
+        database_url = get_arg("--database-url", "sqlite://")
+        size = get_arg("--size", "regional")
+        if size not in event_sizes:
+            print(f"--size has to be one of {', '.join(event_sizes)}")
+            sys.exit(1)
+        seed = int(get_arg("--seed", 0))
+        results = benchmark_refresh(
+            create_sqlite_engine(database_url)
+            if database_url.startswith("sqlite")
+            else create_engine(database_url),
+            size=size,
+            seed=seed,
+            steps=int(get_arg("--steps", 5)),
+            step_size=int(get_arg("--step-size", 6)),
+            trace_memory="--no-memory" not in sys.argv[1:],
+        )
+        output = get_arg(
+            "--output",
+            f"./benchmark_results/refresh-{size}-{seed}-{datetime.now():%Y%m%d-%H%M%S}.json",
+        )
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        with open(output, "w") as f:
+            json.dump(results, f, indent=4)
+        print(f"Saved results to {output}")
+    else:
+        print(json.dumps(benchmark_match_extraction(), indent=4))
@@ -6,10 +6,14 @@ import pymysql
 import requests
 import urllib3
 from rich.syntax import Syntax
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import StaticPool
 
 from terminal import console
 
+# URLs of SQLite databases that only exist inside the process that opened them
+in_memory_sqlite_urls = ("sqlite://", "sqlite:///:memory:")
+
 
 class Config:
     def __init__(self, logger, simulation):
@@ -25,7 +29,14 @@ class Config:
         self.simulator_url = None
         self.db_user = None
         self.db_pwd = None
+        self.db_pool_size = None
+        self.db_max_overflow = None
+        self.db_pool_recycle = None
         self.event = None
+        self.event_poll_intervals = {}
+        self.database_url = None
+        self.cache_dir = None
+        self.snapshot_dir = None
         self.connected_to_internet = True
 
         self.refresh()
@@ -41,13 +52,93 @@ class Config:
         self.db_user = os.getenv("MYSQL_USER")
         self.db_pwd = os.getenv("MYSQL_PASSWORD")
         self.db_host = os.getenv("MYSQL_HOST")
+        self.db_pool_size = int(os.getenv("DB_POOL_SIZE", 5))
+        self.db_max_overflow = int(os.getenv("DB_MAX_OVERFLOW", 10))
+        self.db_pool_recycle = int(os.getenv("DB_POOL_RECYCLE", 3600))
         self.event = os.getenv("EVENT")
+        # How often TBA is polled for each event, as comma separated event=seconds pairs
+        self.event_poll_intervals = {
+            event.strip(): float(seconds)
+            for event, seconds in (
+                pair.split("=") for pair in os.getenv("EVENT_POLL_INTERVALS", "").split(",") if pair.strip()
+            )
+        }
+        self.database_url = os.getenv("DATABASE_URL")
+        self.cache_dir = os.getenv("CACHE_DIR", "./cache")
+        self.snapshot_dir = os.getenv("SNAPSHOT_DIR", "./snapshots")
 
         if validate:
             return self.validate()
         else:
             return None
 
+    def get_database_url(self):
+        """
+
+        Gets the database to connect to, DATABASE_URL if it is set and the MySQL scouting database otherwise.
+
+        :return: A SQLAlchemy database URL
+        :rtype: str
+        """
+        if self.database_url:
+            return self.database_url
+        return f"mysql+pymysql://{self.db_user}:{self.db_pwd}@{self.db_host}/scouting"
+
+    def get_event_keys(self):
+        """
+
+        Gets the TBA keys of the events to ingest. EVENT can list several events separated by commas.
+
+        :return: Event keys with the year in front
+        :rtype: List[str]
+        """
+        if self.event is None:
+            return []
+        return [self.year + event.strip() for event in self.event.split(",") if event.strip()]
+
+    def get_poll_interval(self, event_key, default):
+        """
+
+        Gets how often TBA should be polled for an event.
+
+        :param event_key: Event key with the year in front
+        :type event_key: str
+        :param default: Interval for events without one in EVENT_POLL_INTERVALS
+        :type default: float
+        :return: Seconds between polls
+        :rtype: float
+        """
+        return self.event_poll_intervals.get(event_key[len(self.year):], default)
+
+    def uses_sqlite(self):
+        return self.get_database_url().startswith("sqlite")
+
+    def get_engine(self):
+        """
+
+        Creates the database engine with a bounded connection pool.
+
+        Connections are checked for liveness before use and recycled before MySQL's idle timeout.
+        In-memory SQLite is refused, since its one shared connection would let the check and calculate
+        sessions end each other's transactions.
+
+        :return: A SQLAlchemy engine
+        :rtype: sqlalchemy.engine.Engine
+        """
+        if self.uses_sqlite():
+            if self.get_database_url() in in_memory_sqlite_urls:
+                raise ValueError(
+                    "An in-memory SQLite database can only be used by the benchmark, set DATABASE_URL to a file"
+                )
+            return create_sqlite_engine(self.get_database_url())
+        return create_engine(
+            self.get_database_url(),
+            pool_size=self.db_pool_size,
+            max_overflow=self.db_max_overflow,
+            pool_recycle=self.db_pool_recycle,
+            pool_pre_ping=True,
+        )
+
     def check_internet_connection(self):
         if requests.get("https://google.com").status_code == 401:
             self.log.error("It seems that you have no internet connection.")
@@ -120,44 +211,45 @@ class Config:
         #        )
         #        return False
 
-        if self.db_user is None:
-            self.log.error(
-                "You are missing the Database User field. Please check https://github.com/team4099/scouting-data-ingest#mysql for more information."
-            )
-            return False
+        # A SQLite database needs no server or credentials
+        if not self.uses_sqlite():
+            if self.db_user is None:
+                self.log.error(
+                    "You are missing the Database User field. Please check https://github.com/team4099/scouting-data-ingest#mysql for more information."
+                )
+                return False
 
-        if self.db_pwd is None:
-            self.log.error(
-                "You are missing the Database Password field. Please check https://github.com/team4099/scouting-data-ingest#mysql for more information."
-            )
-            return False
+            if self.db_pwd is None:
+                self.log.error(
+                    "You are missing the Database Password field. Please check https://github.com/team4099/scouting-data-ingest#mysql for more information."
+                )
+                return False
 
-        try:
-            create_engine(
-                f"mysql+pymysql://{self.db_user}:{self.db_pwd}@{self.db_host}/scouting"
-            )
-        except pymysql.err.OperationalError:
-            self.log.error(
-                "Your Database user name and/or password is not correct. Please verify them."
-            )
+            try:
+                create_engine(self.get_database_url())
+            except pymysql.err.OperationalError:
+                self.log.error(
+                    "Your Database user name and/or password is not correct. Please verify them."
+                )
 
-        if self.event is None:
+        if not self.get_event_keys():
             self.log.error(
                 "You are missing the Event field. Please check https://github.com/team4099/scouting-data-ingest#event for more information."
             )
             return False
 
-        if (
-            requests.get(
-                f"https://www.thebluealliance.com/api/v3/event/{self.year}{self.event}",
-                headers={"X-TBA-Auth-Key": self.tba_key},
-            ).status_code
-            == 404
-        ):
-            self.log.error(
-                "The event listed in the TBA-Key field is not valid. Please ensure the event key and year are correct."
-            )
-            return False
+        for event_key in self.get_event_keys():
+            if (
+                requests.get(
+                    f"https://www.thebluealliance.com/api/v3/event/{event_key}",
+                    headers={"X-TBA-Auth-Key": self.tba_key},
+                ).status_code
+                == 404
+            ):
+                self.log.error(
+                    f"The event {event_key} is not valid. Please ensure the event key and year are correct."
+                )
+                return False
 
         if self.simulation:
             if self.simulator_url is None:
@@ -201,3 +293,41 @@ class Config:
             #        return False
 
         return True
+
+
+def create_sqlite_engine(url):
+    """
+
+    Creates an engine for a SQLite file or in-memory database.
+
+    Every thread shares one connection to an in-memory database, since each connection would
+    otherwise get a database of its own. That only suits the benchmark, which runs every stage on one thread. Files use WAL so the dashboard can read while the ingest writes.
+
+    :param url: A sqlite:// URL
+    :type url: str
+    :return: A SQLAlchemy engine
+    :rtype: sqlalchemy.engine.Engine
+    """
+    in_memory = url in in_memory_sqlite_urls
+    if in_memory:
+        engine = create_engine(
+            url, connect_args={"check_same_thread": False}, poolclass=StaticPool
+        )
+    else:
+        engine = create_engine(
+            url, connect_args={"check_same_thread": False, "timeout": 30}
+        )
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not in_memory:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            # WAL only needs to sync on checkpoints to stay consistent
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute("PRAGMA busy_timeout=30000")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA cache_size=-65536")
+        cursor.close()
+
+    return engine
@@ -1,7 +1,9 @@
-from datetime import datetime
-import pytz
+from collections import defaultdict
+from contextlib import contextmanager
+import threading
 import pandas as pd
-from sqlalchemy import exists, update
+from sqlalchemy import bindparam, event, exists, func, text, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 import copy
 from typing import Union, Optional, List, Literal
 
@@ -23,10 +25,12 @@ from SQLObjects import (
     MatchDatum,
     TeamDatum,
     CalculatedTeamDatum,
-    match_data_map,
+    match_datum_extractor,
     team_data_map,
 )
 from terminal import logger
+from AllianceIncidence import AllianceIncidence
+from Metrics import metrics
 from json import dumps
 
 
@@ -49,8 +53,144 @@ class DataAccessor:
         self.log.info("Initializing Variables")
         self.warning_dict = {}
         self.last_checked = None
+        self.reset_caches()
+
+        self.log.info("Loading known Teams and Matches")
+        self.load_identity_cache()
 
         self.log.info("DataAccessor Loaded!")
+
+    def clone(self, session) -> "DataAccessor":
+        """
+        Makes an accessor that uses its own session but shares this one's caches, for use on another thread
+
+        The caches are only read and changed under cache_lock, so the threads can share them safely.
+        """
+        accessor = copy.copy(self)
+        accessor.session = session
+        return accessor
+
+    def reset_caches(self) -> None:
+        """
+        Empties the identity, version and DataFrame caches
+
+        A clone gets caches of its own, which it no longer shares with the accessor it was cloned from.
+        """
+        # Guards the identity, version and DataFrame caches, which clones share with this accessor
+        self.cache_lock = threading.RLock()
+        self.team_ids = set()
+        self.match_ids = set()
+        # Bumped on every write to a table so cached DataFrames know when they are stale
+        self.data_versions = defaultdict(int)
+        self.data_fingerprints = {}
+        self.df_cache = {}
+        # The schedule, decoded once and shared with every clone
+        self.alliance_incidence = AllianceIncidence()
+
+    def load_identity_cache(self) -> None:
+        """
+        Loads the ids of every stored Team and Match so existence checks don't need a query
+        """
+        self.team_ids = {team.id for team in self.session.query(Team.id)}
+        self.match_ids = {match.id for match in self.session.query(Match.id)}
+
+    def team_exists(self, team_id: str) -> bool:
+        """
+        Checks if a team is stored, only querying for ids that aren't cached yet
+        """
+        if team_id not in self.team_ids and self.get_team(team_id) is not None:
+            with self.cache_lock:
+                self.team_ids.add(team_id)
+        return team_id in self.team_ids
+
+    def match_exists(self, match_id: str) -> bool:
+        """
+        Checks if a match is stored, only querying for ids that aren't cached yet
+        """
+        if match_id not in self.match_ids and self.get_match(key=match_id) is not None:
+            with self.cache_lock:
+                self.match_ids.add(match_id)
+        return match_id in self.match_ids
+
+    def bump_data_version(self, *tables: str) -> None:
+        """
+        Marks the data in tables as changed
+        """
+        with self.cache_lock:
+            for table in tables:
+                self.data_versions[table] += 1
+
+    def bump_data_version_on_commit(self, *tables: str) -> None:
+        """
+        Marks the data in tables as changed once the session's transaction commits
+
+        Until then the writes are only visible to this session, so a DataFrame read on another
+        connection in the meantime would cache the old rows under the new version.
+        """
+        self.session.info.setdefault("changed_tables", set()).update(tables)
+        if not event.contains(self.session, "after_commit", self._publish_changed_tables):
+            event.listen(self.session, "after_commit", self._publish_changed_tables)
+            event.listen(self.session, "after_rollback", self._discard_changed_tables)
+
+    def _publish_changed_tables(self, session) -> None:
+        self.bump_data_version(*session.info.pop("changed_tables", ()))
+
+    def _discard_changed_tables(self, session) -> None:
+        session.info.pop("changed_tables", None)
+
+    def sync_data_version(self, model) -> int:
+        """
+        Bumps the data version of a table if rows were added or removed outside this accessor
+
+        This only compares the row count and largest id, so it is meant for tables like
+        team_data that other processes insert into but don't update.
+        """
+        table = model.__tablename__
+        fingerprint = tuple(
+            self.session.query(func.count(model.id), func.max(model.id)).one()
+        )
+        with self.cache_lock:
+            if self.data_fingerprints.get(table) != fingerprint:
+                self.data_fingerprints[table] = fingerprint
+                self.bump_data_version(table)
+            return self.data_versions[table]
+
+    def _get_cached_df(self, model, event_key: Optional[str] = None) -> pd.DataFrame:
+        """
+        Gets a whole table, or one event's rows of it, as a DataFrame, only reading it again when its data version changed
+
+        The returned DataFrame is shared between callers and must not be modified in place.
+        """
+        table = model.__tablename__
+        with self.cache_lock:
+            version = self.data_versions[table]
+            cached_version, df = self.df_cache.get((table, event_key), (None, None))
+        if cached_version == version:
+            return df
+
+        query = self.session.query(model)
+        if event_key is not None:
+            query = query.filter(model.event_key == event_key)
+        with self.sql_connection() as connection:
+            df = pd.read_sql_query(query.statement, connection)
+        with self.cache_lock:
+            # Only cache the read if the table wasn't written to while it ran
+            if self.data_versions[table] == version:
+                self.df_cache[(table, event_key)] = (version, df)
+        return df
+
+    def _cache_stored_ids(self, column, ids, cache: set) -> None:
+        """
+        Adds the ids that are stored but not cached yet to an identity cache
+        """
+        with self.cache_lock:
+            uncached_ids = set(ids) - cache
+        if uncached_ids:
+            stored_ids = [
+                row[0] for row in self.session.query(column).filter(column.in_(uncached_ids))
+            ]
+            with self.cache_lock:
+                cache.update(stored_ids)
         
     def get_all_match_objects(
         self,
@@ -144,6 +284,24 @@ class DataAccessor:
         else:
             return alliance_associations 
 
+    def get_alliance_incidence(self) -> AllianceIncidence:
+        """
+        Gets the schedule as an incidence matrix, adding the AllianceAssociations stored since the last call
+        """
+        new_associations = (
+            self.session.query(
+                AllianceAssociation.id,
+                AllianceAssociation.match_id,
+                AllianceAssociation.alliance,
+                AllianceAssociation.team_id,
+                AllianceAssociation.driver_station,
+            )
+            .filter(AllianceAssociation.id > self.alliance_incidence.last_id)
+            .order_by(AllianceAssociation.id)
+        )
+        self.alliance_incidence.add_associations(new_associations)
+        return self.alliance_incidence
+
     def get_warnings(
         self,
         match_id: Optional[str] = None,
@@ -208,6 +366,15 @@ class DataAccessor:
 
         return query.all() if query is not None else None
 
+    def get_last_match_datum(self, event_key: Optional[str] = None) -> Optional[MatchDatum]:
+        """
+        Get the most recently posted match datum, of one event if event_key is given
+        """
+        query = self.session.query(MatchDatum)
+        if event_key is not None:
+            query = query.filter(MatchDatum.event_key == event_key)
+        return query.order_by(MatchDatum.post_result_time.desc()).first()
+
     def get_match_datum(
         self,
         match_id: Optional[str] = None,
@@ -282,7 +449,7 @@ class DataAccessor:
         match_number: int,
         event_key: str,
     ) -> None:
-        if not self.get_match(key=id):
+        if not self.match_exists(id):
             m = Match(
                 id=id,
                 comp_level=CompLevel(comp_level),
@@ -291,11 +458,82 @@ class DataAccessor:
                 event_key=event_key,
             )
             self.session.add(m)
+            with self.cache_lock:
+                self.match_ids.add(id)
 
     def add_team(self, id: str) -> None:
-        if not self.get_team(id):
+        if not self.team_exists(id):
             t = Team(id=id)
             self.session.add(t)
+            with self.cache_lock:
+                self.team_ids.add(id)
+
+    def add_teams(self, team_ids: List[str]) -> None:
+        """
+        Inserts every team in team_ids that isn't stored yet with one statement
+        """
+        self._cache_stored_ids(Team.id, team_ids, self.team_ids)
+        new_team_ids = [
+            team_id for team_id in dict.fromkeys(team_ids) if team_id not in self.team_ids
+        ]
+        if not new_team_ids:
+            return None
+
+        self._insert(Team.__table__, [{"id": team_id} for team_id in new_team_ids])
+        with self.cache_lock:
+            self.team_ids.update(new_team_ids)
+
+    def add_matches(self, matches: List[dict]) -> None:
+        """
+        Inserts every match that isn't stored yet with one statement
+
+        Each match is a dict with the same fields as add_match.
+        """
+        matches = {match["id"]: match for match in matches}
+        self._cache_stored_ids(Match.id, matches.keys(), self.match_ids)
+        new_matches = [
+            {**match, "comp_level": CompLevel(match["comp_level"])}
+            for match_id, match in matches.items()
+            if match_id not in self.match_ids
+        ]
+        if not new_matches:
+            return None
+
+        self._insert(Match.__table__, new_matches)
+        with self.cache_lock:
+            self.match_ids.update(match["id"] for match in new_matches)
+
+    def add_alliance_associations(self, alliance_associations: List[dict]) -> None:
+        """
+        Inserts every alliance association that isn't stored yet with one statement
+
+        Each association is a dict with the same fields as add_alliance_association.
+        An association is identified by its match, alliance and driver station.
+        """
+        if not alliance_associations:
+            return None
+
+        match_ids = {association["match_id"] for association in alliance_associations}
+        stored = set(
+            self.session.query(
+                AllianceAssociation.match_id,
+                AllianceAssociation.alliance,
+                AllianceAssociation.driver_station,
+            ).filter(AllianceAssociation.match_id.in_(match_ids))
+        )
+        new_associations = {}
+        for association in alliance_associations:
+            key = (
+                association["match_id"],
+                Alliance(association["alliance"]),
+                association["driver_station"],
+            )
+            if key not in stored:
+                new_associations[key] = {**association, "alliance": key[1]}
+        if not new_associations:
+            return None
+
+        self._insert(AllianceAssociation.__table__, list(new_associations.values()))
 
     def add_warning(
         self,
@@ -305,15 +543,38 @@ class DataAccessor:
         content: str,
         ignore: Union[Boolean, Literal[False]] = False,
     ) -> None:
-        if not self.get_warnings(match_id, alliance, category):
-            w = Warning(
-                match_id=match_id,
-                alliance=alliance,
-                category=category,
-                content=content,
-                ignore=ignore,
-            )
-            self.session.add(w)
+        self.add_warnings(
+            [
+                {
+                    "match_id": match_id,
+                    "alliance": alliance,
+                    "category": category,
+                    "content": content,
+                    "ignore": ignore,
+                }
+            ]
+        )
+
+    def add_warnings(self, warnings: List[dict]) -> None:
+        """
+        Saves a batch of warnings with one statement
+
+        Each warning is a dict with the same fields as add_warning. A warning is
+        identified by its match, alliance and category; only the first of a batch
+        is kept, and raising an existing warning again updates its content but
+        keeps its ignore flag.
+        """
+        rows = {}
+        for warning in warnings:
+            key = (warning["match_id"], warning["alliance"], warning["category"])
+            if key not in rows:
+                rows[key] = {"ignore": False, **warning}
+        if not rows:
+            return None
+
+        self._upsert(
+            Warning.__table__, list(rows.values()), ["match_id", "alliance", "category"], ["content"]
+        )
 
     def add_info(self, id: str, value: str) -> None:
         if not self.get_info(id):
@@ -340,59 +601,99 @@ class DataAccessor:
         if not self.get_predictions(scout_id=scout_id, match_id=match_id):
             p = Prediction(scout_id=scout_id, match_id=match_id, prediction=prediction)
             self.session.add(p)
+            self.bump_data_version_on_commit(Prediction.__tablename__)
 
     def add_match_datum(
         self,
         match_id: str,
         match_json: dict,
     ) -> None:
-        check_match = self.get_match(key=match_id)
-        if not check_match:
+        self.add_match_data([{**match_json, "key": match_id}])
+
+    def add_match_data(
+        self,
+        match_jsons: List[dict],
+    ) -> None:
+        """
+        Upserts MatchDatum rows for a batch of raw TBA matches
+
+        Matches that are not in the schedule are skipped. A match that already
+        has a MatchDatum (e.g. it was re-scored) has its row updated in place.
+        """
+        # Later entries win so a batch can't try to write the same match twice
+        match_jsons = {match_json["key"]: match_json for match_json in match_jsons}
+        if not match_jsons:
             return None
 
-        new_vars = {}
-        md = MatchDatum(match_id=match_id)
-
-        new_vars["comp_level"] = CompLevel(match_json["comp_level"])
-        new_vars["set_number"] = match_json["set_number"]
-        new_vars["match_number"] = match_json["match_number"]
-        new_vars["set_number"] = match_json["set_number"]
-        new_vars["winning_alliance"] = Alliance(match_json["winning_alliance"])
-        new_vars["event_key"] = match_json["event_key"]
-        new_vars["time"] = datetime.fromtimestamp(match_json["time"], pytz.utc)
-        new_vars["actual_time"] = datetime.fromtimestamp(
-            match_json["actual_time"], pytz.utc
+        self._cache_stored_ids(Match.id, match_jsons.keys(), self.match_ids)
+        rows = match_datum_extractor.extract_rows(
+            match_json
+            for match_id, match_json in match_jsons.items()
+            if match_id in self.match_ids
         )
-        #new_vars["predicted_time"] = datetime.fromtimestamp(
-        #    match_json["predicted_time"], pytz.utc
-        #)
-        new_vars["post_result_time"] = datetime.fromtimestamp(
-            match_json["post_result_time"], pytz.utc
+        if not rows:
+            return None
+
+        self._upsert(
+            MatchDatum.__table__,
+            rows,
+            ["match_id"],
+            [column for column in rows[0].keys() if column != "match_id"],
         )
+        self.session.flush()
+        self.bump_data_version_on_commit(MatchDatum.__tablename__)
 
-        def climb_tf(climb):
-            if climb == ClimbType.none:
-                return ClimbType.none
-            return climb
+    def _insert(self, table, rows: List[dict]) -> None:
+        """
+        Inserts rows with a single executemany
+        """
+        with metrics.stage(f"write {table.name}", rows=len(rows)):
+            self.session.execute(table.insert(), rows)
 
-        new_vars["r_endgame_1"] = climb_tf(ClimbType(match_json["score_breakdown.red.endgameRobot1"].lower()))
-        new_vars["r_endgame_2"] = climb_tf(ClimbType(match_json["score_breakdown.red.endgameRobot2"].lower()))
-        new_vars["r_endgame_3"] = climb_tf(ClimbType(match_json["score_breakdown.red.endgameRobot3"].lower()))
-        new_vars["b_endgame_1"] = climb_tf(ClimbType(match_json["score_breakdown.blue.endgameRobot1"].lower()))
-        new_vars["b_endgame_2"] = climb_tf(ClimbType(match_json["score_breakdown.blue.endgameRobot2"].lower()))
-        new_vars["b_endgame_3"] = climb_tf(ClimbType(match_json["score_breakdown.blue.endgameRobot3"].lower()))
+    def _upsert(
+        self, table, rows: List[dict], key_columns: List[str], update_columns: List[str]
+    ) -> None:
+        """
+        Inserts rows with a single multi-row statement, updating update_columns of
+        rows that collide with an existing row on the unique key key_columns
 
-        # Dynamically set Year specific items
-        for letter, color in zip(["r", "b"], ["red", "blue"]):
-            for key, value in match_data_map.items():
-                new_vars[f"{letter}_{key}"] = match_json[
-                    f"score_breakdown.{color}.{value}"
-                ]
+        MySQL can't be told which key to collide on, so key_columns has to be the only
+        unique key besides the primary key that the rows could collide on.
+        """
+        with metrics.stage(f"write {table.name}", rows=len(rows)):
+            if self.engine.dialect.name == "sqlite":
+                self._sqlite_upsert(table, rows, key_columns, update_columns)
+                return
+            statement = mysql_insert(table).values(rows)
+            statement = statement.on_duplicate_key_update(
+                {column: statement.inserted[column] for column in update_columns}
+            )
+            self.session.execute(statement)
 
-            md.__dict__.update(new_vars)
+    def _sqlite_upsert(
+        self, table, rows: List[dict], key_columns: List[str], update_columns: List[str]
+    ) -> None:
+        """
+        Upserts on SQLite, which SQLAlchemy 1.3 has no ON CONFLICT support for, with a hand written
+        INSERT ... ON CONFLICT DO UPDATE run as one executemany (needs SQLite 3.24 or newer)
 
-        self.session.add(md)
-        self.session.flush()
+        Only a collision on key_columns updates the row. Any other violation, like a NOT NULL
+        or Enum CHECK constraint, still raises like it does on MySQL.
+        """
+        quote = self.engine.dialect.identifier_preparer.quote
+        columns = list(rows[0].keys())
+        conflict_action = (
+            "DO UPDATE SET "
+            + ", ".join(f"{quote(column)} = excluded.{quote(column)}" for column in update_columns)
+            if update_columns
+            else "DO NOTHING"
+        )
+        statement = text(
+            f"INSERT INTO {quote(table.name)} ({', '.join(quote(column) for column in columns)}) "
+            f"VALUES ({', '.join(f':{column}' for column in columns)}) "
+            f"ON CONFLICT ({', '.join(quote(column) for column in key_columns)}) {conflict_action}"
+        ).bindparams(*[bindparam(column, type_=table.c[column].type) for column in columns])
+        self.session.execute(statement, rows)
 
     def add_alliance_association(
         self,
@@ -403,6 +704,7 @@ class DataAccessor:
     ) -> None:
         aa = AllianceAssociation(
             match_id=match_id,
+            event_key=match_id.split("_")[0],
             team_id=team_id,
             alliance=alliance,
             driver_station=driver_station
@@ -422,7 +724,7 @@ class DataAccessor:
         team_datum_json: dict,
     ) -> None:
         if (
-           self.get_team(team_id) is None or 
+           not self.team_exists(team_id) or 
            self.get_team_data(match_id=match_id, team_id=team_id, alliance=alliance)
            != []
         ):
@@ -435,6 +737,8 @@ class DataAccessor:
         new_vars = {}
         td = TeamDatum(
             match_id=match_id,
+            # Match keys start with the key of their event
+            event_key=match_id.split("_")[0],
             scout_id=scout_id,
             team_id=team_id,
             alliance=alliance,
@@ -448,10 +752,11 @@ class DataAccessor:
 
         self.session.add(td)
         self.session.commit()
+        self.bump_data_version(TeamDatum.__tablename__)
 
 
     def add_calculated_team_datum(self, team_id: str, calculated_team_datum_json: dict):
-        if self.get_team(team_id) is None:
+        if not self.team_exists(team_id):
             return None
         if (old_team_data := self.get_calculated_team_data(team_id)) is not None:
             new_vars = old_team_data.__dict__
@@ -478,21 +783,53 @@ class DataAccessor:
             self.session.add(ctd)
             self.session.flush()
 
-    def get_all_teams_df(self):
-        return pd.read_sql_query(
-            self.session.query(Team).statement, self.sql_connection()
+    def add_calculated_team_data(self, calculated_team_data: dict) -> None:
+        """
+        Upserts CalculatedTeamDatum rows for many teams with one statement
+
+        calculated_team_data maps team ids to their calculated metrics. Teams that
+        aren't stored are skipped, as are metrics that aren't CalculatedTeamDatum columns.
+        """
+        columns = CalculatedTeamDatum.__table__.columns
+        rows = [
+            {
+                "team_id": team_id,
+                **{key: value for key, value in metrics.items() if key in columns and key != "id"},
+            }
+            for team_id, metrics in calculated_team_data.items()
+            if self.team_exists(team_id)
+        ]
+        if not rows:
+            return None
+
+        self._upsert(
+            CalculatedTeamDatum.__table__,
+            rows,
+            ["team_id"],
+            [column for column in rows[0].keys() if column != "team_id"],
         )
+        self.session.flush()
+        self.bump_data_version_on_commit(CalculatedTeamDatum.__tablename__)
+
+    def get_all_teams_df(self):
+        with self.sql_connection() as connection:
+            return pd.read_sql_query(self.session.query(Team).statement, connection)
     
 
-    def get_all_team_data_df(self):
-        return pd.read_sql_query(
-            self.session.query(TeamDatum).statement, self.sql_connection()
-        )
+    def get_all_team_data_df(self, event_key: Optional[str] = None):
+        return self._get_cached_df(TeamDatum, event_key)
+
+    def get_all_match_data_df(self, event_key: Optional[str] = None):
+        return self._get_cached_df(MatchDatum, event_key)
+
+    def get_all_calculated_team_data_df(self):
+        return self._get_cached_df(CalculatedTeamDatum)
 
     def update_prediction(self, scout_id: str, match_id: str, prediction: Alliance):
         prediction = self.get_predictions(scout_id, match_id)[0]
         prediction.prediction = prediction
         self.session.commit()
+        self.bump_data_version(Prediction.__tablename__)
 
     def update_scout(
         self,
@@ -594,6 +931,23 @@ class DataAccessor:
             query = query.filter(self.TeamDataObject.Match_Key == match_key)
 
         query.delete()
+        self.bump_data_version_on_commit(TeamDatum.__tablename__)
 
+    @contextmanager
     def sql_connection(self):
-        return self.engine.connect()
+        """
+        Checks a connection out of the engine's pool and returns it once the block exits
+
+        Use as ``with data_accessor.sql_connection() as connection:``.
+        """
+        connection = self.engine.connect()
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def log_pool_status(self) -> None:
+        """
+        Logs the connection pool's usage so leaked connections show up
+        """
+        self.log.info(f"Connection pool: {self.engine.pool.status()}")
@@ -1,12 +1,125 @@
 import json
 import numpy
 import pandas as pd
-from scipy.sparse.linalg import lsmr
-from sklearn.preprocessing import MultiLabelBinarizer
 from sqlalchemy import Column, Integer, String, Text, ForeignKey, Float, null
 
-from SQLObjects import Base, ClimbType
+from SQLObjects import Alliance, Base, CalculatedTeamDatum, ClimbType, TeamDatum, shooting_zones
 from terminal import logger
+from Metrics import metrics
+
+
+class OPRNormalEquations:
+    """
+    Keeps the normal equations of OPR for one metric and solves them.
+
+    Each alliance adds the outer product of its team indicator vector to AᵀA and its score to
+    Aᵀb, so a new match costs O(teams in the alliance²) instead of rebuilding the whole system.
+    Solving is a plain least squares solve of the teams by teams system every time. It gives the
+    minimum norm solution, even before every team has played enough matches for AᵀA to be invertible.
+    """
+
+    def __init__(self):
+        self.team_index = {}
+        self.ata = numpy.zeros((0, 0))
+        self.atb = numpy.zeros(0)
+        # (match_id, alliance) -> (team indices, score) of every alliance in the system
+        self.alliances = {}
+        # The red and blue scores by match_id, and the schedule version, the system was last updated with
+        self.applied_scores = None
+        self.applied_schedule = None
+
+    def get_team_indices(self, teams):
+        new_teams = [team for team in teams if team not in self.team_index]
+        if new_teams:
+            for team in new_teams:
+                self.team_index[team] = len(self.team_index)
+            size = len(self.team_index)
+            self.ata = numpy.pad(self.ata, (0, size - len(self.atb)))
+            self.atb = numpy.pad(self.atb, (0, size - len(self.atb)))
+        return tuple(self.team_index[team] for team in teams)
+
+    def add_alliance(self, key, teams, score):
+        """
+
+        Adds an alliance's result, replacing the previous one if the match was re-scored.
+
+        :param key: A unique key for the alliance, e.g. (match_id, alliance)
+        :param teams: The teams on the alliance
+        :type teams: List[str]
+        :param score: The alliance's value for the metric
+        :type score: float
+        """
+        indices = self.get_team_indices(teams)
+        if self.alliances.get(key) == (indices, score):
+            return
+
+        if key in self.alliances:
+            old_indices, old_score = self.alliances[key]
+            self.atb[list(old_indices)] -= old_score
+            if old_indices != indices:
+                self.ata[numpy.ix_(old_indices, old_indices)] -= 1
+        else:
+            old_indices = None
+
+        if old_indices != indices:
+            self.ata[numpy.ix_(indices, indices)] += 1
+        self.atb[list(indices)] += score
+        self.alliances[key] = (indices, score)
+
+    def solve(self):
+        """
+
+        Solves for every team's OPR.
+
+        :return: A Series of OPRs indexed by team
+        :rtype: pandas.Series
+        """
+        if not self.team_index:
+            return pd.Series(dtype=float)
+
+        oprs = numpy.linalg.lstsq(self.ata, self.atb, rcond=None)[0]
+        return pd.Series(oprs, index=list(self.team_index))
+
+
+# Every CalculatedTeamDatum column calculate_team_data fills, as an aggregation over each team's TeamData.
+# "of" is the TeamData column, "where" a boolean column a row has to have set to be counted, "equals"
+# turns the column into whether it equals a value and "rows_with" lists the columns a row has to have
+# to be counted at all, just "of" by default.
+team_metric_spec = {}
+for column in ["auto_lower_hub", "auto_upper_hub", "auto_misses", "teleop_lower_hub", "teleop_upper_hub", "teleop_misses"]:
+    team_metric_spec[f"{column}_avg"] = {"agg": "mean", "of": column}
+    team_metric_spec[f"{column}_med"] = {"agg": "median", "of": column}
+for rung in ["low", "mid", "high", "traversal"]:
+    team_metric_spec[f"{rung}_rung_climb_time_avg"] = {"agg": "mean", "of": f"{rung}_rung_climb_time", "where": f"attempted_{rung}"}
+    team_metric_spec[f"{rung}_rung_climb_time_med"] = {"agg": "median", "of": f"{rung}_rung_climb_time", "where": f"attempted_{rung}"}
+# Usages only count matches where every column of the group was scouted
+for prefix in ["", "auto_"]:
+    zone_columns = [f"{prefix}from_{zone}" for zone in shooting_zones]
+    for column in zone_columns:
+        team_metric_spec[f"{column}_usage"] = {"agg": "mean", "of": column, "rows_with": zone_columns}
+attempted_columns = [f"attempted_{rung}" for rung in ["low", "mid", "high", "traversal"]]
+for column in attempted_columns:
+    team_metric_spec[f"{column}_usage"] = {"agg": "mean", "of": column, "rows_with": attempted_columns}
+for climb_type, column in [
+    (ClimbType.traversal, "traversal_rung_pct"),
+    (ClimbType.high, "high_rung_pct"),
+    (ClimbType.mid, "mid_rung_pct"),
+    (ClimbType.low, "low_rung_pct"),
+    (ClimbType.none, "none_pct"),
+]:
+    team_metric_spec[column] = {"agg": "mean", "of": "final_climb_type", "equals": climb_type}
+# Totals for team_share_spec, which are dropped once the shares are calculated
+shot_columns = ["teleop_upper_hub", "teleop_lower_hub", "teleop_misses"]
+for column in shot_columns:
+    team_metric_spec[f"{column}_sum"] = {"agg": "sum", "of": column, "rows_with": shot_columns}
+team_metric_spec["comments"] = {"agg": "".join, "of": "comments"}
+
+# Columns that are one total's share of the sum of several, as column -> (total, totals)
+team_share_spec = {
+    "teleop_upper_hub_pct": ("teleop_upper_hub_sum", [f"{column}_sum" for column in shot_columns]),
+    "teleop_lower_hub_pct": ("teleop_lower_hub_sum", [f"{column}_sum" for column in shot_columns]),
+    "teleop_miss_pct": ("teleop_misses_sum", [f"{column}_sum" for column in shot_columns]),
+}
 
 
 class DataCalculator:
@@ -30,372 +143,187 @@ class DataCalculator:
         self.data_accessor = data_accessor
         self.calculated_team_data_object = None
         self.sql_configured = False
+        # A hash of each team's TeamData as of the last calculation
+        self.team_signatures = {}
+        # Teams being recalculated in the current run, None meaning every team
+        self.dirty_teams = None
+        # OPRNormalEquations by metric
+        self.opr_solvers = {}
 
         self.log.info("DataCalculator Loaded!")
 
-    def calculate_team_average(self, col):
+    def get_team_data_df(self):
         """
 
-        Calculates an average by team for a metric.
+        Gets the TeamData of the teams being recalculated.
 
-        :param col: A metric column from TeamData.
-        :type col: str
-        :return: A Dataframe of averages
+        :return: A Dataframe of TeamData
         :rtype: pandas.DataFrame
         """
-        team_data = self.data_accessor.get_all_team_data_df()[["team_id", col]]
-        if (len(team_data.index)) > 0:
-            team_data_average = self.team_list.merge(
-                team_data.groupby("team_id").mean(),
-                how="outer",
-                left_on="id",
-                right_index=True,
-            )
-        else:
-            team_data_average = self.team_list.merge(
-                team_data, how="outer", left_on="team_id", right_index=True
-            ).drop(columns=["id"])
-        team_data_average = team_data_average.rename(columns={col: col + "_avg"})
-        return team_data_average.set_index("id")
+        team_data = self.data_accessor.get_all_team_data_df()
+        if self.dirty_teams is not None:
+            team_data = team_data[team_data["team_id"].isin(self.dirty_teams)]
+        return team_data
 
-    def calculate_team_average_filter(self, col, filter_col):
+    def get_team_signatures(self, team_data):
         """
 
-        Calculates an average by team for a metric.
+        Hashes the TeamData of every team so new or changed rows can be detected.
 
-        :param col: A metric column from TeamData.
-        :type col: str
-        :return: A Dataframe of averages
-        :rtype: pandas.DataFrame
+        :param team_data: All TeamData
+        :type team_data: pandas.DataFrame
+        :return: A dict of team ids to hashes, with teams that have no TeamData hashed as 0
+        :rtype: Dict[str, int]
         """
-        team_data = self.data_accessor.get_all_team_data_df()[["team_id", col, filter_col]].dropna()
-        if (len(team_data.index)) > 0:
-            team_data_average = self.team_list.merge(
-                team_data[team_data[filter_col]].groupby("team_id").mean(),
-                how="outer",
-                left_on="id",
-                right_index=True,
-            ).drop(columns=[filter_col])
-        else:
-            team_data_average = self.team_list.merge(
-                team_data, how="outer", left_on="team_id", right_index=True
-            ).drop(columns=["id"])
-        team_data_average = team_data_average.rename(columns={col: col + "_avg"})
-        return team_data_average.set_index("id")
+        signatures = dict.fromkeys(self.team_list["id"], 0)
+        if len(team_data.index) > 0:
+            row_hashes = pd.util.hash_pandas_object(team_data, index=False)
+            signatures.update(row_hashes.groupby(team_data["team_id"]).sum().to_dict())
+        return signatures
 
-
-
-    def calculate_team_median(self, col):
+    def aggregate_team_metrics(self, team_data):
         """
 
-        Calculates an median by team for a metric.
-
-        :param col: A metric column from TeamData.
-        :type col: str
-        :return: A Dataframe of medians
-        :rtype: pandas.DataFrame
-        """
-        team_data = self.data_accessor.get_all_team_data_df()[["team_id", col]].dropna()
-        if (len(team_data.index)) > 0:
-            team_data_average = self.team_list.merge(
-                team_data.groupby("team_id").median(),
-                how="outer",
-                left_on="id",
-                right_index=True,
-            )
-        else:
-            team_data_average = self.team_list.merge(
-                team_data, how="outer", left_on="team_id", right_index=True
-            ).drop(columns=["id"])
-        team_data_average = team_data_average.rename(columns={col: col + "_med"})
-        return team_data_average.set_index("id")
-    
-    def calculate_team_median_filter(self, col, filter_col):
-        """
+        Calculates every metric in team_metric_spec with one grouped aggregation.
 
-        Calculates an median by team for a metric.
+        Each metric gets its own input column with the rows it doesn't count set to missing, so mean,
+        median and sum skip them while every metric is aggregated in the same pass.
 
-        :param col: A metric column from TeamData.
-        :type col: str
-        :return: A Dataframe of medians
+        :param team_data: TeamData of the teams being recalculated
+        :type team_data: pandas.DataFrame
+        :return: A Dataframe of CalculatedTeamDatum columns indexed by team
         :rtype: pandas.DataFrame
         """
-        team_data = self.data_accessor.get_all_team_data_df()[["team_id", col, filter_col]].dropna()
-        if (len(team_data.index)) > 0:
-            team_data_average = self.team_list.merge(
-                team_data[team_data[filter_col]].groupby("team_id").median(),
-                how="outer",
-                left_on="id",
-                right_index=True,
-            ).drop(columns=[filter_col])
-        else:
-            team_data_average = self.team_list.merge(
-                team_data, how="outer", left_on="team_id", right_index=True
-            ).drop(columns=["id",filter_col])
-        team_data_average = team_data_average.rename(columns={col: col + "_med"})
-        return team_data_average.set_index("id")
-
-    def calculate_team_percentages(
-        self, cols, one_hot_encoded=True, replacements=None, possible_values=None
-    ):
-        """
+        team_data = team_data.assign(
+            comments="N"
+            + team_data["match_id"].str.split("_", n=1).str[1]
+            + ": "
+            + team_data["notes"].astype(str)
+            + ","
+            + team_data["teleop_notes"].astype(str)
+            + ", "
+            + team_data["auto_notes"].astype(str)
+        )
 
-        Calculates percentages by team for a metric.
-
-        :param cols: Columns to convert to percentages
-        :type cols: List[str]
-        :param one_hot_encoded: Whether the data is already one hot encoded
-        :type one_hot_encoded: Union[bool, None]
-        :param replacements: A dict to map string values to integers
-        :type replacements: Union[Dict[str, int], None]
-        :type possible_values: A list of possible values if using one-hot encoding
-        :type possible_values: Union[List[str], None]
-        :return: A Dataframe of percentages
-        :rtype: pandas.DataFrame
-        """
-        if replacements is None:
-            replacements = {}
-        team_data = self.data_accessor.get_all_team_data_df()[[*cols, "team_id"]]
-        if not one_hot_encoded:
-            team_data_encoded = pd.get_dummies(team_data[cols])
-            team_data[team_data_encoded.columns] = team_data_encoded[
-                team_data_encoded.columns
-            ]
-            unused_col_names = [
-                f"{col}_{name}"
-                for col in cols
-                for name in possible_values
-                if f"{col}_{name}" not in team_data_encoded.columns
-            ]
-            team_data[unused_col_names] = pd.DataFrame(
-                data=0, index=team_data_encoded.index, columns=unused_col_names
-            )
-        if replacements is not None:
-            for k, v in replacements.items():
-                team_data = team_data.replace(k, v)
-        counts = team_data.dropna().groupby("team_id").mean()
-        team_data_percentages = self.team_list.merge(
-            counts, how="outer", left_on="id", right_index=True
+        inputs = {"team_id": team_data["team_id"]}
+        for column, spec in team_metric_spec.items():
+            values = team_data[spec["of"]]
+            counted = team_data[spec.get("rows_with", [spec["of"]])].notna().all(axis=1)
+            if "where" in spec:
+                counted &= team_data[spec["where"]].fillna(False).astype(bool)
+            if "equals" in spec:
+                values = (values == spec["equals"]).astype(float)
+            elif spec["agg"] in ("mean", "median", "sum"):
+                values = values.astype(float)
+            inputs[column] = values.where(counted)
+
+        aggregated = (
+            pd.DataFrame(inputs)
+            .groupby("team_id")
+            .agg({column: spec["agg"] for column, spec in team_metric_spec.items()})
         )
-        team_data_percentages = team_data_percentages.rename(
-            columns={c: c + "_pct" for c in cols}
+        for column, (part, parts) in team_share_spec.items():
+            aggregated[column] = aggregated[part] / aggregated[parts].sum(axis=1)
+        aggregated = aggregated.drop(
+            columns=[column for column in team_metric_spec if column not in CalculatedTeamDatum.__table__.columns]
         )
-        return team_data_percentages.set_index("id")
-
-    def calculate_team_percentages_quant(self, cols):
-        team_data = self.data_accessor.get_all_team_data_df()[[*cols, "team_id"]]
-        counts = team_data.dropna().groupby("team_id").sum()
-        counts["Sum"] = counts.sum(axis=1)
-        for col in cols:
-            counts[f"{col}_pct"] = counts.loc[:, col] / counts["Sum"]
-        cols.append("Sum")
-        counts.drop(cols, axis=1, inplace=True)
-        return counts
-
-    def team_data_to_sql(self, dfs, col_names):
-        self.log.info("Joining Dataframes")
-        full_df = dfs[0].join(dfs[1:])
-        full_df.rename(col_names, inplace=True, axis=1)
 
+        # Teams without TeamData still get a row, with every metric missing
+        return aggregated.reindex(pd.Index(self.team_list["id"]).union(aggregated.index))
+
+    def team_data_to_sql(self, full_df):
         self.log.info("Adding Data")
-        full_df = full_df.replace(numpy.nan, null(), regex=True)
-        for team, calculated_team_datum in full_df.to_dict(orient="index").items():
-            self.data_accessor.add_calculated_team_datum(team, calculated_team_datum)
+        full_df = full_df.astype(object).where(full_df.notna(), None)
+        self.data_accessor.add_calculated_team_data(full_df.to_dict(orient="index"))
         self.session.commit()
 
     def calculate_opr(self, metric):
-        #self.session.flush()
-        all_matches = self.data_accessor.get_all_match_objects(
-            [f"r_{metric}",
-             f"b_{metric}"]
-        ) #getting all data 
-
-        all_alliances = self.data_accessor.get_all_alliance()
-        
-        alliance_metric_info = []
-        for match in range(int(len(all_alliances)/2)):
-            alliance_metric_info.append([all_alliances[match], all_matches[match][1]])
-        for match in range(int(len(all_alliances)/2)):
-            alliance_metric_info.append([all_alliances[int(len(all_alliances)/2) + match], all_matches[match][2]])
-        
-        assembled_data = pd.DataFrame(numpy.array(alliance_metric_info), columns=['teams', 'metricdata'])
-        mlb = MultiLabelBinarizer(sparse_output=True)
-        sparse_teams = mlb.fit_transform(assembled_data["teams"])
-        oprs = lsmr(sparse_teams, assembled_data['metricdata'].apply(lambda val: int(val)).to_numpy())
-        teams_with_oprs = pd.DataFrame([mlb.classes_, oprs[0]]).transpose()
-        teams_with_oprs.rename({0: "teams", 1: f"{metric}_opr"}, inplace=True, axis=1)
-        teams_with_oprs.set_index("teams", inplace=True)
-        
-        return teams_with_oprs
+        """
 
-    def group_notes(self):
-        team_data = self.data_accessor.get_all_team_data_df()[
-            ["team_id", "match_id", "notes", "auto_notes", "teleop_notes"]
-        ]
-        stripped_match_id = team_data["match_id"].apply(lambda x: x[x.index("_") + 1 :])
-        team_data["comments"] = (
-            "N"
-            + stripped_match_id
-            + ": "
-            + team_data["notes"].astype(str)
-            + ","
-            + team_data["teleop_notes"].astype(str)
-            + ", "
-            + team_data["auto_notes"].astype(str)
-        )
+        Calculates OPR by team for a MatchData metric.
 
-        notes_by_teams = pd.DataFrame(
-            index=team_data["team_id"].unique(), columns=["comments"]
-        )
+        Alliances are looked up in the schedule's incidence matrix by match id. Only matches that are new
+        or were re-scored since the last call are fed to the normal equations, unless the schedule changed.
 
-        for team in team_data["team_id"].unique():
-            team_specific_notes = team_data.loc[team_data["team_id"] == team]
-            notes_by_teams.at[team, "comments"] = "".join(
-                team_specific_notes["comments"]
-            )
+        :param metric: A MatchData metric without its alliance prefix, e.g. "total_points"
+        :type metric: str
+        :return: A Dataframe of OPRs
+        :rtype: pandas.DataFrame
+        """
+        solver = self.opr_solvers.setdefault(metric, OPRNormalEquations())
+        incidence = self.data_accessor.get_alliance_incidence()
+        scores = self.data_accessor.get_all_match_data_df().set_index("match_id")[
+            [f"r_{metric}", f"b_{metric}"]
+        ]
+
+        changed_scores = scores
+        # A changed schedule can move teams between alliances of matches that were already fed
+        if solver.applied_scores is not None and solver.applied_schedule == incidence.last_id:
+            applied_scores = solver.applied_scores.reindex(scores.index)
+            unchanged = (scores == applied_scores) | (scores.isna() & applied_scores.isna())
+            changed_scores = scores[~unchanged.all(axis=1)]
+        solver.applied_scores = scores
+        solver.applied_schedule = incidence.last_id
+
+        for match_id, red_score, blue_score in changed_scores.itertuples():
+            for alliance, score in zip([Alliance.red, Alliance.blue], [red_score, blue_score]):
+                row = incidence.alliance_index.get((match_id, alliance))
+                if row is not None and pd.notna(score):
+                    solver.add_alliance(
+                        (match_id, alliance.value), incidence.get_teams(row), float(score)
+                    )
+
+        teams_with_oprs = solver.solve().rename(f"{metric}_opr").to_frame()
+        teams_with_oprs.index.name = "teams"
 
-        return notes_by_teams
+        return teams_with_oprs
 
-    def calculate_team_data(self):
+    def calculate_team_data(self, full=False):
         """
         Calculates Team Data
+
+        Only teams with new or changed TeamData since the last run are recalculated unless full is set.
         """
         self.log.info("Getting a team list")
         self.team_list = self.data_accessor.get_all_teams_df()
+        # Picks up TeamData submitted through the dashboard since the last run
+        self.data_accessor.sync_data_version(TeamDatum)
 
-        if len(self.data_accessor.get_all_team_data_df().index) == 0:
+        all_team_data = self.data_accessor.get_all_team_data_df()
+        if len(all_team_data.index) == 0:
             return
 
-        self.log.info("Calculating averages")
-        auto_lower_avg = self.calculate_team_average("auto_lower_hub")
-        auto_upper_avg = self.calculate_team_average("auto_upper_hub")
-        auto_miss_avg = self.calculate_team_average("auto_misses")
-        tele_lower_avg = self.calculate_team_average("teleop_lower_hub")
-        tele_upper_avg = self.calculate_team_average("teleop_upper_hub")
-        tele_miss_avg = self.calculate_team_average("teleop_misses")
-        low_climb_time_avg = self.calculate_team_average_filter("low_rung_climb_time","attempted_low")
-        mid_climb_time_avg = self.calculate_team_average_filter("mid_rung_climb_time","attempted_mid")
-        high_climb_time_avg = self.calculate_team_average_filter("high_rung_climb_time", "attempted_high")
-        traversal_climb_time_avg = self.calculate_team_average_filter("traversal_rung_climb_time", "attempted_traversal")
-
-        self.log.info("Calculating medians")
-        auto_lower_med = self.calculate_team_median("auto_lower_hub")
-        auto_upper_med = self.calculate_team_median("auto_upper_hub")
-        auto_miss_med = self.calculate_team_median("auto_misses")
-        tele_lower_med = self.calculate_team_median("teleop_lower_hub")
-        tele_upper_med = self.calculate_team_median("teleop_upper_hub")
-        tele_miss_med = self.calculate_team_median("teleop_misses")
-        low_climb_time_med = self.calculate_team_median_filter("low_rung_climb_time", 'attempted_low')
-        mid_climb_time_med = self.calculate_team_median_filter("mid_rung_climb_time", "attempted_mid")
-        high_climb_time_med = self.calculate_team_median_filter("high_rung_climb_time", "attempted_high")
-        traversal_climb_time_med = self.calculate_team_median_filter("traversal_rung_climb_time", "attempted_traversal")
+        team_signatures = self.get_team_signatures(all_team_data)
+        if full or not self.team_signatures:
+            self.dirty_teams = None
+        else:
+            self.dirty_teams = {
+                team
+                for team, signature in team_signatures.items()
+                if self.team_signatures.get(team) != signature
+            }
+            if not self.dirty_teams:
+                self.log.info("No new TeamData, skipping calculations")
+                return
+            self.log.info(f"Recalculating {len(self.dirty_teams)} teams")
+            self.team_list = self.team_list[self.team_list["id"].isin(self.dirty_teams)]
+
+        self.log.info("Calculating team metrics")
+        with metrics.stage("calculate aggregates", rows=len(self.team_list.index)):
+            calculated_team_data = self.aggregate_team_metrics(self.get_team_data_df())
 
         self.log.info("Calculating OPR")
-        total_points_opr= self.calculate_opr("total_points")
+        with metrics.stage("calculate opr", rows=len(self.team_list.index)):
+            total_points_opr= self.calculate_opr("total_points")
         # everything opr but climb
         # points scored during auto
         # points scored during teleop
         # run a sim for 2020 vahay and check reliability of 
 
-        self.log.info("Calculating percentages")
-        shooting_zone_pct = self.calculate_team_percentages(
-            [
-                "from_fender",
-                "from_elsewhere_in_tarmac",
-                "from_launchpad",
-                "from_terminal",
-                "from_hangar_zone",
-                "from_elsewhere_on_field"
-            ],
-            replacements={True: 1, False: 0},
-        )
-        auto_shooting_zone_pct = self.calculate_team_percentages(
-            [
-                "auto_from_fender",
-                "auto_from_elsewhere_in_tarmac",
-                "auto_from_launchpad",
-                "auto_from_terminal",
-                "auto_from_hangar_zone",
-                "auto_from_elsewhere_on_field"
-            ],
-            replacements={True: 1, False: 0},
-        )
-        attempted_climbs_pct = self.calculate_team_percentages(
-            [
-                "attempted_low",
-                "attempted_mid",
-                "attempted_high",
-                "attempted_traversal"
-            ],
-            replacements={True: 1, False: 0},
-        )
-        climb_type_pct = self.calculate_team_percentages(
-            ["final_climb_type"],
-            one_hot_encoded=False,
-            possible_values=[ClimbType.traversal, ClimbType.high, ClimbType.mid, ClimbType.low, ClimbType.none],
-        )
-        shoot_pct = self.calculate_team_percentages_quant(
-            ["teleop_upper_hub", "teleop_lower_hub", "teleop_misses"]
-        )
-
-        comments = self.group_notes()
-
         self.log.info("Adding data to SQL")
-        self.team_data_to_sql(
-            [
-                auto_lower_avg,
-                auto_upper_avg,
-                auto_miss_avg,
-                tele_lower_avg,
-                tele_upper_avg,
-                tele_miss_avg,
-                low_climb_time_avg,
-                mid_climb_time_avg,
-                high_climb_time_avg,
-                traversal_climb_time_avg,
-                auto_lower_med,
-                auto_upper_med,
-                auto_miss_med,
-                tele_lower_med,
-                tele_upper_med,
-                tele_miss_med,
-                low_climb_time_med,
-                mid_climb_time_med,
-                high_climb_time_med,
-                traversal_climb_time_med,
-                shooting_zone_pct,
-                auto_shooting_zone_pct,
-                attempted_climbs_pct,
-                climb_type_pct,
-                shoot_pct,
-                comments,
-            ],
-            {
-                "from_fender_pct": "from_fender_usage",
-                "from_elsewhere_in_tarmac_pct": "from_elsewhere_in_tarmac_usage",
-                "from_launchpad_pct": "from_launchpad_usage",
-                "from_terminal_pct": "from_terminal_usage",
-                "from_hangar_zone_pct": "from_hangar_zone_usage",
-                "from_elsewhere_on_field_pct": "from_elsewhere_on_field_usage",
-                "auto_from_fender_pct": "auto_from_fender_usage",
-                "auto_from_elsewhere_in_tarmac_pct": "auto_from_elsewhere_in_tarmac_usage",
-                "auto_from_launchpad_pct": "auto_from_launchpad_usage",
-                "auto_from_terminal_pct": "auto_from_terminal_usage",
-                "auto_from_hangar_zone_pct": "auto_from_hangar_zone_usage",
-                "auto_from_elsewhere_on_field_pct": "auto_from_elsewhere_on_field_usage",
-                "attempted_low_pct": "attempted_low_usage",
-                "attempted_mid_pct":"attempted_mid_usage",
-                "attempted_high_pct": "attempted_high_usage",
-                "attempted_traversal_pct": "attempted_traversal_usage",
-                "final_climb_type_ClimbType.traversal": "traversal_rung_pct",
-                "final_climb_type_ClimbType.high": "high_rung_pct",
-                "final_climb_type_ClimbType.mid": "mid_rung_pct",
-                "final_climb_type_ClimbType.low": "low_rung_pct",
-                "final_climb_type_ClimbType.none": "none_pct",
-                "teleop_high_goal_pct": "teleop_high_pct",
-                "teleop_low_goal_pct": "teleop_low_pct",
-                "teleop_misses_pct": "teleop_miss_pct",
-            },
-        )
+        with metrics.stage("calculate save", rows=len(self.team_list.index)):
+            self.team_data_to_sql(calculated_team_data)
+        self.team_signatures = team_signatures
+        self.dirty_teams = None
         # Consistency scores
         # ELO
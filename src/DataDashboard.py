@@ -1,6 +1,7 @@
 import datetime
 import itertools
 from flask import Flask, render_template, jsonify
+from flask import json as flask_json
 from flask.globals import request
 import re
 from DataCalculator import DataCalculator
@@ -20,7 +21,8 @@ from Config import Config
 from DataAccessor import DataAccessor
 from loguru import logger
 import json
-from SQLObjects import Alliance, Base
+from SQLObjects import Alliance, Base, Prediction, team_datum_json_from_submission
+from Metrics import prometheus_text
 from flask_cors import CORS
 from waitress import serve
 
@@ -33,22 +35,14 @@ config = Config(logger, False)
 
 
 def update_data_accessor(data_accessor=None):
-    engine = create_engine(
-        f"mysql+pymysql://{config.db_user}:{config.db_pwd}@{config.db_host}/scouting"
-    )
-    session_template = sessionmaker()
-    session_template.configure(bind=engine)
-    session = session_template()
-    connection = engine.connect()
-
-    data_accessor.engine = engine
-    data_accessor.session = session
-    data_accessor.connection = connection
+    # Start a fresh session so we see data written by the ingest, reusing the pooled engine
+    data_accessor.session.close()
+    data_accessor.session = session_template()
 
     return data_accessor
 
 
-engine = create_engine(f"mysql+pymysql://{config.db_user}:{config.db_pwd}@{config.db_host}/scouting")
+engine = config.get_engine()
 session_template = sessionmaker()
 session_template.configure(bind=engine)
 session = session_template()
@@ -56,6 +50,15 @@ connection = engine.connect()
 data_accessor = DataAccessor(engine, session, connection, config)
 calculated_team_data_object = None
 alliance_info = data_accessor.get_alliance_associations(json=True)
+# The last /api/get_match_data response and the data version it was built from
+match_data_cache = {"version": None, "response": None}
+
+
+@app.teardown_request
+def rollback_failed_request(exception=None):
+    # A failed write leaves the shared session unusable until it is rolled back, which would fail every later request
+    if exception is not None:
+        data_accessor.session.rollback()
 
 
 @app.route("/warnings", methods=["GET", "POST"])
@@ -66,7 +69,6 @@ def warnings():
         grouped_warnings = {
             c: [m.content for m in warnings if m.category == c] for c in categories
         }
-        data_accessor.engine.dispose()
         return grouped_warnings
     else:
         d = request.json
@@ -74,7 +76,6 @@ def warnings():
             data_accessor.update_warning(i, 1)
         for i in d["watch"]:
             data_accessor.update_warning(i, 0)
-        data_accessor.engine.dispose()
         return ""
 
 
@@ -90,28 +91,48 @@ def get_status():
 
 @app.route("/api/get_match_data", methods=["GET"])
 def get_match_data():
+    # End the session's transaction so the version below and the data are current
+    data_accessor.session.commit()
+    data_version = data_accessor.get_info("Data Version")
+    version = (
+        data_version.value if data_version is not None else None,
+        data_accessor.data_versions[Prediction.__tablename__],
+    )
+    if match_data_cache["version"] != version or match_data_cache["response"] is None:
+        match_data_cache["response"] = flask_json.dumps(build_match_data())
+        match_data_cache["version"] = version
+
+    return app.response_class(match_data_cache["response"], mimetype="application/json")
+
+
+def build_match_data():
+    # Load everything up front instead of querying per match and per team
     all_matches = [match_object.serialize for match_object in data_accessor.get_match_datum()]
+    all_alliances = data_accessor.get_alliance_associations(dictionary=True)
+    all_predictions = {}
+    for prediction in data_accessor.get_predictions():
+        all_predictions.setdefault(prediction.match_id, []).append(prediction)
+    all_calculated_team_data = {
+        calculated_team_datum.team_id: calculated_team_datum
+        for calculated_team_datum in data_accessor.temp_calc_team_data()
+    }
+
     jsonoutput = {}
     for match in all_matches:
         match_id = list(match.keys())[0] # i cannot think of a more efficient way to do this
         jsonoutput[match_id] = match[match_id]
-        all_teams_for_match = data_accessor.get_alliance_associations(
-            match_id = match_id,
-            dictionary = True
-        )[match_id]
+        all_teams_for_match = all_alliances.get(match_id, {"red": ["", "", ""], "blue": ["", "", ""]})
         jsonoutput[match_id]["currMatch"]["alliances"] = all_teams_for_match
-        predictions_list = data_accessor.get_predictions(match_id=match_id)
-        jsonoutput[match_id]["currMatchData"]["predictions"] = [sum([1 for i in predictions_list if i.prediction == Alliance.red])/len(),sum([1 for i in predictions_list if i.prediction == Alliance.blue])/len()] #TODO figure out predictions
+        predictions_list = all_predictions.get(match_id, [])
+        prediction_count = max(len(predictions_list), 1)
+        jsonoutput[match_id]["currMatchData"]["predictions"] = [sum([1 for i in predictions_list if i.prediction == Alliance.red])/prediction_count,sum([1 for i in predictions_list if i.prediction == Alliance.blue])/prediction_count] #TODO figure out predictions
         jsonoutput[match_id]["team_metrics"] = {}
-        for team_id in all_teams_for_match["red"]:
-            jsonoutput[match_id]["team_metrics"][team_id] = data_accessor.get_calculated_team_data(team_id = team_id).serialize[team_id[3:]]
-            jsonoutput[match_id]["team_metrics"][team_id]["alliance"] = "red"
-        for team_id in all_teams_for_match["blue"]:
-            jsonoutput[match_id]["team_metrics"][team_id] = data_accessor.get_calculated_team_data(team_id = team_id).serialize[team_id[3:]]
-            jsonoutput[match_id]["team_metrics"][team_id]["alliance"] = "blue"
-
-        # for team_id in list(itertools.chain(*list(all_teams_for_match.values()))):
-        #     jsonoutput[match_id]["team_metrics"][team_id] = data_accessor.get_calculated_team_data(team_id = team_id).serialize[team_id[3:]]
+        for color in ["red", "blue"]:
+            for team_id in all_teams_for_match[color]:
+                if team_id not in all_calculated_team_data:
+                    continue
+                jsonoutput[match_id]["team_metrics"][team_id] = all_calculated_team_data[team_id].serialize[team_id[3:]]
+                jsonoutput[match_id]["team_metrics"][team_id]["alliance"] = color
 
     return jsonoutput
 
@@ -152,6 +173,16 @@ def get_api_status():
         "Status": data_accessor.get_info("Status").serialize["Status"]
     }
 
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    # The ingest stores its last few refreshes in the Metrics info row
+    data_accessor.session.commit()
+    info = data_accessor.get_info("Metrics")
+    refreshes = json.loads(info.value) if info is not None else []
+    return app.response_class(
+        prometheus_text(refreshes), mimetype="text/plain; version=0.0.4"
+    )
+
 @app.route("/api/teamdatum/<teamid>", methods=["GET"])
 def get_team_datum(teamid):
     if len(teamid) < 3 or "frc" != teamid[0:3]:
@@ -164,57 +195,14 @@ def get_team_datum(teamid):
 def add_team_datum():
     data_accessor.session.commit()
     data = request.json
-    # Year specific config
-
-    climb_type_map = {
-        "0": "none",
-        "1": "low",
-        "2": "mid",
-        "3": "high",
-        "4": "traversal"
-    }
     data_accessor.add_team_datum(
         team_id =  str(data.get("team_number")),
         scout_id = data.get("scout_id"),
         match_id = data.get("match_key"),
         alliance = Alliance.red if data.get("alliance") == "red" else Alliance.blue,
         driver_station = data.get("driver_station"),
-        team_datum_json = {
-            "preloaded_cargo": bool(data.get("preloaded_cargo")),
-            "auto_lower_hub": data.get("auto_lower_hub"),
-            "auto_upper_hub": data.get("auto_upper_hub"),
-            "auto_misses": data.get("auto_misses"),
-            "auto_human_scores": data.get("auto_human_score"),
-            "auto_human_misses": data.get("auto_human_misses"),
-            "taxied": bool(data.get("taxied")),
-            "auto_notes": data.get("auto_notes"),
-            "teleop_lower_hub": data.get("teleop_lower_hub"),
-            "teleop_upper_hub": data.get("teleop_upper_hub"),
-            "teleop_misses": data.get("teleop_misses"),
-            "from_fender": True if '0' in data.get("shooting_zones") else False, # TODO need to find a better way do do this
-            "from_elsewhere_in_tarmac": True if '1' in data.get("shooting_zones") else False, # TODO need to find a better way do do this
-            "from_launchpad": True if '2' in data.get("shooting_zones") else False, # TODO need to find a better way do do this
-            "from_terminal": True if '3' in data.get("shooting_zones") else False, # TODO need to find a better way do do this
-            "from_hangar_zone": True if '4' in data.get("shooting_zones") else False, # TODO need to find a better way do do this
-            "from_elsewhere_on_field": True if '5' in data.get("shooting_zones") else False, 
-            "auto_from_fender": True if '0' in data.get("auto_shooting_zones") else False, # TODO need to find a better way do do this
-            "auto_from_elsewhere_in_tarmac": True if '1' in data.get("auto_shooting_zones") else False, # TODO need to find a better way do do this
-            "auto_from_launchpad": True if '2' in data.get("auto_shooting_zones") else False, # TODO need to find a better way do do this
-            "auto_from_terminal": True if '3' in data.get("auto_shooting_zones") else False, # TODO need to find a better way do do this
-            "auto_from_hangar_zone": True if '4' in data.get("auto_shooting_zones") else False, # TODO need to find a better way do do this
-            "auto_from_elsewhere_on_field": True if '5' in data.get("auto_shooting_zones") else False, 
-            "teleop_notes": data.get("teleop_notes"),
-            "attempted_low": data.get("attempted_low"),
-            "low_rung_climb_time": data.get("low_climb_time"),
-            "attempted_mid": data.get("attempted_mid"),
-            "mid_rung_climb_time": data.get("mid_climb_time"),
-            "attempted_high": data.get("attempted_high"),
-            "high_rung_climb_time": data.get("high_climb_time"),
-            "attempted_traversal": data.get("attempted_traversal"),
-            "traversal_rung_climb_time": data.get("traversal_climb_time"),
-            "defense": data.get("defense_time"),
-            "final_climb_type": climb_type_map[str(data.get("final_climb_type"))]
-        })
+        team_datum_json = team_datum_json_from_submission(data),
+    )
     return ""
 
 @app.route("/api/add_prediction", methods=["POST"])
@@ -235,7 +223,6 @@ def change_warning():
         id = int(data["warning_id"]),
         ignore = bool(data["ignore"])
     )
-    data_accessor.engine.dispose()
     return ""
 
 @app.route("/api/change_scout", methods=["POST"])
@@ -0,0 +1,109 @@
+import enum
+import os
+import time
+
+import pyarrow
+from pyarrow import feather
+from loguru import logger
+from sqlalchemy import Enum
+
+from SQLObjects import CalculatedTeamDatum, MatchDatum, TeamDatum
+
+
+class DataExporter:
+    """Snapshots the tables visualizations read into Arrow IPC files, so they can be read without the database"""
+
+    def __init__(self, data_accessor, directory="./snapshots"):
+        """
+
+        :param data_accessor: The accessor to read tables and their data versions from
+        :type data_accessor: DataAccessor
+        :param directory: Where to write the snapshots, one <table>.arrow file per table
+        :type directory: str
+        """
+        self.log = logger.opt(colors=True)
+        self.data_accessor = data_accessor
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+        self.tables = {
+            MatchDatum: self.data_accessor.get_all_match_data_df,
+            TeamDatum: self.data_accessor.get_all_team_data_df,
+            CalculatedTeamDatum: self.data_accessor.get_all_calculated_team_data_df,
+        }
+        # The data version each table was last exported at
+        self.exported_versions = {}
+
+    def path(self, model):
+        return os.path.join(self.directory, f"{model.__tablename__}.arrow")
+
+    @staticmethod
+    def to_arrow(model, df, version):
+        """
+
+        Converts a table's DataFrame to Arrow, storing Enums by name like the database does.
+
+        :param model: The model the DataFrame was read from
+        :type model: Type[Base]
+        :param df: The table
+        :type df: pandas.DataFrame
+        :param version: The table's data version, stored in the schema metadata
+        :type version: int
+        :rtype: pyarrow.Table
+        """
+        enum_columns = [
+            column.name
+            for column in model.__table__.columns
+            if isinstance(column.type, Enum) and column.name in df.columns
+        ]
+        df = df.assign(
+            **{
+                column: df[column].map(
+                    lambda value: value.name if isinstance(value, enum.Enum) else value
+                )
+                for column in enum_columns
+            }
+        )
+        table = pyarrow.Table.from_pandas(df, preserve_index=False)
+        return table.replace_schema_metadata(
+            {
+                **(table.schema.metadata or {}),
+                b"data_version": str(version).encode(),
+                b"exported": str(time.time()).encode(),
+            }
+        )
+
+    def export(self):
+        """
+
+        Writes a snapshot of every table that changed since it was last exported.
+
+        Each file is written next to the old one and swapped in with os.replace, so a reader
+        never sees a partial snapshot. The files are uncompressed so they can be memory-mapped.
+
+        :return: Names of the tables that were written
+        :rtype: List[str]
+        """
+        # Scouting data can be inserted by the dashboard, which doesn't bump this process's versions
+        self.data_accessor.sync_data_version(TeamDatum)
+        written = []
+        for model, get_df in self.tables.items():
+            table_name = model.__tablename__
+            path = self.path(model)
+            version = self.data_accessor.data_versions[table_name]
+            if self.exported_versions.get(table_name) == version and os.path.exists(path):
+                continue
+
+            table = self.to_arrow(model, get_df(), version)
+            try:
+                feather.write_feather(table, f"{path}.tmp", compression="uncompressed")
+                os.replace(f"{path}.tmp", path)
+            except OSError as e:
+                # On Windows a snapshot that is open can't be replaced, so try again after the next refresh
+                self.log.warning(f"Could not write the {table_name} snapshot: {e}")
+                continue
+            self.exported_versions[table_name] = version
+            written.append(table_name)
+
+        if written:
+            self.log.info(f"Exported snapshots of {', '.join(written)}")
+        return written
@@ -1,10 +1,13 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import gspread
+import ijson
 import numpy
 import pandas as pd
 import requests
 from loguru import logger
+from requests.adapters import HTTPAdapter
 from sqlalchemy import (
     Column,
     ForeignKey,
@@ -19,6 +22,8 @@ from sqlalchemy import (
 from sqlalchemy.orm import relationship
 import pytz
 from DataAccessor import DataAccessor
+from Metrics import metrics
+from ResponseCache import ResponseCache
 
 from SQLObjects import (
     Alliance,
@@ -26,7 +31,6 @@ from SQLObjects import (
     CompLevel,
     Match,
     Team,
-    flatten_json,
     MatchDatum,
     TeamDatum,
     match_data_map,
@@ -36,7 +40,7 @@ from SQLObjects import (
 # Main Input Object that will handle all the input
 class DataInput:
     def __init__(
-        self, engine, session, connection, data_accessor: DataAccessor, config
+        self, engine, session, connection, data_accessor: DataAccessor, config, event=None
     ):
         # Get logger
         self.log = logger.opt(colors=True)
@@ -53,17 +57,26 @@ class DataInput:
         self.session = session
         self.connection = connection
         self.data_accessor = data_accessor
-        self.event = self.config.year + self.config.event
+        # Each event is ingested by its own DataInput
+        self.event = event if event is not None else self.config.get_event_keys()[0]
 
         # Exists to use a year specific object types
         self.log.info("Initializing Variables")
 
-        # Set as early as possible to make sure the first TBA response on load will provide data
-        self.tba_last_modified = "Wed, 1 Jan 1000 00:00:01 GMT"
+        # Validator of the last match list that was ingested, None so the first response is always used
+        self.tba_last_modified = None
         self.sheet_last_modified = None
         self.last_tba_time = 0
         self.last_tba_match = None
 
+        # One keep-alive session for every TBA and simulator request, shared by the fetch threads
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+        # Keeps TBA responses across restarts so they only need to be revalidated
+        self.tba_cache = ResponseCache(self.http, self.config.cache_dir)
+
         # Object to represent worksheet
         #gc = gspread.service_account(f"./config/{self.config.google_credentials}")
         #if self.config.simulation:
@@ -76,7 +89,7 @@ class DataInput:
         self.log.info("Loading matches and teams")
         self.load_matches_and_teams()
         self.data_accessor.session.commit()
-
+        self.resume_from_database()
 
         self.log.info("DataInput Loaded!")
 
@@ -86,54 +99,171 @@ class DataInput:
 
         Gets Data from TBA and places it in SQL.
 
-        :param event: Event Key
-        :type event: str
         :return: TBA request status code
         :rtype: int
         """
-        self.log.info("Loading TBA Data")
+        status_code, occurred_data = self.fetch_new_matches()
+        self.store_matches(occurred_data)
+        return status_code
+
+    def fetch_new_matches(self):
+        """
+
+        Gets the event's match list from TBA and parses the matches posted since the last ingested one.
+
+        Nothing is written to the database, so the DataInputs of different events can fetch at the same time.
+
+        :return: TBA request status code and the new matches
+        :rtype: Tuple[int, List[Dict]]
+        """
+        self.log.info(f"Loading TBA Data for {self.event}")
         headers = {
             "X-TBA-Auth-Key": self.config.tba_key,
-            "If-Modified-Since": self.tba_last_modified,
         }
-        if self.config.simulation:
-            url = f"{self.config.simulator_url}/matches"
-        else:
-            url = f"https://www.thebluealliance.com/api/v3/event/{self.event}/matches"
-
-        r = requests.get(url, headers=headers)
+        r = self.get_tba_response(self.get_match_url(), headers=headers)
 
         # Stop if we don't get a proper response
         if r.status_code != 200 and r.status_code != 304:
             self.log.error(
                 f"Data not successfully retrieved with status code {r.status_code}"
             )
-            return r.status_code
-        elif r.status_code == 304:
-            self.log.info("TBA has not been changed. It will not be updated.")
-            return r.status_code
-        self.log.info("Data successfully retrieved")
-        self.tba_last_modified = r.headers["Last-Modified"]
+            return r.status_code, []
+        elif r.validator is not None and r.validator == self.tba_last_modified:
+            self.log.info(f"TBA has not been changed for {self.event}. It will not be updated.")
+            return 304, []
+        if r.from_cache:
+            self.log.info("Data successfully retrieved from the cache")
+        else:
+            self.log.info("Data successfully retrieved")
+        self.tba_last_modified = r.validator
         self.log.info("Normalizing and Cleaning Data")
-        # Flatten the data and sort it so matches are entered in a sane way
-        occurred_data = sorted(
-            filter(lambda x: x["post_result_time"] > self.last_tba_time, r.json()),
-            key=lambda x: x["post_result_time"],
-        )
+        return r.status_code, self.parse_new_matches(r.content)
+
+    def store_matches(self, occurred_data):
+        """
+
+        Adds MatchData for matches returned by fetch_new_matches.
+
+        :param occurred_data: The new matches, sorted by post_result_time
+        :type occurred_data: List[Dict]
+        """
+        metrics.count_rows(len(occurred_data))
         if len(occurred_data) == 0:
             return
         self.last_tba_time = occurred_data[-1]["post_result_time"]
         self.last_tba_match = occurred_data[-1]["key"]
-        matches = [flatten_json(i) for i in occurred_data]
 
         self.log.info("Adding Match Data")
         # Add matches
-        for match in matches:
-            self.data_accessor.add_match_datum(match["key"], match)
+        self.data_accessor.add_match_data(occurred_data)
 
         self.session.commit()
-        self.log.info("Finished getting TBA Data.")
-        return r.status_code
+        self.log.info(f"Finished getting TBA Data for {self.event}.")
+
+    def get_tba_response(self, url, headers=None, load_body=True):
+        """
+
+        Gets a TBA or simulator URL through the response cache.
+
+        :param url: The URL to GET
+        :type url: str
+        :param headers: Headers to send
+        :type headers: Dict[str, str]
+        :param load_body: Whether to read the cached body when TBA reports no change
+        :type load_body: bool
+        :return: The response
+        :rtype: ResponseCache.CachedResponse
+        """
+        return self.tba_cache.get(url, headers=headers, load_body=load_body)
+
+    def get_match_url(self):
+        if self.config.simulation:
+            return f"{self.config.simulator_url}/matches"
+        return f"https://www.thebluealliance.com/api/v3/event/{self.event}/matches"
+
+    def tba_changed(self):
+        """
+
+        Asks TBA whether the match list changed since it was last ingested, without reading any cached body.
+
+        :return: Whether get_tba_data would find a new match list
+        :rtype: bool
+        """
+        headers = {
+            "X-TBA-Auth-Key": self.config.tba_key,
+        }
+        r = self.get_tba_response(self.get_match_url(), headers=headers, load_body=False)
+        if r.status_code != 200 and r.status_code != 304:
+            self.log.warning(f"TBA poll failed with status code {r.status_code}")
+            return False
+        return r.validator is None or r.validator != self.tba_last_modified
+
+    def resume_from_database(self):
+        """
+
+        Picks up from the last match already in the database so a restart only ingests new matches.
+
+        """
+        last_match_datum = self.data_accessor.get_last_match_datum(self.event)
+        if last_match_datum is None:
+            return
+        post_result_time = last_match_datum.post_result_time
+        # MySQL hands back the UTC time it was given without a timezone
+        if post_result_time.tzinfo is None:
+            post_result_time = pytz.utc.localize(post_result_time)
+        self.last_tba_time = int(post_result_time.timestamp())
+        self.last_tba_match = last_match_datum.match_id
+        self.log.info(f"Resuming after {self.last_tba_match}")
+
+    def parse_new_matches(self, content):
+        """
+
+        Streams through a TBA match list, only building the matches posted after the last ingested one.
+
+        TBA sorts each match's keys, so event_key and post_result_time are read before the score breakdown
+        and the rest of an already ingested match is skipped without being decoded into dicts. Matches of
+        other events, which the simulator serves alongside this one's, are skipped the same way.
+
+        :param content: The raw match list response body
+        :type content: bytes
+        :return: The new matches, sorted so they are entered in a sane way
+        :rtype: List[Dict]
+        """
+        matches = []
+        builder = None
+        for prefix, event, value in ijson.parse(content, use_float=True):
+            if prefix == "item" and event == "start_map":
+                builder = ijson.ObjectBuilder()
+            if builder is None:
+                continue
+            # Matches that have not been played yet have no post_result_time
+            if (prefix == "item.event_key" and value != self.event) or (
+                prefix == "item.post_result_time" and (value is None or value <= self.last_tba_time)
+            ):
+                builder = None
+                continue
+            builder.event(event, value)
+            if prefix == "item" and event == "end_map":
+                if builder.value.get("post_result_time") is not None:
+                    matches.append(builder.value)
+                builder = None
+        return sorted(matches, key=lambda x: x["post_result_time"])
+
+    def fetch_all(self, urls, headers=None):
+        """
+
+        Requests several URLs at once over the shared session, revalidating cached responses.
+
+        :param urls: URLs to GET
+        :type urls: List[str]
+        :param headers: Headers to send with every request
+        :type headers: Dict[str, str]
+        :return: The responses in the same order as urls
+        :rtype: List[ResponseCache.CachedResponse]
+        """
+        # Only used while loading, so the threads are not kept around between refreshes
+        with ThreadPoolExecutor(max_workers=max(1, len(urls))) as executor:
+            return list(executor.map(lambda url: self.get_tba_response(url, headers=headers), urls))
 
     def get_sheet_data(self, event):
         """
@@ -217,8 +347,7 @@ class DataInput:
                 f"https://www.thebluealliance.com/api/v3/event/{self.event}/teams/keys"
             )
 
-        match_r = requests.get(match_url, headers=headers)
-        team_r = requests.get(team_url, headers=headers)
+        match_r, team_r = self.fetch_all([match_url, team_url], headers)
 
         # Stop if we don't get a proper response
         if (
@@ -233,26 +362,37 @@ class DataInput:
             return [match_r.status_code, team_r.status_code]
 
         self.log.info("Data successfully retrieved")
+        self.log.info("Adding Teams")
+        self.data_accessor.add_teams(team_r.json())
+
         self.log.info("Adding Matches")
+        # The simulator serves the matches of every event at one URL
+        matches = [match for match in match_r.json() if match["event_key"] == self.event]
+        self.data_accessor.add_matches(
+            [
+                {
+                    "id": match["key"],
+                    "comp_level": match["comp_level"],
+                    "set_number": match["set_number"],
+                    "match_number": match["match_number"],
+                    "event_key": match["event_key"],
+                }
+                for match in matches
+            ]
+        )
 
-        for team in team_r.json():
-            self.data_accessor.add_team(team)
-            
-        for match in match_r.json():
-            self.data_accessor.add_match(
-                match["key"],
-                CompLevel(match["comp_level"]),
-                match["set_number"],
-                match["match_number"],
-                match["event_key"],
-            )
-            for color in ["red", "blue"]:
-                for index, team in enumerate(match["alliances"][color]["team_keys"]):
-                    self.data_accessor.add_alliance_association(
-                        match["key"],
-                        Alliance(color),
-                        team,
-                        index+1
-                    )
-
-        
+        self.log.info("Adding Alliances")
+        self.data_accessor.add_alliance_associations(
+            [
+                {
+                    "match_id": match["key"],
+                    "alliance": color,
+                    "team_id": team,
+                    "driver_station": index + 1,
+                    "event_key": match["event_key"],
+                }
+                for match in matches
+                for color in ["red", "blue"]
+                for index, team in enumerate(match["alliances"][color]["team_keys"])
+            ]
+        )
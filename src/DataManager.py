@@ -1,5 +1,6 @@
 import time
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 from loguru import logger
 from sqlalchemy import create_engine, text
@@ -9,13 +10,27 @@ from requests import post, get
 from Config import Config
 from DataAccessor import DataAccessor
 from DataCalculator import DataCalculator
+from DataExporter import DataExporter
 from DataInput import DataInput
 from DataProcessor import DataProcessor
-from SQLObjects import Base
+from Metrics import metrics
+from SchemaMigrator import SchemaMigrator
+from SQLObjects import Base, TeamDatum
 
 
 class DataManager:
-    def __init__(self, skip_validation=False, interval=180, simulation=False):
+    def __init__(
+        self,
+        skip_validation=False,
+        interval=180,
+        simulation=False,
+        full_recalculation=False,
+        reset=False,
+        poll_interval=2,
+        tba_poll_interval=15,
+        debounce=5,
+        max_debounce=30,
+    ):
         self.log = logger.opt(colors=True)
 
         self.log.info("Starting Scouting-Data-Ingest")
@@ -38,52 +53,113 @@ class DataManager:
 
         # Connecting to MySQL
         self.log.info("Connecting to MySQL")
-        self.engine = create_engine(
-            f"mysql+pymysql://{self.config.db_user}:{self.config.db_pwd}@{self.config.db_host}/scouting"
-        )
+        self.engine = self.config.get_engine()
+        metrics.watch(self.engine)
         self.session_template = sessionmaker()
         self.session_template.configure(bind=self.engine)
         self.session = self.session_template()
         self.connection = self.engine.connect()
 
-        self.log.info("Erasing existing data")
-        self.connection.execute(f"drop table if exists alliance_associations")           
-        Base.metadata.drop_all(self.engine)
-        self.session.commit()
+        if reset:
+            self.log.warning("Erasing existing data")
+            self.connection.execute(f"drop table if exists alliance_associations")
+            Base.metadata.drop_all(self.engine)
+            self.session.commit()
+        else:
+            self.log.info("Resuming with existing data")
+        # Only creates tables that don't exist yet, the migration updates the ones that do
         Base.metadata.create_all(self.engine)
+        SchemaMigrator(self.engine).migrate()
 
         self.log.info("Loading Components")
         self.data_accessor = DataAccessor(
             self.engine, self.session, self.connection, self.config
         )
-        self.data_input = DataInput(
+        # One DataInput per event, each resuming from its own last match
+        self.data_inputs = {
+            event: DataInput(
+                self.engine,
+                self.session,
+                self.connection,
+                self.data_accessor,
+                self.config,
+                event=event,
+            )
+            for event in self.config.get_event_keys()
+        }
+        # Fetches and polls for different events run at the same time. There can be no events when validation is skipped
+        self.fetch_executor = ThreadPoolExecutor(max_workers=max(1, len(self.data_inputs)))
+        # Checks and calculations run on their own threads, so each gets its own session
+        self.check_session = self.session_template()
+        self.calculate_session = self.session_template()
+        self.data_processor = DataProcessor(
+            self.data_accessor.clone(self.check_session), self.config
+        )
+        self.data_calculator = DataCalculator(
             self.engine,
-            self.session,
+            self.calculate_session,
             self.connection,
-            self.data_accessor,
+            self.data_accessor.clone(self.calculate_session),
             self.config,
         )
-        self.data_processor = DataProcessor(self.data_accessor, self.config)
-        self.data_calculator = DataCalculator(
-            self.engine, self.session, self.connection, self.data_accessor, self.config
-        )
+        # Snapshots of the finished data for Tableau and notebooks, so they don't query the live database
+        self.data_exporter = DataExporter(self.data_accessor, self.config.snapshot_dir)
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        # Futures of the checks and calculations that are still running, by stage
+        self.pending_stages = {}
+        # The metrics of the refresh those stages belong to
+        self.pending_refresh = None
+        # Seconds each stage of the last refresh took
+        self.stage_timings = {}
 
+        # The longest the data can go without a refresh, even when nothing seems to have changed
         self.interval = interval
+        self.poll_interval = poll_interval
+        # Each event is polled on its own cadence, EVENT_POLL_INTERVALS overrides tba_poll_interval
+        self.tba_poll_intervals = {
+            event: self.config.get_poll_interval(event, tba_poll_interval)
+            for event in self.data_inputs
+        }
+        self.last_tba_polls = {event: 0 for event in self.data_inputs}
+        # A burst of changes is refreshed once it has been quiet for debounce seconds, or after max_debounce
+        self.debounce = debounce
+        self.max_debounce = max_debounce
+        self.full_recalculation = full_recalculation
         self.data_accessor.add_info("Status", "Paused")
         self.data_accessor.add_info("Task", "Waiting")
         self.data_accessor.add_info("Last Match", "N/A")
+        # Bumped after every refresh so the dashboard knows when its cached responses are stale
+        self.data_accessor.add_info("Data Version", "0")
+        # The stage metrics of the last few refreshes, for the dashboard's /metrics
+        self.data_accessor.add_info("Metrics", "[]")
 
         self.log.info("Loaded Scouting-Data-Ingest!")
 
-    def get_data(self):
+    def get_data(self, events=None):
         """
+
         Gets Data from TBA and Google Sheets
 
+        The match lists of every event are fetched at the same time, and then stored one event at a time
+        since the session is not thread safe.
+
+        :param events: Keys of the events to get data for, every event if None
+        :type events: Iterable[str]
         """
         self.data_accessor.update_info("Task", "Getting Data")
-        self.log.info(f"Getting data for {self.config.year + self.config.event}")
-        self.data_input.get_tba_data()
-        self.session.commit()
+        data_inputs = [
+            self.data_inputs[event] for event in (self.data_inputs if events is None else events)
+        ]
+        if not data_inputs:
+            return
+        self.log.info(f"Getting data for {', '.join(data_input.event for data_input in data_inputs)}")
+        with metrics.stage("get_tba_data"):
+            fetched = list(
+                self.fetch_executor.map(lambda data_input: data_input.fetch_new_matches(), data_inputs)
+            )
+            for data_input, (status_code, occurred_data) in zip(data_inputs, fetched):
+                data_input.store_matches(occurred_data)
+            self.session.commit()
 
     def check_data(self):
         """
@@ -91,38 +167,202 @@ class DataManager:
         Checks the data for errors.
 
         """
-        self.data_accessor.update_info("Task", "Checking Data")
         self.data_processor.check_data()
 
     def calculate_data(self):
         """
         Calculates TeamData
         """
-        self.data_accessor.update_info("Task", "Performing Calculations on data")
-        self.data_calculator.calculate_team_data()
+        self.data_calculator.calculate_team_data(full=self.full_recalculation)
+
+    @staticmethod
+    def run_stage(name, stage, session, refresh):
+        """
+
+        Runs a stage on a worker thread and commits its session.
+
+        :param name: Name the stage is recorded under
+        :type name: str
+        :param stage: The stage to run
+        :type stage: Callable[[], None]
+        :param session: The session the stage writes through
+        :type session: sqlalchemy.orm.Session
+        :param refresh: The refresh to record the stage's metrics into
+        :type refresh: Dict
+        :return: How many seconds the stage took
+        :rtype: float
+        """
+        start_time = time.perf_counter()
+        with metrics.use_refresh(refresh), metrics.stage(name):
+            try:
+                stage()
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+        return time.perf_counter() - start_time
 
-    def refresh(self):
+    def refresh(self, wait=True, events=None):
         """
+
         Gets Data and then checks it and calculates new data.
 
+        Checking and calculating run in parallel workers. Getting the data for the next refresh
+        can overlap them, since they only have to finish before they are started again.
+
+        :param wait: Whether to wait for the checks and calculations, otherwise finish_refresh completes the refresh
+        :type wait: bool
+        :param events: Keys of the events to get TBA data for, every event if None
+        :type events: Iterable[str]
         """
         self.data_accessor.update_info("Status", "Running")
         self.data_accessor.session.commit()
-        self.get_data()
-        self.check_data()
-        self.calculate_data()
+        refresh = metrics.start_refresh()
+        start_time = time.perf_counter()
+        self.get_data(events)
+        get_data_time = time.perf_counter() - start_time
+
+        self.finish_refresh(wait=True)
+        self.stage_timings = {"get_data": get_data_time}
+        self.pending_refresh = refresh
+        self.data_accessor.update_info("Task", "Checking and Calculating Data")
+        self.pending_stages = {
+            "check_data": self.executor.submit(
+                self.run_stage, "check_data", self.check_data, self.check_session, refresh
+            ),
+            "calculate_data": self.executor.submit(
+                self.run_stage, "calculate_data", self.calculate_data, self.calculate_session, refresh
+            ),
+        }
+        if wait:
+            self.finish_refresh(wait=True)
+
+    def finish_refresh(self, wait=False):
+        """
+
+        Completes a refresh once its checks and calculations are done and exports the tables that changed.
+
+        If a stage failed, the refresh is recorded as failed, nothing is exported and the data version
+        isn't bumped, so the dashboard keeps serving the data of the last refresh that finished.
+
+        :param wait: Whether to block until they are done
+        :type wait: bool
+        :return: Whether a refresh was completed
+        :rtype: bool
+        """
+        if not self.pending_stages:
+            return False
+        if not wait and not all(future.done() for future in self.pending_stages.values()):
+            return False
+
+        failed_stages = []
+        for stage, future in self.pending_stages.items():
+            try:
+                self.stage_timings[stage] = future.result()
+            except Exception:
+                self.log.exception(f"{stage} failed")
+                failed_stages.append(stage)
+        self.pending_stages = {}
+
+        if not failed_stages:
+            start_time = time.perf_counter()
+            with metrics.use_refresh(self.pending_refresh), metrics.stage("export_data"):
+                try:
+                    self.data_exporter.export()
+                except Exception:
+                    self.log.exception("export_data failed")
+            self.stage_timings["export_data"] = time.perf_counter() - start_time
+        self.pending_refresh["failed_stages"] = failed_stages
+        metrics.finish_refresh(self.pending_refresh)
+        self.pending_refresh = None
+
         self.data_accessor.update_info("Task", "Waiting")
-        self.data_accessor.update_info("Status", "Finished")
-        self.data_accessor.update_info("Last Match", self.data_input.last_tba_match)
-        self.log.info("Run finished.")
+        self.data_accessor.update_info("Status", "Failed" if failed_stages else "Finished")
+        last_input = max(
+            self.data_inputs.values(), key=lambda data_input: data_input.last_tba_time, default=None
+        )
+        if last_input is not None:
+            self.data_accessor.update_info("Last Match", last_input.last_tba_match)
+        if not failed_stages:
+            self.data_accessor.update_info(
+                "Data Version", str(int(self.data_accessor.get_info("Data Version").value) + 1)
+            )
+        self.data_accessor.update_info("Metrics", metrics.to_json())
+        self.data_accessor.log_pool_status()
+        timings = ", ".join(f"{stage}: {seconds:.2f}s" for stage, seconds in self.stage_timings.items())
+        if failed_stages:
+            self.log.error(f"Run failed in {', '.join(failed_stages)}. {timings}")
+        else:
+            self.log.info(f"Run finished. {timings}")
+        return True
+
+    def poll(self, team_data_version):
+        """
+
+        Cheaply checks for new scouting data and changed TBA match lists.
+
+        Only the events whose poll interval has passed are asked, all at the same time.
+
+        :param team_data_version: The TeamDatum version seen by the last poll
+        :type team_data_version: int
+        :return: Whether there is new scouting data, the current TeamDatum version and the events TBA has new data for
+        :rtype: Tuple[bool, int, Set[str]]
+        """
+        # End the transaction so rows committed by the dashboard are visible
+        self.session.commit()
+        version = self.data_accessor.sync_data_version(TeamDatum)
+        changed = version != team_data_version
+        if changed and team_data_version is not None:
+            self.log.info("New scouting data was submitted")
+
+        now = time.time()
+        due = [
+            event
+            for event, last_tba_poll in self.last_tba_polls.items()
+            if now - last_tba_poll >= self.tba_poll_intervals[event]
+        ]
+        for event in due:
+            self.last_tba_polls[event] = now
+        changed_events = {
+            event
+            for event, tba_changed in zip(
+                due,
+                self.fetch_executor.map(lambda event: self.data_inputs[event].tba_changed(), due),
+            )
+            if tba_changed
+        }
+        for event in changed_events:
+            self.log.info(f"TBA has new data for {event}")
+        return changed, version, changed_events
 
     def start(self):
         """
-        Starts the ingest
+        Starts the ingest, refreshing whenever new scouting or TBA data shows up
         """
         self.data_accessor.update_info("Status", "Running")
-        start_time = time.time()
+        team_data_version = None
+        last_refresh = None
+        first_change = last_change = None
+        # Events with new TBA data that the next refresh has to get
+        changed_events = set()
         while True:
-            self.refresh()
-            self.data_accessor.update_info("Task", "Waiting")
-            time.sleep(self.interval - ((time.time() - start_time) % self.interval))
+            changed, team_data_version, new_events = self.poll(team_data_version)
+            changed_events |= new_events
+            now = time.time()
+            if changed or new_events:
+                first_change = first_change or now
+                last_change = now
+
+            stale = last_refresh is None or now - last_refresh >= self.interval
+            settled = first_change is not None and (
+                now - last_change >= self.debounce
+                or now - first_change >= self.max_debounce
+            )
+            if stale or settled:
+                # A stale refresh gets every event, otherwise only the events that changed are fetched
+                self.refresh(wait=False, events=None if stale else changed_events)
+                last_refresh = time.time()
+                first_change = last_change = None
+                changed_events = set()
+            self.finish_refresh()
+            time.sleep(self.poll_interval)
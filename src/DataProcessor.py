@@ -3,7 +3,8 @@ import re
 import pandas
 import pandas as pd
 from loguru import logger
-from SQLObjects import Alliance, ClimbType
+from Metrics import metrics
+from SQLObjects import Alliance, ClimbType, TeamDatum
 
 
 class DataProcessor:
@@ -33,7 +34,6 @@ class DataProcessor:
         self.error_condition = err_cond
         self.team_data = None
         self.match_data = None
-        self.alliance_data = None
         self.clean_tags = re.compile("<.*?>")
 
         self.log.info("DataProcessor Loaded!")
@@ -46,27 +46,86 @@ class DataProcessor:
                 return default
         return res
 
+    def make_warning(self, match_id, alliance, category, warning):
+        """
+
+        Builds a warning to be saved with DataAccessor.add_warnings.
+
+        :param warning: The warning text, which may contain loguru color tags
+        :type warning: str
+        :rtype: Dict[str, Any]
+        """
+        return {
+            "match_id": match_id,
+            "alliance": alliance,
+            "category": category,
+            "content": re.sub(self.clean_tags, '', warning),
+        }
+
+    @staticmethod
+    def format_number(value):
+        return int(value) if float(value).is_integer() else value
+
+    def get_match_metrics(self, metrics, default=None):
+        """
+
+        Reshapes alliance specific MatchData columns into one row per match and alliance.
+
+        :param metrics: Metrics without their alliance prefix, e.g. "total_points" for "r_total_points"
+        :type metrics: List[str]
+        :param default: A value to replace missing data with
+        :return: A Dataframe with match_id, alliance and one column per metric, ordered by match and then red before blue
+        :rtype: pandas.DataFrame
+        """
+        alliance_metrics = []
+        for color in ["red", "blue"]:
+            columns = {f"{color[0]}_{metric}": metric for metric in metrics}
+            alliance_metric = self.match_data[["match_id", *columns]].rename(columns=columns)
+            alliance_metric.insert(1, "alliance", Alliance(color))
+            alliance_metric.insert(2, "order", range(len(alliance_metric.index)))
+            alliance_metrics.append(alliance_metric)
+        match_metrics = (
+            pd.concat(alliance_metrics)
+            .sort_values("order", kind="stable")
+            .drop(columns=["order"])
+            .reset_index(drop=True)
+        )
+        if default is not None:
+            match_metrics[metrics] = match_metrics[metrics].where(match_metrics[metrics].notna(), default)
+        return match_metrics
+
     def check_equals_by_alliance(self, category, team_metrics, match_metrics, team_weights=None, match_weights=None):
         if team_weights is None:
             team_weights = [1]*len(team_metrics)
         if match_weights is None:
             match_weights = [1]*len(match_metrics)
-        for match, alliances in zip(self.match_data, self.alliance_data):
-            alliance_r_sum = sum([sum([DataProcessor.get(team, metric,0)*weight for metric, weight in zip(team_metrics, team_weights)]) for team in alliances[0]])
-            alliance_b_sum = sum([sum([DataProcessor.get(team, metric,0)*weight for metric, weight in zip(team_metrics, team_weights)]) for team in alliances[1]])
-
-            match_r_sum = sum([DataProcessor.get(match,f"r_{metric}",0)*weight for metric,weight in zip(match_metrics, match_weights)])
-            match_b_sum = sum([DataProcessor.get(match,f"b_{metric}",0)*weight for metric,weight in zip(match_metrics, match_weights)])
-
-            for alliance_sum, match_sum, color in zip([alliance_r_sum,alliance_b_sum],[match_r_sum,match_b_sum],["red","blue"]):
-                if abs(alliance_sum - match_sum) > self.error_condition:
-                    self.errors.append(alliance_sum - match_sum)
-                    warning_desc = f'<b>{match.match_id}{" " if len(match.match_id) < 14 else ""}</b> - <{color}>{color}</> - '
-                    team_col_names = ", ".join(team_metrics)
-                    match_col_names = ", ".join(match_metrics)
-                    warning = f'Sum of the {team_col_names} columns (<d><green>{alliance_sum}</></>) does not equal the sum of the TBA columns {match_col_names} (<d><green>{match_sum}</></>)'
-                    self.log.log("DATA", warning_desc + warning)
-                    self.data_accessor.add_warning(match.match_id,Alliance(color),category,re.sub(self.clean_tags, '', warning))
+
+        team_sums = (
+            (self.team_data[team_metrics].fillna(0) * team_weights)
+            .sum(axis=1)
+            .groupby([self.team_data["match_id"], self.team_data["alliance"]], sort=False)
+            .sum()
+            .rename("alliance_sum")
+        )
+        sums = self.get_match_metrics(match_metrics, default=0)
+        sums["match_sum"] = (sums[match_metrics] * match_weights).sum(axis=1)
+        sums = sums.merge(team_sums, how="left", left_on=["match_id", "alliance"], right_index=True)
+        sums["alliance_sum"] = sums["alliance_sum"].fillna(0)
+        sums["difference"] = sums["alliance_sum"] - sums["match_sum"]
+
+        team_col_names = ", ".join(team_metrics)
+        match_col_names = ", ".join(match_metrics)
+        warnings = []
+        for row in sums[sums["difference"].abs() > self.error_condition].itertuples():
+            alliance_sum = DataProcessor.format_number(row.alliance_sum)
+            match_sum = DataProcessor.format_number(row.match_sum)
+            color = row.alliance.value
+            self.errors.append(alliance_sum - match_sum)
+            warning_desc = f'<b>{row.match_id}{" " if len(row.match_id) < 14 else ""}</b> - <{color}>{color}</> - '
+            warning = f'Sum of the {team_col_names} columns (<d><green>{alliance_sum}</></>) does not equal the sum of the TBA columns {match_col_names} (<d><green>{match_sum}</></>)'
+            self.log.log("DATA", warning_desc + warning)
+            warnings.append(self.make_warning(row.match_id, row.alliance, category, warning))
+        self.data_accessor.add_warnings(warnings)
         self.data_accessor.session.flush()
 
     def check_same(self, category, team_metric, match_metrics, team_default=None, tba_default=None):
@@ -74,28 +133,63 @@ class DataProcessor:
             team_default = ""
         if tba_default is None:
             tba_default = ""
-        for match, alliances in zip(self.match_data, self.alliance_data):
-            for alliance, color in zip(alliances, ["red", "blue"]):
-                for team, metric in zip(alliance, match_metrics):
-                    team_val = DataProcessor.get(team, team_metric, team_default)
-                    tba_val = DataProcessor.get(match, f"{color[0]}_{metric}", tba_default)
-                    if team_val != tba_val:
-                        warning_desc = f'<b>{match.match_id}{" " if len(match.match_id) < 14 else ""}</b> - <{color}>{color}</> - '
-                        warning = f'{team.id}\'s endgame status is recorded as <d><blue>{team_val.value}</></> while TBA has it as <d><blue>{tba_val.value}</></>'
-                        self.log.log("DATA", warning_desc + warning)
-                        self.data_accessor.add_warning(match.match_id,Alliance(color),category,re.sub(self.clean_tags, '', warning))
+
+        # One row per match, alliance and driver station with the TBA value for that station
+        tba_values = self.get_match_metrics(match_metrics, default=tba_default)
+        tba_values["order"] = range(len(tba_values.index))
+        tba_values = tba_values.rename(
+            columns={metric: index + 1 for index, metric in enumerate(match_metrics)}
+        ).melt(
+            id_vars=["order", "match_id", "alliance"], var_name="driver_station", value_name="tba_val"
+        ).sort_values(["order", "driver_station"])
+        # TBA reports by driver station, so the schedule says which robot each value belongs to
+        tba_values = tba_values.merge(
+            self.data_accessor.get_alliance_incidence().to_frame(),
+            on=["match_id", "alliance", "driver_station"],
+        )
+
+        team_values = self.team_data[["id", "match_id", "team_id", team_metric]].rename(
+            columns={team_metric: "team_val"}
+        )
+        team_values["team_val"] = team_values["team_val"].where(team_values["team_val"].notna(), team_default)
+        values = tba_values.merge(team_values, on=["match_id", "team_id"])
+
+        warnings = []
+        for row in values[values["team_val"] != values["tba_val"]].itertuples():
+            color = row.alliance.value
+            warning_desc = f'<b>{row.match_id}{" " if len(row.match_id) < 14 else ""}</b> - <{color}>{color}</> - '
+            warning = f'{row.id}\'s endgame status is recorded as <d><blue>{row.team_val.value}</></> while TBA has it as <d><blue>{row.tba_val.value}</></>'
+            self.log.log("DATA", warning_desc + warning)
+            warnings.append(self.make_warning(row.match_id, row.alliance, category, warning))
+        self.data_accessor.add_warnings(warnings)
         self.data_accessor.session.flush()
 
 
     def check_key(self, category, key_name):
-        for team_datum in self.team_data:
-            if not re.search(r"2022[a-z]{4,5}_(qm|sf|qf|f)\d{1,2}(m\d{1})*", DataProcessor.get(team_datum, key_name,"")):
-                warning = (
-                    f"Match Key in TeamData with id {team_datum.id} is not a proper key"
-                )
-                self.log.warning(warning)
-                self.data_accessor.add_warning(DataProcessor.get(team_datum, key_name,""), Alliance.red, category=category,content=re.sub(self.clean_tags, '', warning))
+        keys = self.team_data[key_name].fillna("")
+        valid = keys.str.contains(r"2022[a-z]{4,5}_(?:qm|sf|qf|f)\d{1,2}(?:m\d{1})*")
+        warnings = []
+        for team_datum_id, key in zip(self.team_data.loc[~valid, "id"], keys[~valid]):
+            warning = (
+                f"Match Key in TeamData with id {team_datum_id} is not a proper key"
+            )
+            self.log.warning(warning)
+            warnings.append(self.make_warning(key, Alliance.red, category, warning))
+        self.data_accessor.add_warnings(warnings)
+
+
+    def run_check(self, check, category, *args, **kwargs):
+        """
+
+        Runs a check as its own metrics stage.
 
+        :param check: The check method to run
+        :type check: Callable
+        :param category: Category of the warnings the check adds
+        :type category: str
+        """
+        with metrics.stage(f"check {category}", rows=len(self.team_data.index)):
+            check(category, *args, **kwargs)
 
     def check_data(self):
         """
@@ -108,30 +202,26 @@ class DataProcessor:
         self.log.info("Validating Data")
         self.log.info("Loading Data")
 
-        self.team_data = self.data_accessor.get_team_data()
-        self.match_data = self.data_accessor.get_match_datum()
-        self.alliance_data = [[[None, None, None] for j in range(2)] for i in range(len(self.match_data))]
-
-        for team_datum in self.team_data:
-            self.alliance_data[team_datum.match.match_number - 1][0 if team_datum.alliance == Alliance.red else 1][team_datum.driver_station - 1] = team_datum
-
+        self.data_accessor.sync_data_version(TeamDatum)
+        self.team_data = self.data_accessor.get_all_team_data_df()
+        self.match_data = self.data_accessor.get_all_match_data_df()
 
         self.log.info("Checking TeamData match keys")
-        self.check_key("Match Key Violations", "match_id")
+        self.run_check(self.check_key, "Match Key Violations", "match_id")
 
         self.log.info("Checking for Auto Cargo Lower Hub Violations")
-        self.check_equals_by_alliance("Auto Cargo Lower Hub Violations", ["auto_lower_hub"], ['auto_cargo_lower_near','auto_cargo_lower_far', 'auto_cargo_lower_blue', 'auto_cargo_lower_red'])
+        self.run_check(self.check_equals_by_alliance, "Auto Cargo Lower Hub Violations", ["auto_lower_hub"], ['auto_cargo_lower_near','auto_cargo_lower_far', 'auto_cargo_lower_blue', 'auto_cargo_lower_red'])
 
         self.log.info("Checking for Auto Cargo Upper Hub Violations")
-        self.check_equals_by_alliance("Auto Cargo Upper Hub Violations", ["auto_upper_hub"], ['auto_cargo_upper_near','auto_cargo_upper_far', 'auto_cargo_upper_blue', 'auto_cargo_upper_red'])
+        self.run_check(self.check_equals_by_alliance, "Auto Cargo Upper Hub Violations", ["auto_upper_hub"], ['auto_cargo_upper_near','auto_cargo_upper_far', 'auto_cargo_upper_blue', 'auto_cargo_upper_red'])
 
         self.log.info("Checking for Teleop Cargo Lower Hub Violations")
-        self.check_equals_by_alliance("Teleop Cargo Lower Hub Violations", ["teleop_lower_hub"],['teleop_cargo_lower_near', 'teleop_cargo_lower_far', 'teleop_cargo_lower_blue', 'teleop_cargo_lower_red'])
+        self.run_check(self.check_equals_by_alliance, "Teleop Cargo Lower Hub Violations", ["teleop_lower_hub"],['teleop_cargo_lower_near', 'teleop_cargo_lower_far', 'teleop_cargo_lower_blue', 'teleop_cargo_lower_red'])
 
         self.log.info(
             "Checking for Teleop Cargo Upper Hub Violations"
         )
-        self.check_equals_by_alliance("Teleop Cargo Upper Hub Violations", ["teleop_upper_hub"],['teleop_cargo_upper_near', 'teleop_cargo_upper_far', 'teleop_cargo_upper_blue', 'teleop_cargo_upper_red'])
+        self.run_check(self.check_equals_by_alliance, "Teleop Cargo Upper Hub Violations", ["teleop_upper_hub"],['teleop_cargo_upper_near', 'teleop_cargo_upper_far', 'teleop_cargo_upper_blue', 'teleop_cargo_upper_red'])
 
         self.log.info("Checking for Endgame Status Violations")
-        self.check_same("Endgame Status Violations", "final_climb_type", ["endgame_1", "endgame_2", "endgame_3"], team_default=ClimbType.none, tba_default=ClimbType.none)
+        self.run_check(self.check_same, "Endgame Status Violations", "final_climb_type", ["endgame_1", "endgame_2", "endgame_3"], team_default=ClimbType.none, tba_default=ClimbType.none)
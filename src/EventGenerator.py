@@ -0,0 +1,320 @@
+import random
+
+# Points per scoring action in the 2022 game
+auto_cargo_points = {"lower": 2, "upper": 4}
+teleop_cargo_points = {"lower": 1, "upper": 2}
+taxi_points = 2
+endgame_points = {"None": 0, "Low": 4, "Mid": 6, "High": 10, "Traversal": 15}
+climb_type_codes = {"None": "0", "Low": "1", "Mid": "2", "High": "3", "Traversal": "4"}
+
+# Match keys are checked against 2022 and four or five letters, so the divisions follow that
+division_keys = ["cmpa", "cmpb", "cmpc", "cmpd", "cmpe", "cmpf"]
+
+# Event sizes the benchmarks are run at, as (events, teams per event, matches per event)
+event_sizes = {
+    "small": (1, 12, 16),
+    "regional": (1, 40, 80),
+    "division": (1, 75, 130),
+    "championship": (6, 75, 132),
+}
+
+
+class EventGenerator:
+    """Generates seeded TBA match lists and matching scouting submissions for synthetic events"""
+
+    def __init__(self, seed=0, year="2022", start_time=1645300000):
+        """
+
+        :param seed: Seed for every random choice, so the same seed always generates the same events
+        :type seed: int
+        :param year: Year the event keys start with
+        :type year: str
+        :param start_time: Unix time the first match is played at
+        :type start_time: int
+        """
+        self.random = random.Random(seed)
+        self.year = year
+        self.start_time = start_time
+        self.used_team_numbers = set()
+
+    def generate(self, size="regional"):
+        """
+
+        Generates one of the event sizes in event_sizes, with every event's matches played at the same time.
+
+        :param size: Name of the event size
+        :type size: str
+        :return: The teams, matches and submissions of every event combined
+        :rtype: Dict[str, List]
+        """
+        events, num_teams, num_matches = event_sizes[size]
+        if events == 1:
+            keys = ["bench"]
+        else:
+            keys = division_keys[:events]
+
+        generated = {"teams": [], "matches": [], "submissions": []}
+        for key in keys:
+            event = self.generate_event(key, num_teams, num_matches)
+            for field, values in event.items():
+                generated[field] += values
+        generated["matches"].sort(key=lambda match: match["post_result_time"])
+        return generated
+
+    def generate_event(self, event, num_teams, num_matches):
+        """
+
+        Generates a qualification schedule where every team plays about as often as the others.
+
+        :param event: Event key without the year
+        :type event: str
+        :param num_teams: How many teams attend, at least six
+        :type num_teams: int
+        :param num_matches: How many qualification matches are played
+        :type num_matches: int
+        :return: The team keys, TBA matches and scouting submissions of the event
+        :rtype: Dict[str, List]
+        """
+        event_key = f"{self.year}{event}"
+        teams = [f"frc{number}" for number in self.pick_team_numbers(num_teams)]
+        skills = {team: self.generate_skill() for team in teams}
+
+        matches = []
+        submissions = []
+        queue = []
+        for match_number in range(1, num_matches + 1):
+            # Draw from a shuffled copy of every team, refilled when it runs out, so teams play evenly
+            playing = []
+            while len(playing) < 6:
+                if not queue:
+                    queue = self.random.sample(teams, len(teams))
+                team = queue.pop()
+                if team not in playing:
+                    playing.append(team)
+
+            alliances = {"red": playing[:3], "blue": playing[3:]}
+            performances = {
+                color: [self.generate_performance(skills[team]) for team in team_keys]
+                for color, team_keys in alliances.items()
+            }
+            match = self.generate_match(event_key, match_number, alliances, performances)
+            matches.append(match)
+            for color, team_keys in alliances.items():
+                for index, (team, performance) in enumerate(
+                    zip(team_keys, performances[color])
+                ):
+                    submissions.append(
+                        self.generate_submission(
+                            match["key"], team, color, index + 1, performance
+                        )
+                    )
+
+        return {"teams": teams, "matches": matches, "submissions": submissions}
+
+    def pick_team_numbers(self, num_teams):
+        numbers = []
+        while len(numbers) < num_teams:
+            number = self.random.randint(1, 9999)
+            if number not in self.used_team_numbers:
+                self.used_team_numbers.add(number)
+                numbers.append(number)
+        return numbers
+
+    def generate_skill(self):
+        return {
+            "auto_lower": self.random.uniform(0, 1),
+            "auto_upper": self.random.uniform(0, 2.5),
+            "teleop_lower": self.random.uniform(0, 4),
+            "teleop_upper": self.random.uniform(0, 10),
+            "accuracy": self.random.uniform(0.5, 0.95),
+            "taxi": self.random.uniform(0.5, 1),
+            "climb": self.random.choice(list(endgame_points)),
+            "climb_reliability": self.random.uniform(0.4, 1),
+        }
+
+    def generate_performance(self, skill):
+        def shots(mean):
+            return max(0, round(self.random.gauss(mean, mean / 3 + 0.5)))
+
+        performance = {
+            "auto_lower": shots(skill["auto_lower"]),
+            "auto_upper": shots(skill["auto_upper"]),
+            "teleop_lower": shots(skill["teleop_lower"]),
+            "teleop_upper": shots(skill["teleop_upper"]),
+            "taxied": self.random.random() < skill["taxi"],
+        }
+        attempts = performance["auto_upper"] + performance["teleop_upper"]
+        performance["auto_misses"] = round(attempts * (1 - skill["accuracy"]) / 4)
+        performance["teleop_misses"] = round(attempts * (1 - skill["accuracy"]))
+        if self.random.random() < skill["climb_reliability"]:
+            performance["climb"] = skill["climb"]
+        else:
+            performance["climb"] = "None"
+        return performance
+
+    def split(self, total, parts):
+        """
+        Randomly splits a cargo count between the four hub exits
+        """
+        counts = [0] * parts
+        for _ in range(total):
+            counts[self.random.randrange(parts)] += 1
+        return counts
+
+    def generate_breakdown(self, performances, fouls):
+        breakdown = {}
+        totals = {}
+        for period in ["auto", "teleop"]:
+            for goal in ["lower", "upper"]:
+                total = sum(performance[f"{period}_{goal}"] for performance in performances)
+                totals[f"{period}_{goal}"] = total
+                for exit_name, count in zip(
+                    ["Near", "Far", "Blue", "Red"], self.split(total, 4)
+                ):
+                    breakdown[f"{period}Cargo{goal.capitalize()}{exit_name}"] = count
+            breakdown[f"{period}CargoTotal"] = totals[f"{period}_lower"] + totals[f"{period}_upper"]
+
+        for index, performance in enumerate(performances):
+            breakdown[f"taxiRobot{index + 1}"] = "Yes" if performance["taxied"] else "No"
+            breakdown[f"endgameRobot{index + 1}"] = performance["climb"]
+
+        breakdown["autoTaxiPoints"] = taxi_points * sum(
+            performance["taxied"] for performance in performances
+        )
+        breakdown["autoCargoPoints"] = sum(
+            totals[f"auto_{goal}"] * points for goal, points in auto_cargo_points.items()
+        )
+        breakdown["autoPoints"] = breakdown["autoTaxiPoints"] + breakdown["autoCargoPoints"]
+        breakdown["teleopCargoPoints"] = sum(
+            totals[f"teleop_{goal}"] * points for goal, points in teleop_cargo_points.items()
+        )
+        breakdown["endgamePoints"] = sum(
+            endgame_points[performance["climb"]] for performance in performances
+        )
+        breakdown["teleopPoints"] = breakdown["teleopCargoPoints"] + breakdown["endgamePoints"]
+        breakdown["matchCargoTotal"] = breakdown["autoCargoTotal"] + breakdown["teleopCargoTotal"]
+        breakdown["quintetAchieved"] = breakdown["autoCargoTotal"] >= 5
+        breakdown["cargoBonusRankingPoint"] = breakdown["matchCargoTotal"] >= (
+            18 if breakdown["quintetAchieved"] else 20
+        )
+        breakdown["hangarBonusRankingPoint"] = breakdown["endgamePoints"] >= 16
+        breakdown["foulCount"] = fouls["foul_count"]
+        breakdown["techFoulCount"] = fouls["tech_foul_count"]
+        breakdown["adjustPoints"] = 0
+        return breakdown
+
+    def generate_match(self, event_key, match_number, alliances, performances):
+        fouls = {
+            color: {
+                "foul_count": self.random.choice([0, 0, 0, 1, 2]),
+                "tech_foul_count": self.random.choice([0, 0, 0, 0, 1]),
+            }
+            for color in alliances
+        }
+        score_breakdown = {
+            color: self.generate_breakdown(performances[color], fouls[color])
+            for color in alliances
+        }
+        for color, other in [("red", "blue"), ("blue", "red")]:
+            # Fouls give points to the other alliance
+            breakdown = score_breakdown[color]
+            breakdown["foulPoints"] = (
+                4 * fouls[other]["foul_count"] + 8 * fouls[other]["tech_foul_count"]
+            )
+            breakdown["totalPoints"] = (
+                breakdown["autoPoints"] + breakdown["teleopPoints"] + breakdown["foulPoints"]
+            )
+
+        red_score = score_breakdown["red"]["totalPoints"]
+        blue_score = score_breakdown["blue"]["totalPoints"]
+        if red_score > blue_score:
+            winning_alliance = "red"
+        elif blue_score > red_score:
+            winning_alliance = "blue"
+        else:
+            winning_alliance = ""
+        for color in alliances:
+            breakdown = score_breakdown[color]
+            if winning_alliance == color:
+                win_points = 2
+            elif winning_alliance == "":
+                win_points = 1
+            else:
+                win_points = 0
+            breakdown["rp"] = (
+                win_points
+                + breakdown["cargoBonusRankingPoint"]
+                + breakdown["hangarBonusRankingPoint"]
+            )
+
+        # Matches run on a seven minute cycle and are posted a few minutes after they end
+        scheduled_time = self.start_time + (match_number - 1) * 420
+        actual_time = scheduled_time + self.random.randint(0, 120)
+        return {
+            "actual_time": actual_time,
+            "alliances": {
+                color: {
+                    "dq_team_keys": [],
+                    "score": score_breakdown[color]["totalPoints"],
+                    "surrogate_team_keys": [],
+                    "team_keys": team_keys,
+                }
+                for color, team_keys in alliances.items()
+            },
+            "comp_level": "qm",
+            "event_key": event_key,
+            "key": f"{event_key}_qm{match_number}",
+            "match_number": match_number,
+            "post_result_time": actual_time + 150 + self.random.randint(0, 60),
+            "predicted_time": None,
+            "score_breakdown": score_breakdown,
+            "set_number": 1,
+            "time": scheduled_time,
+            "videos": [],
+            "winning_alliance": winning_alliance,
+        }
+
+    def generate_submission(self, match_key, team, color, driver_station, performance):
+        """
+        Builds the scouting submission the dashboard would receive for one robot, with some scouting mistakes
+        """
+
+        def scouted(count):
+            # Scouts sometimes miscount, which the checks should flag
+            if self.random.random() < 0.1:
+                return max(0, count + self.random.choice([-1, 1]))
+            return count
+
+        climb_time = self.random.randint(3, 12)
+        climb = performance["climb"]
+        return {
+            "scout_id": f"scout{driver_station}{color[0]}",
+            "match_key": match_key,
+            "team_number": team,
+            "alliance": color,
+            "driver_station": driver_station,
+            "preloaded_cargo": self.random.random() < 0.9,
+            "auto_lower_hub": scouted(performance["auto_lower"]),
+            "auto_upper_hub": scouted(performance["auto_upper"]),
+            "auto_misses": performance["auto_misses"],
+            "auto_human_score": self.random.randint(0, 1),
+            "auto_human_misses": self.random.randint(0, 1),
+            "taxied": performance["taxied"],
+            "auto_shooting_zones": self.random.sample(["0", "1", "2"], self.random.randint(0, 2)),
+            "teleop_lower_hub": scouted(performance["teleop_lower"]),
+            "teleop_upper_hub": scouted(performance["teleop_upper"]),
+            "teleop_misses": performance["teleop_misses"],
+            "shooting_zones": self.random.sample(
+                ["0", "1", "2", "3", "4", "5"], self.random.randint(1, 3)
+            ),
+            "attempted_low": climb == "Low",
+            "low_climb_time": climb_time if climb == "Low" else None,
+            "attempted_mid": climb == "Mid",
+            "mid_climb_time": climb_time if climb == "Mid" else None,
+            "attempted_high": climb == "High",
+            "high_climb_time": climb_time if climb == "High" else None,
+            "attempted_traversal": climb == "Traversal",
+            "traversal_climb_time": climb_time if climb == "Traversal" else None,
+            "defense_time": self.random.choice(["never", "never", "sometimes"]),
+            "final_climb_type": climb_type_codes[climb],
+        }
@@ -0,0 +1,179 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+
+class MetricsRecorder:
+    """Records the duration, rows and queries of every pipeline stage for the last few refreshes"""
+
+    def __init__(self, size=10):
+        """
+
+        :param size: How many refreshes to keep
+        :type size: int
+        """
+        self.refreshes = deque(maxlen=size)
+        # The refresh and the stack of running stages of each thread
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def watch(self, engine):
+        """
+        Counts the queries run on an engine towards the stages running on the same thread
+        """
+        event.listen(engine, "before_cursor_execute", self.count_query)
+
+    def count_query(self, *args):
+        for record in getattr(self.local, "stages", []):
+            record["queries"] += 1
+
+    def count_rows(self, rows):
+        """
+        Adds to the rows processed by the innermost running stage of this thread
+        """
+        stages = getattr(self.local, "stages", [])
+        if stages:
+            stages[-1]["rows"] += rows
+
+    def start_refresh(self):
+        """
+
+        Starts recording a refresh on this thread.
+
+        :return: The refresh, for worker threads to record into with use_refresh
+        :rtype: Dict
+        """
+        refresh = {"started": time.time(), "seconds": None, "stages": {}, "failed_stages": []}
+        self.local.refresh = refresh
+        return refresh
+
+    @contextmanager
+    def use_refresh(self, refresh):
+        """
+        Records the stages this thread runs into refresh
+        """
+        previous = getattr(self.local, "refresh", None)
+        self.local.refresh = refresh
+        try:
+            yield
+        finally:
+            self.local.refresh = previous
+
+    def finish_refresh(self, refresh):
+        refresh["seconds"] = time.time() - refresh["started"]
+        with self.lock:
+            self.refreshes.append(refresh)
+
+    @contextmanager
+    def stage(self, name, rows=0):
+        """
+
+        Measures a stage. Stages with the same name in one refresh are added together.
+
+        :param name: Name of the stage
+        :type name: str
+        :param rows: How many rows the stage processes, count_rows can add more while it runs
+        :type rows: int
+        """
+        record = {"seconds": 0, "queries": 0, "rows": rows}
+        if not hasattr(self.local, "stages"):
+            self.local.stages = []
+        self.local.stages.append(record)
+        start_time = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start_time
+            self.local.stages.pop()
+            refresh = getattr(self.local, "refresh", None)
+            if refresh is not None:
+                with self.lock:
+                    totals = refresh["stages"].setdefault(
+                        name, {"count": 0, "seconds": 0, "queries": 0, "rows": 0}
+                    )
+                    totals["count"] += 1
+                    for field in ["seconds", "queries", "rows"]:
+                        totals[field] += record[field]
+
+    def to_json(self):
+        with self.lock:
+            return json.dumps(list(self.refreshes))
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text(refreshes):
+    """
+
+    Formats recorded refreshes in the Prometheus text exposition format.
+
+    The last refresh is reported as gauges, and the durations of every kept refresh as a summary.
+
+    :param refreshes: Refreshes from MetricsRecorder.to_json, oldest first
+    :type refreshes: List[Dict]
+    :return: The metrics page
+    :rtype: str
+    """
+    lines = [
+        "# HELP scouting_refreshes_recorded Refreshes kept in the metrics ring buffer",
+        "# TYPE scouting_refreshes_recorded gauge",
+        f"scouting_refreshes_recorded {len(refreshes)}",
+    ]
+    if not refreshes:
+        return "\n".join(lines) + "\n"
+
+    last = refreshes[-1]
+    lines += [
+        "# HELP scouting_last_refresh_timestamp_seconds When the last refresh started",
+        "# TYPE scouting_last_refresh_timestamp_seconds gauge",
+        f"scouting_last_refresh_timestamp_seconds {last['started']}",
+        "# HELP scouting_last_refresh_duration_seconds How long the last refresh took",
+        "# TYPE scouting_last_refresh_duration_seconds gauge",
+        f"scouting_last_refresh_duration_seconds {last['seconds']}",
+        "# HELP scouting_last_refresh_failed_stages How many stages of the last refresh failed",
+        "# TYPE scouting_last_refresh_failed_stages gauge",
+        f"scouting_last_refresh_failed_stages {len(last['failed_stages'])}",
+    ]
+    for field, unit, description in [
+        ("seconds", "duration_seconds", "Time spent in each stage"),
+        ("queries", "queries", "Queries run by each stage"),
+        ("rows", "rows", "Rows processed by each stage"),
+    ]:
+        lines += [
+            f"# HELP scouting_stage_last_{unit} {description} during the last refresh",
+            f"# TYPE scouting_stage_last_{unit} gauge",
+        ]
+        for stage, totals in sorted(last["stages"].items()):
+            lines.append(
+                f'scouting_stage_last_{unit}{{stage="{escape_label(stage)}"}} {totals[field]}'
+            )
+
+    durations = {}
+    for refresh in refreshes:
+        for stage, totals in refresh["stages"].items():
+            durations.setdefault(stage, []).append(totals["seconds"])
+    lines += [
+        "# HELP scouting_stage_duration_seconds Time spent in each stage over the kept refreshes",
+        "# TYPE scouting_stage_duration_seconds summary",
+    ]
+    for stage, values in sorted(durations.items()):
+        label = escape_label(stage)
+        values = sorted(values)
+        for quantile in [0.5, 0.9, 1]:
+            value = values[min(int(quantile * len(values)), len(values) - 1)]
+            lines.append(
+                f'scouting_stage_duration_seconds{{stage="{label}",quantile="{quantile}"}} {value}'
+            )
+        lines.append(f'scouting_stage_duration_seconds_sum{{stage="{label}"}} {sum(values)}')
+        lines.append(f'scouting_stage_duration_seconds_count{{stage="{label}"}} {len(values)}')
+    return "\n".join(lines) + "\n"
+
+
+# Shared by every component of the process, like the logger
+metrics = MetricsRecorder()
@@ -0,0 +1,152 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from loguru import logger
+
+
+class CachedResponse:
+    """The parts of a HTTP response that the ingest uses, served from the network or the disk cache"""
+
+    def __init__(self, status_code, content=None, validator=None, from_cache=False):
+        self.status_code = status_code
+        self.content = content
+        # The ETag or Last-Modified header the content was served with
+        self.validator = validator
+        self.from_cache = from_cache
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class ResponseCache:
+    """Keeps the last response of every URL on disk and revalidates it with conditional requests"""
+
+    def __init__(self, http, directory="./cache"):
+        """
+
+        :param http: The session to send requests with
+        :type http: requests.Session
+        :param directory: Where to store cached responses
+        :type directory: str
+        """
+        self.log = logger.opt(colors=True)
+        self.http = http
+        self.directory = directory
+        # Keeps the body and metadata of one store together when several threads store the same URL
+        self.store_lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def paths(self, url):
+        key = hashlib.sha1(url.encode()).hexdigest()
+        return (
+            os.path.join(self.directory, f"{key}.json"),
+            os.path.join(self.directory, f"{key}.body.gz"),
+        )
+
+    def load_metadata(self, url):
+        """
+        Loads the stored validators for a URL, or None if nothing is stored
+        """
+        metadata_path, _ = self.paths(url)
+        try:
+            with open(metadata_path) as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if metadata.get("url") != url:
+            return None
+        return metadata
+
+    def load_body(self, url):
+        """
+        Loads the stored body for a URL, or None if it can't be read
+        """
+        _, body_path = self.paths(url)
+        try:
+            with gzip.open(body_path, "rb") as f:
+                return f.read()
+        except (OSError, EOFError):
+            return None
+
+    def replace(self, path, write):
+        """
+        Writes a file through a temporary file of its own, then swaps it in so a crash never leaves a partial file
+        """
+        with tempfile.NamedTemporaryFile(
+            dir=self.directory, prefix=os.path.basename(path), suffix=".tmp", delete=False
+        ) as f:
+            try:
+                write(f)
+            except BaseException:
+                f.close()
+                os.remove(f.name)
+                raise
+        os.replace(f.name, path)
+
+    def store(self, url, metadata, body):
+        """
+        Writes a response to disk, replacing the old files atomically
+        """
+        metadata_path, body_path = self.paths(url)
+
+        def write_body(f):
+            with gzip.GzipFile(fileobj=f, mode="wb") as gzip_file:
+                gzip_file.write(body)
+
+        with self.store_lock:
+            self.replace(body_path, write_body)
+            self.replace(metadata_path, lambda f: f.write(json.dumps({"url": url, **metadata}).encode()))
+
+    def get(self, url, headers=None, load_body=True):
+        """
+
+        Gets a URL, sending the stored validators so an unchanged response is served from disk.
+
+        :param url: The URL to GET
+        :type url: str
+        :param headers: Extra headers to send
+        :type headers: Dict[str, str]
+        :param load_body: Whether to read the stored body on a 304, False when only the validator is needed
+        :type load_body: bool
+        :return: The response, with content set for both 200 and 304 responses when it is known
+        :rtype: CachedResponse
+        """
+        metadata = self.load_metadata(url)
+        body = None
+        if metadata is not None and load_body:
+            body = self.load_body(url)
+            # Without its body the stored response is useless, so ask for the whole thing again
+            if body is None:
+                metadata = None
+        headers = dict(headers or {})
+        if metadata is not None:
+            if metadata.get("etag"):
+                headers["If-None-Match"] = metadata["etag"]
+            if metadata.get("last_modified"):
+                headers["If-Modified-Since"] = metadata["last_modified"]
+
+        r = self.http.get(url, headers=headers)
+
+        if r.status_code == 304 and metadata is not None:
+            return CachedResponse(
+                304,
+                body,
+                metadata.get("etag") or metadata.get("last_modified"),
+                from_cache=True,
+            )
+        if r.status_code != 200:
+            return CachedResponse(r.status_code)
+
+        metadata = {
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+        }
+        if metadata["etag"] or metadata["last_modified"]:
+            self.store(url, metadata, r.content)
+        return CachedResponse(
+            200, r.content, metadata["etag"] or metadata["last_modified"]
+        )
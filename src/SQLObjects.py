@@ -10,10 +10,15 @@ from sqlalchemy import (
     Text,
     Enum,
     DateTime,
+    UniqueConstraint,
     null,
 )
 from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.types import TypeDecorator
+from datetime import datetime
+from operator import itemgetter
 import enum
+import pytz
 
 
 # Setting Up SQL
@@ -55,6 +60,28 @@ class ClimbType(enum.Enum):
     none = "none"
 
 
+class UTCDateTime(TypeDecorator):
+    """
+    A DateTime stored as naive UTC and read back as aware UTC
+
+    Neither MySQL's DATETIME nor SQLite keep a timezone, so aware datetimes are converted
+    to UTC on the way in and tagged with it on the way out.
+    """
+
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(pytz.utc).replace(tzinfo=None)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is not None and value.tzinfo is None:
+            value = value.replace(tzinfo=pytz.utc)
+        return value
+
+
 # Declaring SQL Objects
 class Team(Base):
     __tablename__ = "teams"
@@ -86,7 +113,7 @@ class Match(Base):
     comp_level = Column(Enum(CompLevel))
     set_number = Column(Integer)
     match_number = Column(Integer)
-    event_key = Column(String(50))
+    event_key = Column(String(50), index=True)
 
     def __repr__(self) -> str:
         return f"<Match id={self.id}>"
@@ -104,6 +131,7 @@ class Match(Base):
 
 class AllianceAssociation(Base):
     __tablename__ = "alliance_associations"
+    __table_args__ = (UniqueConstraint("match_id", "alliance", "driver_station"),)
     id = Column(Integer, primary_key=True)
 
     match_id = Column(String(50), ForeignKey("matches.id", name="match_id"))
@@ -113,7 +141,7 @@ class AllianceAssociation(Base):
         back_populates="alliance_associations",
     )
 
-    team_id = Column(String(10), ForeignKey("teams.id", name="team_id"))
+    team_id = Column(String(10), ForeignKey("teams.id", name="team_id"), index=True)
     team = relationship(
         "Team",
         foreign_keys = [team_id],
@@ -122,12 +150,14 @@ class AllianceAssociation(Base):
 
     alliance = Column(Enum(Alliance))
     driver_station = Column(Integer)
+    event_key = Column(String(50), index=True)
 
     def __repr__(self) -> str:
         return f"<AllianceAssociation id={self.id} match_id={self.match_id} team_id={self.team_id} alliance={self.alliance} driver_station={self.driver_station}>"    
 
 class Warning(Base):
     __tablename__ = "warnings"
+    __table_args__ = (UniqueConstraint("match_id", "alliance", "category"),)
     id = Column(Integer, primary_key=True)
     match_id = Column(String(50), ForeignKey("matches.id"))
     match = relationship("Match", back_populates="warnings")
@@ -191,10 +221,12 @@ class Scout(Base):
 
 class Prediction(Base):
     __tablename__ = "predictions"
+    # Each scout predicts a match once
+    __table_args__ = (UniqueConstraint("scout_id", "match_id"),)
     id = Column(Integer(), primary_key=True)
     scout_id = Column(String(20), ForeignKey("scouts.id"))
     scout = relationship("Scout", back_populates="predictions")
-    match_id = Column(String(50), ForeignKey("matches.id"))
+    match_id = Column(String(50), ForeignKey("matches.id"), index=True)
     match = relationship("Match", back_populates="predictions")
     prediction = Column(Enum(Alliance))
 
@@ -214,16 +246,18 @@ class Prediction(Base):
 class MatchDatum(Base):
     __tablename__ = "match_data"
     id = Column(Integer, primary_key=True)
-    match_id = Column(String(50), ForeignKey("matches.id"))
+    match_id = Column(String(50), ForeignKey("matches.id"), unique=True)
     match = relationship("Match", back_populates="match_data")
+    # Copied from the match so one event's data can be read without a join
+    event_key = Column(String(50), index=True)
 
     # Year agnostic config
 
     winning_alliance = Column(Enum(Alliance))
-    time = Column(DateTime(timezone=True))
-    actual_time = Column(DateTime(timezone=True))
-    predicted_time = Column(DateTime(timezone=True))
-    post_result_time = Column(DateTime(timezone=True))
+    time = Column(UTCDateTime)
+    actual_time = Column(UTCDateTime)
+    predicted_time = Column(UTCDateTime)
+    post_result_time = Column(UTCDateTime)
 
     # Year specific config
 
@@ -365,17 +399,20 @@ class MatchDatum(Base):
 
 class TeamDatum(Base):
     __tablename__ = "team_data"
+    # A robot is scouted once per match
+    __table_args__ = (UniqueConstraint("match_id", "team_id", "alliance"),)
     id = Column(Integer, primary_key=True)
-    team_id = Column(String(50), ForeignKey("teams.id"))
+    team_id = Column(String(50), ForeignKey("teams.id"), index=True)
     team = relationship("Team", back_populates="team_data")
     scout_id = Column(String(20), ForeignKey("scouts.id"))
     scout = relationship("Scout", back_populates="team_data")
     match_id = Column(String(50), ForeignKey("matches.id"))
     match = relationship("Match", back_populates="team_data")
+    event_key = Column(String(50), index=True)
 
     # Year agnostic config
 
-    time = Column(DateTime(timezone=True))
+    time = Column(UTCDateTime)
     alliance = Column(Enum(Alliance))
     driver_station = Column(Integer)
 
@@ -430,7 +467,7 @@ class TeamDatum(Base):
 class CalculatedTeamDatum(Base):
     __tablename__ = "calculated_team_data"
     id = Column(Integer, primary_key=True)
-    team_id = Column(String(50), ForeignKey("teams.id"))
+    team_id = Column(String(50), ForeignKey("teams.id"), unique=True)
     team = relationship("Team", back_populates="calculated_team_data")
 
     # Year Specific Config
@@ -500,8 +537,8 @@ class CalculatedTeamDatum(Base):
        return {
            self.team_id[3:] : {
                "accuracy": {
-                   "upper": self.teleop_upper_pct,
-                   "lower": self.teleop_lower_pct,
+                   "upper": self.teleop_upper_hub_pct,
+                   "lower": self.teleop_lower_hub_pct,
                    "miss": self.teleop_miss_pct
                },
                "auto": {
@@ -517,10 +554,10 @@ class CalculatedTeamDatum(Base):
                    "no_climb": self.none_pct
                },
                "climb_time" :{
-                    "low_rung_climb_time": self.low_rung_time_avg,
-                   "mid_rung_climb_time": self.mid_rung_climb_time,
-                   "high_rung_climb_time": self.high_rung_climb_time,
-                   "traversal_rung_climb_time": self.traversal_rung_climb_time,
+                    "low_rung_climb_time": self.low_rung_climb_time_avg,
+                   "mid_rung_climb_time": self.mid_rung_climb_time_avg,
+                   "high_rung_climb_time": self.high_rung_climb_time_avg,
+                   "traversal_rung_climb_time": self.traversal_rung_climb_time_avg,
                    
                },
                "attempted_climbs": {
@@ -603,6 +640,142 @@ match_data_map = {
     "total_points": "totalPoints",
 }
 
+
+
+class MatchDatumExtractor:
+    """
+    Pulls the match_data columns straight out of a raw TBA match without flattening it
+
+    The paths into score_breakdown are resolved once, so extracting a match is a
+    handful of lookups per alliance instead of a walk over the whole match object.
+    """
+
+    endgame_keys = ("endgameRobot1", "endgameRobot2", "endgameRobot3")
+
+    def __init__(self, columns):
+        self.breakdown_keys = {}
+        breakdown_columns = []
+        for letter, color in zip(["r", "b"], ["red", "blue"]):
+            keys = [
+                (f"{letter}_{key}", value)
+                for key, value in match_data_map.items()
+                if f"{letter}_{key}" in columns
+            ]
+            self.breakdown_keys[color] = tuple(value for _, value in keys)
+            breakdown_columns += [column for column, _ in keys]
+        self.getters = {
+            color: self._getter(keys) for color, keys in self.breakdown_keys.items()
+        }
+        self.endgame_getter = itemgetter(*self.endgame_keys)
+
+        self.columns = (
+            "match_id",
+            "event_key",
+            "winning_alliance",
+            "time",
+            "actual_time",
+            "post_result_time",
+            "r_endgame_1",
+            "r_endgame_2",
+            "r_endgame_3",
+            "b_endgame_1",
+            "b_endgame_2",
+            "b_endgame_3",
+            *breakdown_columns,
+        )
+
+    @staticmethod
+    def _getter(keys):
+        # itemgetter returns a bare value instead of a tuple for a single key
+        if len(keys) == 1:
+            return lambda breakdown: (breakdown[keys[0]],)
+        if len(keys) == 0:
+            return lambda breakdown: ()
+        return itemgetter(*keys)
+
+    def extract(self, match_json):
+        """
+        Builds a match_data row from a raw TBA match, ordered like self.columns
+        """
+        red = match_json["score_breakdown"]["red"]
+        blue = match_json["score_breakdown"]["blue"]
+        return (
+            match_json["key"],
+            match_json["event_key"],
+            # TBA leaves the winner empty for ties
+            Alliance(match_json["winning_alliance"] or "NA"),
+            datetime.fromtimestamp(match_json["time"], pytz.utc),
+            datetime.fromtimestamp(match_json["actual_time"], pytz.utc),
+            datetime.fromtimestamp(match_json["post_result_time"], pytz.utc),
+            *[ClimbType(climb.lower()) for climb in self.endgame_getter(red)],
+            *[ClimbType(climb.lower()) for climb in self.endgame_getter(blue)],
+            *self.getters["red"](red),
+            *self.getters["blue"](blue),
+        )
+
+    def extract_rows(self, match_jsons):
+        """
+        Builds match_data rows ready for a bulk insert
+        """
+        return [dict(zip(self.columns, self.extract(match_json))) for match_json in match_jsons]
+
+
+match_datum_extractor = MatchDatumExtractor(MatchDatum.__table__.columns)
+
+# Year specific config
+climb_type_map = {
+    "0": "none",
+    "1": "low",
+    "2": "mid",
+    "3": "high",
+    "4": "traversal"
+}
+
+# Zones in the order the scouting app numbers them
+shooting_zones = [
+    "fender",
+    "elsewhere_in_tarmac",
+    "launchpad",
+    "terminal",
+    "hangar_zone",
+    "elsewhere_on_field",
+]
+
+
+def team_datum_json_from_submission(data):
+    """
+    Maps a scouting submission from the dashboard to TeamDatum columns
+    """
+    team_datum_json = {
+        "preloaded_cargo": bool(data.get("preloaded_cargo")),
+        "auto_lower_hub": data.get("auto_lower_hub"),
+        "auto_upper_hub": data.get("auto_upper_hub"),
+        "auto_misses": data.get("auto_misses"),
+        "auto_human_scores": data.get("auto_human_score"),
+        "auto_human_misses": data.get("auto_human_misses"),
+        "taxied": bool(data.get("taxied")),
+        "auto_notes": data.get("auto_notes"),
+        "teleop_lower_hub": data.get("teleop_lower_hub"),
+        "teleop_upper_hub": data.get("teleop_upper_hub"),
+        "teleop_misses": data.get("teleop_misses"),
+        "teleop_notes": data.get("teleop_notes"),
+        "attempted_low": data.get("attempted_low"),
+        "low_rung_climb_time": data.get("low_climb_time"),
+        "attempted_mid": data.get("attempted_mid"),
+        "mid_rung_climb_time": data.get("mid_climb_time"),
+        "attempted_high": data.get("attempted_high"),
+        "high_rung_climb_time": data.get("high_climb_time"),
+        "attempted_traversal": data.get("attempted_traversal"),
+        "traversal_rung_climb_time": data.get("traversal_climb_time"),
+        "defense": data.get("defense_time"),
+        "final_climb_type": climb_type_map[str(data.get("final_climb_type"))]
+    }
+    for index, zone in enumerate(shooting_zones):
+        team_datum_json[f"from_{zone}"] = str(index) in data.get("shooting_zones")
+        team_datum_json[f"auto_from_{zone}"] = str(index) in data.get("auto_shooting_zones")
+    return team_datum_json
+
+
 team_data_map = {
     "auto_lower_hub": "Auto Lower Hub",
     "auto_upper_hub": "Auto Upper Hub",
@@ -0,0 +1,219 @@
+from loguru import logger
+from sqlalchemy import and_, func, inspect, select, text, UniqueConstraint
+from sqlalchemy.schema import CreateColumn
+
+from SQLObjects import Base
+
+
+# How columns added to existing tables are filled in, from the columns the rows already have
+backfills = {
+    # The event key is the part of the match key before the underscore, 2022vahay_qm1 -> 2022vahay
+    "event_key": lambda table: func.substr(table.c.match_id, 1, func.instr(table.c.match_id, "_") - 1),
+}
+
+# Columns whose value is kept from any of the duplicates removed before adding a unique key, like a warning someone ignored
+kept_flags = {"warnings": ["ignore"]}
+
+
+class SchemaMigrator:
+    """Brings the tables of a database made by an older version up to date, so it can be resumed without --reset"""
+
+    def __init__(self, engine):
+        """
+
+        :param engine: Engine of the database to migrate
+        :type engine: sqlalchemy.engine.Engine
+        """
+        self.log = logger.opt(colors=True)
+        self.engine = engine
+
+    def migrate(self):
+        """
+        Migrates every table that exists, run after create_all so new tables are already up to date
+        """
+        stored_tables = set(inspect(self.engine).get_table_names())
+        for table in Base.metadata.sorted_tables:
+            if table.name not in stored_tables:
+                continue
+            self.add_columns(table)
+            self.add_unique_keys(table)
+            self.add_indexes(table)
+
+    def add_columns(self, table):
+        """
+
+        Adds the columns a table is missing, fills them in from backfills and creates their indexes.
+
+        :param table: The model's table
+        :type table: sqlalchemy.Table
+        :return: Names of the columns that were added
+        :rtype: List[str]
+        """
+        stored_columns = {column["name"] for column in inspect(self.engine).get_columns(table.name)}
+        added = [column for column in table.columns if column.name not in stored_columns]
+        if not added:
+            return []
+
+        preparer = self.engine.dialect.identifier_preparer
+        with self.engine.begin() as connection:
+            for column in added:
+                self.log.warning(f"Adding the missing column {column.name} to {table.name}")
+                connection.execute(
+                    text(
+                        f"ALTER TABLE {preparer.quote(table.name)} "
+                        f"ADD COLUMN {CreateColumn(column).compile(dialect=self.engine.dialect)}"
+                    )
+                )
+                if column.name in backfills:
+                    connection.execute(
+                        table.update()
+                        .where(and_(column.is_(None), func.instr(table.c.match_id, "_") > 0))
+                        .values({column.name: backfills[column.name](table)})
+                    )
+            for index in table.indexes:
+                if any(column.name in index.columns for column in added):
+                    index.create(connection)
+        return [column.name for column in added]
+
+    def add_indexes(self, table):
+        """
+
+        Creates the indexes a model declares that the stored table is missing.
+
+        An index is only skipped when a stored index starts with the same columns, since that one serves the same lookups.
+
+        :param table: The model's table
+        :type table: sqlalchemy.Table
+        :return: Names of the indexes that were created
+        :rtype: List[str]
+        """
+        stored_indexes = [index["column_names"] for index in inspect(self.engine).get_indexes(table.name)]
+        created = []
+        with self.engine.begin() as connection:
+            for index in sorted(table.indexes, key=lambda index: index.name):
+                columns = [column.name for column in index.columns]
+                if any(stored[: len(columns)] == columns for stored in stored_indexes):
+                    continue
+                self.log.warning(f"Creating the missing index {index.name} on {table.name}")
+                index.create(connection)
+                created.append(index.name)
+        return created
+
+    @staticmethod
+    def get_unique_keys(table):
+        """
+
+        Gets the unique keys a model declares, including columns declared with unique=True.
+
+        :param table: The model's table
+        :type table: sqlalchemy.Table
+        :return: The columns of each key
+        :rtype: List[List[str]]
+        """
+        return sorted(
+            [column.name for column in constraint.columns]
+            for constraint in table.constraints
+            if isinstance(constraint, UniqueConstraint)
+        )
+
+    def get_stored_unique_keys(self, table_name):
+        """
+
+        Gets the unique keys a table has in the database, whether they were made as constraints or unique indexes.
+
+        :param table_name: Name of the table
+        :type table_name: str
+        :rtype: Set[FrozenSet[str]]
+        """
+        inspector = inspect(self.engine)
+        keys = {
+            frozenset(constraint["column_names"])
+            for constraint in inspector.get_unique_constraints(table_name)
+        }
+        keys |= {
+            frozenset(index["column_names"])
+            for index in inspector.get_indexes(table_name)
+            if index["unique"]
+        }
+        return keys
+
+    def add_unique_keys(self, table):
+        """
+        Adds the unique keys a table is missing, which the upserts need to find the rows they update
+        """
+        stored_keys = self.get_stored_unique_keys(table.name)
+        for columns in self.get_unique_keys(table):
+            if frozenset(columns) in stored_keys:
+                continue
+            self.log.warning(f"Adding the missing unique key ({', '.join(columns)}) to {table.name}")
+            with self.engine.begin() as connection:
+                removed = self.remove_duplicates(connection, table, columns)
+                if removed:
+                    self.log.warning(f"Removed {removed} duplicate rows from {table.name}")
+                self.add_unique_key(connection, table, columns)
+
+    @staticmethod
+    def remove_duplicates(connection, table, columns):
+        """
+
+        Removes every row that has the same key as a newer one, so a unique key can be added.
+
+        Rows with a NULL in the key are kept, since they don't collide. Flags in kept_flags
+        stay set on the kept row if any of the removed rows had them set.
+
+        :param connection: Connection to delete through
+        :type connection: sqlalchemy.engine.Connection
+        :param table: The table
+        :type table: sqlalchemy.Table
+        :param columns: Columns of the key
+        :type columns: List[str]
+        :return: How many rows were removed
+        :rtype: int
+        """
+        key_columns = [table.c[column] for column in columns]
+        flags = kept_flags.get(table.name, [])
+        rows = connection.execute(
+            select([table.c.id, *key_columns, *[table.c[flag] for flag in flags]])
+            .where(and_(*[column.isnot(None) for column in key_columns]))
+            .order_by(table.c.id)
+        )
+
+        # The newest row of every key, and the flags set on any of its rows
+        newest = {}
+        set_flags = {}
+        duplicate_ids = []
+        for row in rows:
+            key = tuple(row[column] for column in columns)
+            if key in newest:
+                duplicate_ids.append(newest[key])
+            newest[key] = row["id"]
+            set_flags.setdefault(key, set()).update(flag for flag in flags if row[flag])
+        if not duplicate_ids:
+            return 0
+
+        for key, flags_to_keep in set_flags.items():
+            if flags_to_keep:
+                connection.execute(
+                    table.update()
+                    .where(table.c.id == newest[key])
+                    .values({flag: True for flag in flags_to_keep})
+                )
+        for start in range(0, len(duplicate_ids), 500):
+            connection.execute(
+                table.delete().where(table.c.id.in_(duplicate_ids[start : start + 500]))
+            )
+        return len(duplicate_ids)
+
+    def add_unique_key(self, connection, table, columns):
+        """
+        Adds a unique key to a stored table
+        """
+        preparer = self.engine.dialect.identifier_preparer
+        name = preparer.quote(f"uq_{table.name}_{'_'.join(columns)}")
+        column_list = ", ".join(preparer.quote(column) for column in columns)
+        if self.engine.dialect.name == "sqlite":
+            # SQLite can't add constraints to a table, but upserts collide on a unique index just the same
+            statement = f"CREATE UNIQUE INDEX {name} ON {preparer.quote(table.name)} ({column_list})"
+        else:
+            statement = f"ALTER TABLE {preparer.quote(table.name)} ADD CONSTRAINT {name} UNIQUE ({column_list})"
+        connection.execute(text(statement))
@@ -11,13 +11,28 @@ if "--refresh-time" in sys.argv[1:]:
 else:
     refresh_time = 180
 
+if "--poll-time" in sys.argv[1:]:
+    poll_time = float(sys.argv[sys.argv.index("--poll-time") + 1])
+else:
+    poll_time = 2
+
+full_recalculation = "--full-recalculation" in sys.argv[1:]
+
+# Existing data is kept unless a reset is explicitly asked for
+reset = "--reset" in sys.argv[1:]
+
 simulation = False
 
 if "--simulation" in sys.argv[1:]:
     simulation = True
 
 dm = DataManager(
-    skip_validation=skip_validation, interval=refresh_time, simulation=simulation
+    skip_validation=skip_validation,
+    interval=refresh_time,
+    simulation=simulation,
+    full_recalculation=full_recalculation,
+    reset=reset,
+    poll_interval=poll_time,
 )
 if simulation:
     dm.start()
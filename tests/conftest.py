@@ -0,0 +1,144 @@
+import json
+import os
+import sys
+from email.utils import formatdate
+from unittest import mock
+
+import pytest
+import requests
+from loguru import logger
+from requests.structures import CaseInsensitiveDict
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "data")
+# The modules in src import each other by name, like they do when run from src
+sys.path.insert(0, os.path.dirname(data_dir))
+
+from Config import Config, create_sqlite_engine
+from DataAccessor import DataAccessor
+from DataInput import DataInput
+from SQLObjects import Alliance, Base, Defense, team_datum_json_from_submission
+
+
+class SimulatedEvent:
+    """
+    Week 0 of 2022 replayed from src/data, with the simulator serving the matches played so far
+
+    Every 7th scouting submission reports a different climb than TBA has, every 11th is missing its
+    teleop upper hub count and every 13th counts an extra auto cargo in each hub, so every check has
+    something to warn about.
+    """
+
+    def __init__(self, engine, directory):
+        """
+
+        :param engine: Engine of an empty database
+        :type engine: sqlalchemy.engine.Engine
+        :param directory: A temporary directory for the response cache
+        :type directory: str
+        """
+        with open(os.path.join(data_dir, "2022week0.json")) as f:
+            self.matches = sorted(json.load(f), key=lambda match: match["post_result_time"])
+        with open(os.path.join(data_dir, "gen_data.json")) as f:
+            self.submissions = json.load(f)
+        for index, submission in enumerate(
+            submission for match in self.matches for submission in self.submissions[match["key"]]
+        ):
+            # Enum columns store names, which only match the values sent for one word answers
+            submission["defense_time"] = Defense(submission["defense_time"])
+            if index % 7 == 3:
+                submission["final_climb_type"] = (int(submission["final_climb_type"]) + 1) % 5
+            if index % 11 == 5:
+                submission["teleop_upper_hub"] = None
+            if index % 13 == 6:
+                submission["auto_lower_hub"] += 1
+                submission["auto_upper_hub"] += 1
+        self.teams = sorted(
+            {team for match in self.matches for alliance in match["alliances"].values() for team in alliance["team_keys"]}
+        )
+        self.played_matches = 0
+
+        self.engine = engine
+        Base.metadata.drop_all(self.engine)
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+
+        self.config = Config(logger, True)
+        self.config.year = "2022"
+        self.config.event = "week0"
+        self.config.simulator_url = "http://simulator"
+        self.config.cache_dir = directory
+
+        self.http = mock.patch.object(requests.Session, "request", side_effect=self.respond)
+        self.http.start()
+        self.data_accessor = DataAccessor(self.engine, self.session, None, self.config)
+        self.data_input = DataInput(self.engine, self.session, None, self.data_accessor, self.config)
+
+    def respond(self, method, url, **kwargs):
+        """
+        Serves the matches and teams like EventSimulator, with the matches that weren't played yet zeroed out
+        """
+        if url.endswith("/matches"):
+            body = self.matches[: self.played_matches] + [
+                {
+                    **match,
+                    "alliances": {
+                        color: {**alliance, "score": 0} for color, alliance in match["alliances"].items()
+                    },
+                    "winning_alliance": None,
+                    "time": 0,
+                    "post_result_time": 0,
+                    "actual_time": 0,
+                    "score_breakdown": {},
+                }
+                for match in self.matches[self.played_matches :]
+            ]
+        else:
+            body = self.teams
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response._content = json.dumps(body).encode()
+        response.headers = CaseInsensitiveDict(
+            {"Last-Modified": formatdate(1646000000 + self.played_matches, usegmt=True)}
+        )
+        return response
+
+    def add_submission(self, submission):
+        self.data_accessor.add_team_datum(
+            team_id=submission["team_number"],
+            scout_id=submission["scout_id"],
+            match_id=submission["match_key"],
+            alliance=Alliance(submission["alliance"]),
+            driver_station=submission["driver_station"],
+            team_datum_json=team_datum_json_from_submission(submission),
+        )
+
+    def play(self, played_matches):
+        """
+        Scouts the matches up to played_matches and ingests their results
+        """
+        for match in self.matches[self.played_matches : played_matches]:
+            for submission in self.submissions[match["key"]]:
+                self.add_submission(submission)
+        self.played_matches = played_matches
+        self.data_input.get_tba_data()
+        self.session.commit()
+
+    def close(self):
+        self.http.stop()
+        self.session.close()
+        self.engine.dispose()
+
+
+@pytest.fixture
+def simulated_event(tmp_path):
+    # Runs against a MySQL database when one is given, it is wiped first
+    if os.getenv("TEST_DATABASE_URL"):
+        engine = create_engine(os.getenv("TEST_DATABASE_URL"))
+    else:
+        engine = create_sqlite_engine(f"sqlite:///{tmp_path / 'scouting.db'}")
+    event = SimulatedEvent(engine, str(tmp_path))
+    yield event
+    event.close()
@@ -0,0 +1,82 @@
+from collections import namedtuple
+
+import pandas as pd
+
+from AllianceIncidence import AllianceIncidence
+from SQLObjects import Alliance
+
+Association = namedtuple("Association", ["id", "match_id", "alliance", "team_id", "driver_station"])
+
+associations = [
+    Association(1, "2022week0_qm1", Alliance.red, "frc4099", 2),
+    Association(2, "2022week0_qm1", Alliance.red, "frc612", 1),
+    Association(3, "2022week0_qm1", Alliance.blue, "frc2363", 1),
+    Association(4, "2022week0_qm2", Alliance.red, "frc612", 3),
+    # An empty driver station
+    Association(5, "2022week0_qm2", Alliance.blue, None, 1),
+    Association(6, "2022week0_qm2", Alliance.blue, "frc4099", 2),
+]
+
+
+def test_matrix_holds_driver_stations():
+    incidence = AllianceIncidence()
+    assert incidence.add_associations(associations) == 5
+
+    matrix = incidence.get_matrix().toarray()
+
+    assert incidence.team_ids == ["frc4099", "frc612", "frc2363"]
+    assert incidence.alliance_keys == [
+        ("2022week0_qm1", Alliance.red),
+        ("2022week0_qm1", Alliance.blue),
+        ("2022week0_qm2", Alliance.red),
+        ("2022week0_qm2", Alliance.blue),
+    ]
+    assert matrix.tolist() == [[2, 1, 0], [0, 0, 1], [0, 3, 0], [2, 0, 0]]
+
+
+def test_teams_are_in_driver_station_order():
+    incidence = AllianceIncidence()
+    incidence.add_associations(associations)
+
+    row = incidence.alliance_index[("2022week0_qm1", Alliance.red)]
+
+    assert incidence.get_teams(row) == ["frc612", "frc4099"]
+
+
+def test_associations_are_only_added_once():
+    incidence = AllianceIncidence()
+    incidence.add_associations(associations[:3])
+    frame = incidence.to_frame()
+
+    # Later refreshes pass every association again
+    assert incidence.add_associations(associations) == 2
+    assert incidence.add_associations(associations) == 0
+    assert incidence.last_id == 6
+    assert len(frame.index) == 3
+    assert len(incidence.to_frame().index) == 5
+
+
+def test_to_frame():
+    incidence = AllianceIncidence()
+    incidence.add_associations(associations)
+
+    frame = incidence.to_frame().sort_values(["match_id", "alliance", "driver_station"], key=lambda column: column.map(str))
+
+    expected = pd.DataFrame(
+        [
+            (association.match_id, association.alliance, association.driver_station, association.team_id)
+            for association in associations
+            if association.team_id
+        ],
+        columns=["match_id", "alliance", "driver_station", "team_id"],
+    ).sort_values(["match_id", "alliance", "driver_station"], key=lambda column: column.map(str))
+    pd.testing.assert_frame_equal(frame.reset_index(drop=True), expected.reset_index(drop=True))
+
+
+def test_schedule_matches_tba(simulated_event):
+    incidence = simulated_event.data_accessor.get_alliance_incidence()
+
+    for match in simulated_event.matches:
+        for color, alliance in match["alliances"].items():
+            row = incidence.alliance_index[(match["key"], Alliance(color))]
+            assert incidence.get_teams(row) == alliance["team_keys"]
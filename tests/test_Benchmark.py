@@ -0,0 +1,12 @@
+from Benchmark import check_query_plans
+
+
+def test_query_plans_are_captured_for_every_lookup_with_warm_caches(simulated_event):
+    simulated_event.play(6)
+    data_accessor = simulated_event.data_accessor
+    data_accessor.get_all_team_data_df(simulated_event.matches[0]["event_key"])
+    data_accessor.get_all_match_data_df(simulated_event.matches[0]["event_key"])
+
+    plans = check_query_plans(simulated_event.engine, data_accessor)
+
+    assert all(plans.values())
@@ -0,0 +1,105 @@
+import copy
+
+import pytest
+from loguru import logger
+from sqlalchemy.exc import IntegrityError
+
+from Config import Config
+from SQLObjects import Alliance, CalculatedTeamDatum, MatchDatum
+
+
+def rescore(match, points):
+    """
+    Copies a TBA match with points added to red's total, like TBA does when a match is re-scored
+    """
+    match = copy.deepcopy(match)
+    match["alliances"]["red"]["score"] += points
+    match["score_breakdown"]["red"]["totalPoints"] += points
+    return match
+
+
+def get_match_datum(simulated_event, match_id):
+    simulated_event.session.expire_all()
+    return simulated_event.session.query(MatchDatum).filter(MatchDatum.match_id == match_id).one()
+
+
+def test_rescored_match_is_updated_in_place(simulated_event):
+    simulated_event.play(3)
+    match = simulated_event.matches[0]
+    total_points = get_match_datum(simulated_event, match["key"]).r_total_points
+
+    simulated_event.data_accessor.add_match_data([rescore(match, 6)])
+    simulated_event.session.commit()
+
+    assert get_match_datum(simulated_event, match["key"]).r_total_points == total_points + 6
+    assert simulated_event.session.query(MatchDatum).count() == 3
+
+
+def test_last_of_a_batch_wins(simulated_event):
+    match = simulated_event.matches[0]
+
+    simulated_event.data_accessor.add_match_data([rescore(match, 1), rescore(match, 2)])
+    simulated_event.session.commit()
+
+    assert get_match_datum(simulated_event, match["key"]).r_total_points == match["score_breakdown"]["red"]["totalPoints"] + 2
+
+
+def test_unscheduled_matches_are_skipped(simulated_event):
+    match = {**simulated_event.matches[0], "key": "2022week0_qm99"}
+
+    simulated_event.data_accessor.add_match_data([match])
+    simulated_event.session.commit()
+
+    assert simulated_event.session.query(MatchDatum).count() == 0
+
+
+def test_match_data_read_before_commit_is_not_cached_as_current(simulated_event):
+    data_accessor = simulated_event.data_accessor
+    match = simulated_event.matches[0]
+
+    data_accessor.add_match_data([match])
+    # Read on another connection, which can't see the write yet
+    assert data_accessor.get_all_match_data_df().empty
+    simulated_event.session.commit()
+
+    assert list(data_accessor.get_all_match_data_df()["match_id"]) == [match["key"]]
+
+
+def test_rolled_back_writes_do_not_change_the_data_version(simulated_event):
+    data_accessor = simulated_event.data_accessor
+    version = data_accessor.data_versions[MatchDatum.__tablename__]
+
+    data_accessor.add_match_data([simulated_event.matches[0]])
+    simulated_event.session.rollback()
+    simulated_event.session.commit()
+
+    assert data_accessor.data_versions[MatchDatum.__tablename__] == version
+
+
+def test_calculated_team_data_is_updated_in_place(simulated_event):
+    data_accessor = simulated_event.data_accessor
+    team_id = simulated_event.teams[0]
+
+    data_accessor.add_calculated_team_data({team_id: {"auto_lower_hub_avg": 1.5, "comments": "Nqm1: "}})
+    data_accessor.add_calculated_team_data({team_id: {"auto_lower_hub_avg": 2.5, "comments": "Nqm1: Nqm2: "}})
+    simulated_event.session.commit()
+
+    calculated_team_data = simulated_event.session.query(CalculatedTeamDatum).all()
+    assert [(row.team_id, row.auto_lower_hub_avg, row.comments) for row in calculated_team_data] == [
+        (team_id, 2.5, "Nqm1: Nqm2: ")
+    ]
+
+
+def test_other_constraint_violations_still_raise(simulated_event):
+    warning = {"match_id": simulated_event.matches[0]["key"], "category": "Test", "content": "Test"}
+    simulated_event.data_accessor.add_warnings([{**warning, "alliance": Alliance.red}])
+
+    with pytest.raises(IntegrityError):
+        simulated_event.data_accessor.add_warnings([{**warning, "alliance": "green"}])
+
+
+def test_in_memory_sqlite_is_refused(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "sqlite://")
+
+    with pytest.raises(ValueError):
+        Config(logger, True).get_engine()
@@ -0,0 +1,149 @@
+import numpy
+import pandas as pd
+from scipy.sparse.linalg import lsmr
+from sklearn.preprocessing import MultiLabelBinarizer
+from sqlalchemy import select
+
+from DataCalculator import DataCalculator
+from SQLObjects import CalculatedTeamDatum, ClimbType, MatchDatum
+
+shooting_zone_columns = ["from_fender", "from_elsewhere_in_tarmac", "from_launchpad", "from_terminal", "from_hangar_zone", "from_elsewhere_on_field"]
+attempted_columns = ["attempted_low", "attempted_mid", "attempted_high", "attempted_traversal"]
+
+
+def reference_team_data(team_data, team_list):
+    """
+
+    The CalculatedTeamDatum columns as DataCalculator calculated them before the metrics were aggregated in
+    one pass, with one merge onto the team list per metric.
+
+    :param team_data: All TeamData
+    :type team_data: pandas.DataFrame
+    :param team_list: All Teams
+    :type team_list: pandas.DataFrame
+    :return: A Dataframe of CalculatedTeamDatum columns indexed by team
+    :rtype: pandas.DataFrame
+    """
+
+    def by_team(calculated, column):
+        return team_list.merge(
+            calculated.rename(column), how="outer", left_on="id", right_index=True
+        ).set_index("id")
+
+    dfs = []
+    for col in ["auto_lower_hub", "auto_upper_hub", "auto_misses", "teleop_lower_hub", "teleop_upper_hub", "teleop_misses"]:
+        dfs.append(by_team(team_data.groupby("team_id")[col].mean(), f"{col}_avg"))
+        dfs.append(by_team(team_data[["team_id", col]].dropna().groupby("team_id")[col].median(), f"{col}_med"))
+    for rung in ["low", "mid", "high", "traversal"]:
+        col, filter_col = f"{rung}_rung_climb_time", f"attempted_{rung}"
+        filtered = team_data[["team_id", col, filter_col]].dropna()
+        filtered = filtered[filtered[filter_col].astype(bool)]
+        times = filtered[col].astype(float).groupby(filtered["team_id"])
+        dfs.append(by_team(times.mean(), f"{col}_avg"))
+        dfs.append(by_team(times.median(), f"{col}_med"))
+
+    for cols in [shooting_zone_columns, [f"auto_{col}" for col in shooting_zone_columns], attempted_columns]:
+        counts = team_data[[*cols, "team_id"]].replace({True: 1, False: 0}).dropna()
+        for col in cols:
+            dfs.append(by_team(counts[col].astype(float).groupby(counts["team_id"]).mean(), f"{col}_usage"))
+
+    climbs = team_data[["final_climb_type", "team_id"]].dropna()
+    for climb_type, column in [
+        (ClimbType.traversal, "traversal_rung_pct"),
+        (ClimbType.high, "high_rung_pct"),
+        (ClimbType.mid, "mid_rung_pct"),
+        (ClimbType.low, "low_rung_pct"),
+        (ClimbType.none, "none_pct"),
+    ]:
+        dfs.append(by_team((climbs["final_climb_type"] == climb_type).astype(float).groupby(climbs["team_id"]).mean(), column))
+
+    shots = team_data[["teleop_upper_hub", "teleop_lower_hub", "teleop_misses", "team_id"]].dropna().groupby("team_id").sum()
+    shots["Sum"] = shots.sum(axis=1)
+    for col, column in [("teleop_upper_hub", "teleop_upper_hub_pct"), ("teleop_lower_hub", "teleop_lower_hub_pct"), ("teleop_misses", "teleop_miss_pct")]:
+        dfs.append(by_team(shots[col] / shots["Sum"], column))
+
+    stripped_match_id = team_data["match_id"].apply(lambda x: x[x.index("_") + 1 :])
+    comments = (
+        "N"
+        + stripped_match_id
+        + ": "
+        + team_data["notes"].astype(str)
+        + ","
+        + team_data["teleop_notes"].astype(str)
+        + ", "
+        + team_data["auto_notes"].astype(str)
+    )
+    dfs.append(by_team(comments.groupby(team_data["team_id"]).agg("".join), "comments"))
+
+    return dfs[0].join(dfs[1:])
+
+
+def reference_opr(session, matches, metric):
+    """
+    OPR as DataCalculator calculated it before the normal equations were kept, with lsmr on the whole schedule
+    """
+    scores = {
+        match.match_id: {"red": getattr(match, f"r_{metric}"), "blue": getattr(match, f"b_{metric}")}
+        for match in session.query(MatchDatum)
+    }
+    alliances = [
+        [alliance["team_keys"], scores[match["key"]][color]]
+        for match in matches
+        if match["key"] in scores
+        for color, alliance in match["alliances"].items()
+    ]
+    assembled_data = pd.DataFrame(alliances, columns=["teams", "metricdata"])
+    mlb = MultiLabelBinarizer(sparse_output=True)
+    sparse_teams = mlb.fit_transform(assembled_data["teams"])
+    oprs = lsmr(sparse_teams, assembled_data["metricdata"].astype(float).to_numpy(), atol=1e-12, btol=1e-12)
+    return pd.Series(oprs[0], index=mlb.classes_)
+
+
+def stored_team_data(engine):
+    return (
+        pd.read_sql_query(select([CalculatedTeamDatum.__table__]), engine)
+        .drop(columns=["id"])
+        .set_index("team_id")
+        .sort_index()
+    )
+
+
+def assert_matches_reference(simulated_event):
+    expected = reference_team_data(
+        simulated_event.data_accessor.get_all_team_data_df(), simulated_event.data_accessor.get_all_teams_df()
+    ).sort_index()
+    stored = stored_team_data(simulated_event.engine)
+    assert len(expected.index) == len(simulated_event.teams)
+    pd.testing.assert_frame_equal(
+        stored[expected.columns], expected, check_dtype=False, check_names=False
+    )
+
+
+def test_calculate_team_data_matches_reference(simulated_event):
+    simulated_event.play(len(simulated_event.matches))
+
+    DataCalculator(simulated_event.engine, simulated_event.session, None, simulated_event.data_accessor, simulated_event.config).calculate_team_data(full=True)
+
+    assert_matches_reference(simulated_event)
+
+
+def test_incremental_calculate_team_data_matches_reference(simulated_event):
+    data_calculator = DataCalculator(simulated_event.engine, simulated_event.session, None, simulated_event.data_accessor, simulated_event.config)
+    # The first matches leave some teams without TeamData, which still get a row
+    for played_matches, full in [(1, True), (6, False), (len(simulated_event.matches), False)]:
+        simulated_event.play(played_matches)
+        data_calculator.calculate_team_data(full=full)
+
+        assert_matches_reference(simulated_event)
+
+
+def test_calculate_opr_matches_reference(simulated_event):
+    data_calculator = DataCalculator(simulated_event.engine, simulated_event.session, None, simulated_event.data_accessor, simulated_event.config)
+    # Fed a few matches at a time, like the refreshes during an event
+    for played_matches in [8, 12, len(simulated_event.matches)]:
+        simulated_event.play(played_matches)
+        oprs = data_calculator.calculate_opr("total_points")["total_points_opr"]
+
+    expected = reference_opr(simulated_event.session, simulated_event.matches, "total_points")
+    numpy.testing.assert_allclose(oprs.sort_index().to_numpy(), expected.sort_index().to_numpy(), atol=1e-6)
+    assert sorted(oprs.index) == sorted(expected.index)
@@ -0,0 +1,31 @@
+import importlib
+import sys
+
+import pytest
+
+
+@pytest.fixture
+def dashboard(simulated_event, monkeypatch):
+    # The dashboard connects when it is imported, so import it fresh against the test database
+    monkeypatch.setenv("DATABASE_URL", str(simulated_event.engine.url))
+    monkeypatch.delitem(sys.modules, "DataDashboard", raising=False)
+    DataDashboard = importlib.import_module("DataDashboard")
+    yield DataDashboard
+    DataDashboard.data_accessor.session.close()
+    DataDashboard.connection.close()
+    DataDashboard.engine.dispose()
+
+
+def test_match_data_is_served_after_a_failed_write(simulated_event, dashboard):
+    simulated_event.play(3)
+    client = dashboard.app.test_client()
+    match = simulated_event.matches[3]
+    submission = dict(simulated_event.submissions[match["key"]][0])
+    # Sent as the value instead of the enum name the column stores, so the insert fails
+    submission["defense_time"] = "most of the time"
+
+    assert client.post("/api/add_team_datum", json=submission).status_code == 500
+
+    response = client.get("/api/get_match_data")
+    assert response.status_code == 200
+    assert set(response.get_json()) == {match["key"] for match in simulated_event.matches[:3]}
@@ -0,0 +1,65 @@
+import os
+from unittest import mock
+
+import pyarrow
+import pytest
+
+from DataExporter import DataExporter
+from SQLObjects import MatchDatum, TeamDatum
+
+
+def read_snapshot(path):
+    with pyarrow.memory_map(path) as source:
+        return pyarrow.ipc.open_file(source).read_all()
+
+
+@pytest.fixture
+def data_exporter(simulated_event, tmp_path):
+    simulated_event.play(4)
+    return DataExporter(simulated_event.data_accessor, str(tmp_path / "snapshots"))
+
+
+def test_snapshots_hold_the_tables(simulated_event, data_exporter):
+    assert sorted(data_exporter.export()) == ["calculated_team_data", "match_data", "team_data"]
+
+    team_data = read_snapshot(data_exporter.path(TeamDatum))
+    assert team_data.num_rows == 4 * 6
+    assert int(team_data.schema.metadata[b"data_version"]) == simulated_event.data_accessor.data_versions["team_data"]
+    # Enums are stored by name, like the database does
+    assert set(team_data.column("alliance").to_pylist()) == {"red", "blue"}
+    assert read_snapshot(data_exporter.path(MatchDatum)).num_rows == 4
+    assert not [name for name in os.listdir(data_exporter.directory) if name.endswith(".tmp")]
+
+
+def test_only_changed_tables_are_written(simulated_event, data_exporter):
+    data_exporter.export()
+
+    assert data_exporter.export() == []
+    simulated_event.play(5)
+    assert sorted(data_exporter.export()) == ["match_data", "team_data"]
+
+
+def test_open_snapshots_keep_their_data(simulated_event, data_exporter):
+    data_exporter.export()
+    with pyarrow.memory_map(data_exporter.path(TeamDatum)) as source:
+        reader = pyarrow.ipc.open_file(source)
+
+        simulated_event.play(5)
+        data_exporter.export()
+
+        # The new snapshot replaced the file, the one already open is untouched
+        assert reader.read_all().num_rows == 4 * 6
+    assert read_snapshot(data_exporter.path(TeamDatum)).num_rows == 5 * 6
+
+
+def test_failed_replace_keeps_the_old_snapshot(simulated_event, data_exporter):
+    data_exporter.export()
+    simulated_event.play(5)
+
+    with mock.patch("DataExporter.os.replace", side_effect=PermissionError("in use")):
+        assert data_exporter.export() == []
+    assert read_snapshot(data_exporter.path(TeamDatum)).num_rows == 4 * 6
+
+    # Tried again on the next export
+    assert sorted(data_exporter.export()) == ["match_data", "team_data"]
+    assert read_snapshot(data_exporter.path(TeamDatum)).num_rows == 5 * 6
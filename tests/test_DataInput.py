@@ -0,0 +1,38 @@
+import json
+import threading
+
+from DataInput import DataInput
+
+
+def test_only_matches_posted_after_the_last_one_are_parsed(simulated_event):
+    data_input = simulated_event.data_input
+    played = [match for match in simulated_event.matches if match["post_result_time"]]
+    data_input.last_tba_time = played[5]["post_result_time"]
+    unplayed = {**played[0], "key": "2022week0_qm99", "post_result_time": None, "score_breakdown": None}
+    content = json.dumps([unplayed] + list(reversed(simulated_event.matches))).encode()
+
+    assert data_input.parse_new_matches(content) == played[6:]
+
+
+def test_matches_of_other_events_are_skipped(simulated_event):
+    data_input = simulated_event.data_input
+    match = simulated_event.matches[0]
+    other_event_match = {**match, "key": "2022week1_qm1", "event_key": "2022week1"}
+    content = json.dumps([other_event_match, match]).encode()
+
+    assert data_input.parse_new_matches(content) == [match]
+
+
+def test_loading_leaves_no_threads_behind(simulated_event):
+    threads = set(threading.enumerate())
+
+    # Loads the schedule with fetch_all
+    DataInput(
+        simulated_event.engine,
+        simulated_event.session,
+        None,
+        simulated_event.data_accessor,
+        simulated_event.config,
+    )
+
+    assert set(threading.enumerate()) <= threads
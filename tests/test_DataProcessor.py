@@ -0,0 +1,162 @@
+import re
+
+import pandas as pd
+from sqlalchemy import select
+
+from DataProcessor import DataProcessor
+from SQLObjects import Alliance, ClimbType, MatchDatum, TeamDatum, Warning
+
+lower_auto = ["auto_cargo_lower_near", "auto_cargo_lower_far", "auto_cargo_lower_blue", "auto_cargo_lower_red"]
+upper_auto = ["auto_cargo_upper_near", "auto_cargo_upper_far", "auto_cargo_upper_blue", "auto_cargo_upper_red"]
+lower_teleop = ["teleop_cargo_lower_near", "teleop_cargo_lower_far", "teleop_cargo_lower_blue", "teleop_cargo_lower_red"]
+upper_teleop = ["teleop_cargo_upper_near", "teleop_cargo_upper_far", "teleop_cargo_upper_blue", "teleop_cargo_upper_red"]
+
+
+def get(obj, metric, default=None):
+    res = getattr(obj, metric, default)
+    if default is not None and res is None:
+        return default
+    return res
+
+
+def reference_warnings(session, error_condition):
+    """
+
+    The checks as DataProcessor ran them before they were vectorized, one ORM object at a time.
+
+    Like add_warning did then, only the first warning of a match, alliance and category is kept.
+
+    :return: The warnings by match, alliance and category
+    :rtype: Dict[Tuple[str, Alliance, str], str]
+    """
+    clean_tags = re.compile("<.*?>")
+    warnings = {}
+
+    def add_warning(match_id, alliance, category, content):
+        warnings.setdefault((match_id, alliance, category), re.sub(clean_tags, "", content))
+
+    team_data = session.query(TeamDatum).order_by(TeamDatum.id).all()
+    match_data = session.query(MatchDatum).order_by(MatchDatum.id).all()
+    # Robots by match, alliance and driver station. This used to be indexed by match number, which
+    # failed on TeamData of matches TBA doesn't have, so those are left out
+    alliance_data = {match.match_id: [[None, None, None], [None, None, None]] for match in match_data}
+    for team_datum in team_data:
+        if team_datum.match_id in alliance_data:
+            alliance_data[team_datum.match_id][0 if team_datum.alliance == Alliance.red else 1][
+                team_datum.driver_station - 1
+            ] = team_datum
+
+    for team_datum in team_data:
+        if not re.search(r"2022[a-z]{4,5}_(qm|sf|qf|f)\d{1,2}(m\d{1})*", get(team_datum, "match_id", "")):
+            add_warning(
+                get(team_datum, "match_id", ""),
+                Alliance.red,
+                "Match Key Violations",
+                f"Match Key in TeamData with id {team_datum.id} is not a proper key",
+            )
+
+    for category, team_metrics, match_metrics in [
+        ("Auto Cargo Lower Hub Violations", ["auto_lower_hub"], lower_auto),
+        ("Auto Cargo Upper Hub Violations", ["auto_upper_hub"], upper_auto),
+        ("Teleop Cargo Lower Hub Violations", ["teleop_lower_hub"], lower_teleop),
+        ("Teleop Cargo Upper Hub Violations", ["teleop_upper_hub"], upper_teleop),
+    ]:
+        for match in match_data:
+            alliances = alliance_data[match.match_id]
+            for robots, color in zip(alliances, ["red", "blue"]):
+                alliance_sum = sum(get(team, metric, 0) for team in robots for metric in team_metrics)
+                match_sum = sum(get(match, f"{color[0]}_{metric}", 0) for metric in match_metrics)
+                if abs(alliance_sum - match_sum) > error_condition:
+                    add_warning(
+                        match.match_id,
+                        Alliance(color),
+                        category,
+                        f'Sum of the {", ".join(team_metrics)} columns (<d><green>{alliance_sum}</></>) '
+                        f'does not equal the sum of the TBA columns {", ".join(match_metrics)} (<d><green>{match_sum}</></>)',
+                    )
+
+    for match in match_data:
+        for robots, color in zip(alliance_data[match.match_id], ["red", "blue"]):
+            for team, metric in zip(robots, ["endgame_1", "endgame_2", "endgame_3"]):
+                team_val = get(team, "final_climb_type", ClimbType.none)
+                tba_val = get(match, f"{color[0]}_{metric}", ClimbType.none)
+                if team_val != tba_val:
+                    add_warning(
+                        match.match_id,
+                        Alliance(color),
+                        "Endgame Status Violations",
+                        f"{team.id}'s endgame status is recorded as <d><blue>{team_val.value}</></> "
+                        f"while TBA has it as <d><blue>{tba_val.value}</></>",
+                    )
+    return warnings
+
+
+def stored_warnings(engine):
+    warnings = pd.read_sql_query(select([Warning.match_id, Warning.alliance, Warning.category, Warning.content]), engine)
+    return {
+        (row.match_id, Alliance(row.alliance), row.category): row.content
+        for row in warnings.itertuples()
+    }
+
+
+def test_check_data_matches_reference(simulated_event):
+    simulated_event.play(len(simulated_event.matches))
+
+    # Without a tolerance every sum check has something to warn about
+    DataProcessor(simulated_event.data_accessor, simulated_event.config, err_cond=0).check_data()
+    simulated_event.session.commit()
+
+    expected = reference_warnings(simulated_event.session, 0)
+    assert {category for match_id, alliance, category in expected} == {
+        "Match Key Violations",
+        "Auto Cargo Lower Hub Violations",
+        "Auto Cargo Upper Hub Violations",
+        "Teleop Cargo Lower Hub Violations",
+        "Teleop Cargo Upper Hub Violations",
+        "Endgame Status Violations",
+    }
+    assert stored_warnings(simulated_event.engine) == expected
+
+
+def test_check_data_after_more_matches_matches_reference(simulated_event):
+    data_processor = DataProcessor(simulated_event.data_accessor, simulated_event.config)
+    for played_matches in [6, len(simulated_event.matches)]:
+        simulated_event.play(played_matches)
+        data_processor.check_data()
+        simulated_event.session.commit()
+
+    assert stored_warnings(simulated_event.engine) == reference_warnings(simulated_event.session, 2)
+
+
+def test_add_warnings_keeps_ignore(simulated_event):
+    simulated_event.play(1)
+    match_id = simulated_event.matches[0]["key"]
+    data_accessor = simulated_event.data_accessor
+
+    data_accessor.add_warnings(
+        [
+            {"match_id": match_id, "alliance": Alliance.red, "category": "Test", "content": "first"},
+            {"match_id": match_id, "alliance": Alliance.red, "category": "Test", "content": "second"},
+            {"match_id": match_id, "alliance": Alliance.blue, "category": "Test", "content": "blue", "ignore": True},
+        ]
+    )
+    simulated_event.session.commit()
+    warning = data_accessor.get_warnings(match_id, Alliance.red, "Test")[0]
+    assert (warning.content, warning.ignore) == ("first", False)
+
+    warning.ignore = True
+    simulated_event.session.commit()
+    data_accessor.add_warnings(
+        [
+            {"match_id": match_id, "alliance": Alliance.red, "category": "Test", "content": "raised again"},
+            {"match_id": match_id, "alliance": Alliance.blue, "category": "Test", "content": "blue again"},
+        ]
+    )
+    simulated_event.session.commit()
+    simulated_event.session.expire_all()
+
+    warnings = {
+        warning.alliance: (warning.content, warning.ignore)
+        for warning in simulated_event.session.query(Warning).filter(Warning.category == "Test")
+    }
+    assert warnings == {Alliance.red: ("raised again", True), Alliance.blue: ("blue again", True)}
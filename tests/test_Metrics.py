@@ -0,0 +1,87 @@
+import json
+import threading
+
+from Metrics import MetricsRecorder, prometheus_text
+
+
+def record_refresh(recorder, stages):
+    """
+    Records a refresh that ran each (name, rows) stage in stages
+    """
+    refresh = recorder.start_refresh()
+    for name, rows in stages:
+        with recorder.stage(name, rows=rows):
+            pass
+    recorder.finish_refresh(refresh)
+    return refresh
+
+
+def test_stages_with_the_same_name_are_added_together():
+    recorder = MetricsRecorder()
+    refresh = record_refresh(recorder, [("get_data", 3), ("check_data", 0), ("get_data", 4)])
+
+    assert refresh["stages"]["get_data"]["count"] == 2
+    assert refresh["stages"]["get_data"]["rows"] == 7
+    assert set(refresh["stages"]) == {"get_data", "check_data"}
+
+
+def test_worker_threads_record_into_the_refresh():
+    recorder = MetricsRecorder()
+    refresh = recorder.start_refresh()
+
+    def work():
+        with recorder.use_refresh(refresh):
+            with recorder.stage("calculate_data"):
+                recorder.count_rows(5)
+
+    worker = threading.Thread(target=work)
+    worker.start()
+    worker.join()
+    recorder.finish_refresh(refresh)
+
+    assert refresh["stages"]["calculate_data"]["rows"] == 5
+
+
+def test_only_the_last_refreshes_are_kept():
+    recorder = MetricsRecorder(size=2)
+    for rows in [1, 2, 3]:
+        record_refresh(recorder, [("get_data", rows)])
+
+    refreshes = json.loads(recorder.to_json())
+
+    assert [refresh["stages"]["get_data"]["rows"] for refresh in refreshes] == [2, 3]
+
+
+def test_prometheus_text_without_refreshes():
+    assert prometheus_text([]).splitlines()[-1] == "scouting_refreshes_recorded 0"
+
+
+def test_prometheus_text():
+    recorder = MetricsRecorder()
+    record_refresh(recorder, [("get_data", 2)])
+    last = record_refresh(recorder, [("get_data", 3), ('check "Endgame"\n', 0)])
+
+    lines = prometheus_text(json.loads(recorder.to_json())).splitlines()
+
+    assert "scouting_refreshes_recorded 2" in lines
+    assert f"scouting_last_refresh_duration_seconds {last['seconds']}" in lines
+    assert 'scouting_stage_last_rows{stage="get_data"} 3' in lines
+    assert 'scouting_stage_last_rows{stage="check \\"Endgame\\"\\n"} 0' in lines
+    assert 'scouting_stage_duration_seconds_count{stage="get_data"} 2' in lines
+    assert 'scouting_stage_duration_seconds_count{stage="check \\"Endgame\\"\\n"} 1' in lines
+    # Every sample has a TYPE line before it
+    types = {line.split()[2] for line in lines if line.startswith("# TYPE")}
+    for line in lines:
+        if not line.startswith("#"):
+            name = line.split("{")[0].split()[0]
+            assert name in types or name.rsplit("_", 1)[0] in types
+
+
+def test_prometheus_text_reports_failed_stages():
+    recorder = MetricsRecorder()
+    refresh = record_refresh(recorder, [("check_data", 0)])
+    refresh["failed_stages"].append("check_data")
+
+    lines = prometheus_text(json.loads(recorder.to_json())).splitlines()
+
+    assert "scouting_last_refresh_failed_stages 1" in lines
@@ -0,0 +1,131 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from ResponseCache import ResponseCache
+
+url = "https://www.thebluealliance.com/api/v3/event/2022week0/matches"
+
+
+class FakeSession:
+    """Answers every request with the next queued response and records the headers sent"""
+
+    def __init__(self):
+        self.responses = []
+        self.sent_headers = []
+
+    def queue(self, status_code, content=b"", **headers):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = content
+        response.headers = CaseInsensitiveDict(headers)
+        self.responses.append(response)
+
+    def get(self, url, headers=None):
+        self.sent_headers.append(headers or {})
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def http():
+    return FakeSession()
+
+
+@pytest.fixture
+def cache(http, tmp_path):
+    return ResponseCache(http, str(tmp_path))
+
+
+def test_unchanged_response_is_served_from_disk(http, cache):
+    http.queue(200, b'[{"key": "2022week0_qm1"}]', ETag='"1"')
+    http.queue(304)
+
+    first = cache.get(url)
+    second = cache.get(url)
+
+    assert (first.status_code, first.validator, first.from_cache) == (200, '"1"', False)
+    assert http.sent_headers[1]["If-None-Match"] == '"1"'
+    assert (second.status_code, second.validator, second.from_cache) == (304, '"1"', True)
+    assert second.json() == [{"key": "2022week0_qm1"}]
+
+
+def test_changed_response_replaces_the_stored_one(http, cache):
+    http.queue(200, b"[1]", **{"Last-Modified": "Sat, 26 Feb 2022 22:00:00 GMT"})
+    http.queue(200, b"[1, 2]", **{"Last-Modified": "Sat, 26 Feb 2022 22:10:00 GMT"})
+    http.queue(304)
+
+    cache.get(url)
+    cache.get(url)
+    third = cache.get(url)
+
+    assert http.sent_headers[2]["If-Modified-Since"] == "Sat, 26 Feb 2022 22:10:00 GMT"
+    assert third.json() == [1, 2]
+    assert not [name for name in os.listdir(cache.directory) if name.endswith(".tmp")]
+
+
+def test_body_is_not_read_when_only_the_validator_is_needed(http, cache):
+    http.queue(200, b"[1]", ETag='"1"')
+    http.queue(304)
+
+    cache.get(url)
+    response = cache.get(url, load_body=False)
+
+    assert (response.status_code, response.validator, response.content) == (304, '"1"', None)
+
+
+@pytest.mark.parametrize("damage", ["corrupt", "missing"])
+def test_damaged_body_is_requested_again(http, cache, damage):
+    http.queue(200, b"[1]", ETag='"1"')
+    http.queue(200, b"[1]", ETag='"1"')
+
+    cache.get(url)
+    _, body_path = cache.paths(url)
+    if damage == "corrupt":
+        with open(body_path, "wb") as f:
+            f.write(b"not gzip")
+    else:
+        os.remove(body_path)
+    response = cache.get(url)
+
+    # Without the validators the server can't answer 304 for a body that is gone
+    assert "If-None-Match" not in http.sent_headers[1]
+    assert (response.status_code, response.json()) == (200, [1])
+    assert cache.load_body(url) == b"[1]"
+
+
+def test_concurrent_stores_of_a_url_keep_a_matching_body(cache):
+    def store(version):
+        cache.store(url, {"etag": f'"{version}"', "last_modified": None}, f"[{version}]".encode())
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(store, range(200)))
+
+    assert cache.load_body(url) == f"[{cache.load_metadata(url)['etag'][1:-1]}]".encode()
+    assert not [name for name in os.listdir(cache.directory) if name.endswith(".tmp")]
+
+
+def test_responses_without_validators_are_not_stored(http, cache):
+    http.queue(200, b"[1]")
+    http.queue(200, b"[1]")
+
+    cache.get(url)
+    cache.get(url)
+
+    assert cache.load_metadata(url) is None
+    assert "If-None-Match" not in http.sent_headers[1]
+
+
+def test_errors_are_not_stored(http, cache):
+    http.queue(200, b"[1]", ETag='"1"')
+    http.queue(500)
+    http.queue(304)
+
+    cache.get(url)
+    error = cache.get(url)
+    response = cache.get(url)
+
+    assert (error.status_code, error.content) == (500, None)
+    assert (response.status_code, response.json()) == (304, [1])
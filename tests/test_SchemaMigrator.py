@@ -0,0 +1,127 @@
+import pytest
+from sqlalchemy import Column, MetaData, Table, inspect
+
+from Config import create_sqlite_engine
+from SchemaMigrator import SchemaMigrator
+from SQLObjects import Alliance, Base, CompLevel, Match, MatchDatum, TeamDatum, Warning
+
+
+def create_old_table(engine, table, missing_columns=()):
+    """
+    Replaces a table with one like older versions made, without its unique keys, indexes and missing_columns
+    """
+    table.drop(engine)
+    Table(
+        table.name,
+        MetaData(),
+        *[
+            Column(column.name, column.type, primary_key=column.primary_key)
+            for column in table.columns
+            if column.name not in missing_columns
+        ],
+    ).create(engine)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_sqlite_engine(f"sqlite:///{tmp_path / 'scouting.db'}")
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(
+            Match.__table__.insert(),
+            [
+                {"id": f"2022week0_qm{number}", "comp_level": CompLevel.qm, "set_number": 1, "match_number": number, "event_key": "2022week0"}
+                for number in [1, 2]
+            ],
+        )
+    yield engine
+    engine.dispose()
+
+
+def stored_unique_keys(engine, table_name):
+    return SchemaMigrator(engine).get_stored_unique_keys(table_name)
+
+
+def test_duplicates_are_removed_before_the_unique_key_is_added(engine):
+    create_old_table(engine, Warning.__table__)
+    warning = {"match_id": "2022week0_qm1", "alliance": Alliance.red, "category": "Endgame Status Violations"}
+    with engine.begin() as connection:
+        connection.execute(
+            Warning.__table__.insert(),
+            [
+                {**warning, "content": "oldest", "ignore": True},
+                {**warning, "content": "older", "ignore": False},
+                {**warning, "content": "newest", "ignore": False},
+                {**warning, "alliance": Alliance.blue, "content": "blue", "ignore": False},
+                # Rows with a NULL in the key don't collide
+                {**warning, "match_id": None, "content": "no match", "ignore": False},
+                {**warning, "match_id": None, "content": "no match", "ignore": False},
+            ],
+        )
+
+    SchemaMigrator(engine).migrate()
+
+    with engine.connect() as connection:
+        rows = connection.execute(
+            Warning.__table__.select().order_by(Warning.__table__.c.id)
+        ).fetchall()
+    assert [(row.alliance, row.content, row.ignore) for row in rows] == [
+        (Alliance.red, "newest", True),
+        (Alliance.blue, "blue", False),
+        (Alliance.red, "no match", False),
+        (Alliance.red, "no match", False),
+    ]
+    assert frozenset(["match_id", "alliance", "category"]) in stored_unique_keys(engine, "warnings")
+
+
+def test_migrating_twice_changes_nothing(engine):
+    create_old_table(engine, Warning.__table__)
+    SchemaMigrator(engine).migrate()
+    unique_keys = stored_unique_keys(engine, "warnings")
+    indexes = inspect(engine).get_indexes("warnings")
+
+    SchemaMigrator(engine).migrate()
+
+    assert stored_unique_keys(engine, "warnings") == unique_keys
+    assert inspect(engine).get_indexes("warnings") == indexes
+
+
+def test_up_to_date_tables_are_left_alone(engine):
+    indexes = {table.name: inspect(engine).get_indexes(table.name) for table in Base.metadata.sorted_tables}
+
+    SchemaMigrator(engine).migrate()
+
+    assert {table.name: inspect(engine).get_indexes(table.name) for table in Base.metadata.sorted_tables} == indexes
+
+
+def test_event_key_is_added_and_filled_in_from_the_match_key(engine):
+    create_old_table(engine, TeamDatum.__table__, missing_columns=["event_key"])
+    with engine.begin() as connection:
+        connection.execute(
+            TeamDatum.__table__.insert(),
+            [
+                {"team_id": "frc4099", "match_id": "2022week0_qm1", "alliance": Alliance.red, "driver_station": 1},
+                {"team_id": "frc4099", "match_id": None, "alliance": Alliance.red, "driver_station": 1},
+            ],
+        )
+
+    SchemaMigrator(engine).migrate()
+
+    with engine.connect() as connection:
+        event_keys = connection.execute(
+            TeamDatum.__table__.select().order_by(TeamDatum.__table__.c.id)
+        ).fetchall()
+    assert [row.event_key for row in event_keys] == ["2022week0", None]
+    assert {
+        index["name"] for index in inspect(engine).get_indexes("team_data")
+    } >= {index.name for index in TeamDatum.__table__.indexes}
+
+
+def test_missing_indexes_are_created(engine):
+    create_old_table(engine, MatchDatum.__table__)
+
+    SchemaMigrator(engine).migrate()
+
+    assert {index["name"] for index in inspect(engine).get_indexes("match_data")} >= {
+        index.name for index in MatchDatum.__table__.indexes
+    }